@@ -2,9 +2,12 @@ import select
 import streamlit as st
 from streamlit_folium import st_folium
 import streamlit.components.v1 as components
+from streamlit.errors import StreamlitAPIException
 import folium
 from folium.plugins import MarkerCluster
 from folium.plugins import AntPath, MarkerCluster  # Add AntPath here
+from folium.plugins import HeatMap, VectorGridProtobuf
+from folium.template import Template
 import json
 import os
 import sys
@@ -14,11 +17,33 @@ import base64
 import logging
 from pathlib import Path
 import html
+import hashlib
 import argparse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import re
 # === NEW IMPORTS FOR GOOGLE CLOUD STORAGE ===
 import os
 from google.cloud import storage
 from google.oauth2 import service_account
+from journey_model import Journey, default_journey_dict
+from journey_storage import LocalJourneyStore, GCSJourneyStore, NO_OBJECT
+from journey_cache import JourneyCache, JourneyListCache, RenderCache
+from journey_merge import save_with_merge
+from blob_cache import DiskBlobCache
+from autosave import WriteBehindBuffer
+from journey_archive import MediaFetcher, write_archive_file, cleanup_exports
+from journey_restore import restore_upload, inspect_upload, LocalMediaSink, GCSMediaSink
+from journey_storage import WriteConflict
+from media_store import delete_media, parse_gs_ref
+from journey_analytics import journey_stats
+from trips import segment_trips, trip_path
+from heatmap import heat_points
+from tile_proxy import TileProxy, DEFAULT_UPSTREAM
+from vector_tiles import VectorTileSource
+from cache_warmer import CacheWarmer
+from shared_cache import open_shared_cache
+from journey_history import JourneyHistory, LocalHistoryFiles, GCSHistoryFiles, changes
 
 DEFAULT_ACTIVE_JSON="life_events.json"
 
@@ -45,8 +70,20 @@ if not logger.handlers:
 logger.info("🚀 App started")
 logger.info(f"Detected IS_CLOUD = {os.getenv('DEPLOY_ENV') == 'cloud'}")
 
+# ==================== JSON FILE PATH WITH ARGUMENT SUPPORT ====================
+# streamlit run app.py -- --file my_journey.json  (batch jobs: see journey_cli.py)
+parser = argparse.ArgumentParser(description="My Life Journey App")
+parser.add_argument(
+    "--file",
+    type=str,
+    default=DEFAULT_ACTIVE_JSON,
+    help=f"Path to the life events JSON file (default: {DEFAULT_ACTIVE_JSON})"
+)
+args, _ = parser.parse_known_args()
+
 if "selected_json_file" not in st.session_state:
-    st.session_state.selected_json_file = DEFAULT_ACTIVE_JSON
+    # Journeys live in the app folder (or journeys/ in GCS), so only the name counts
+    st.session_state.selected_json_file = Path(args.file).name or DEFAULT_ACTIVE_JSON
 
 if getattr(sys, 'frozen', False):
     BASE_DIR = Path(sys.executable).parent
@@ -93,13 +130,6 @@ def download_from_gcs(blob_name):
     return blob.download_as_bytes()
 
 
-def list_journey_blobs():
-    return [blob.name for blob in bucket.list_blobs(prefix=f"{JOURNEYS_FOLDER}/") if blob.name.endswith(".json")]
-
-
-def get_json_path(json_name):
-    return f"{JOURNEYS_FOLDER}/{json_name}"
-
 if IS_CLOUD:
     pass
 else:
@@ -109,6 +139,149 @@ else:
     UPLOADS_PHOTOS.mkdir(parents=True, exist_ok=True)
     UPLOADS_VIDEOS.mkdir(parents=True, exist_ok=True)
 
+# ==================== JOURNEY STORE & SHARED CACHE ====================
+JOURNEY_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Parsed journeys kept per process
+BLOB_CACHE_DIR = Path(os.getenv("BLOB_CACHE_DIR", BASE_DIR / ".blob_cache"))
+BLOB_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Journey JSON + media downloaded from GCS
+
+@st.cache_resource(show_spinner=False)
+def get_blob_cache():
+    """On-disk GCS cache, survives restarts (cloud mode only)"""
+    return DiskBlobCache(BLOB_CACHE_DIR, max_bytes=BLOB_CACHE_MAX_BYTES)
+
+blob_cache = get_blob_cache() if IS_CLOUD else None
+
+# JOURNEY_USER_FOLDERS=1 gives each logged-in user (st.login) their own journeys/users/<email>/
+# folder, so listing one user's journeys doesn't get slower as others add theirs
+JOURNEY_USER_FOLDERS = os.getenv("JOURNEY_USER_FOLDERS") == "1"
+JOURNEY_LIST_TTL = float(os.getenv("JOURNEY_LIST_TTL", "30"))  # Seconds a journey listing is reused
+JOURNEY_DATA_DIR = Path(os.getenv("JOURNEY_DATA_DIR", BASE_DIR))  # Local journeys (load_test.py points it elsewhere)
+
+def journey_user_folder():
+    """'users/<email>' for the logged-in user with per-user folders on, else ''"""
+    email = st.user.get("email") if JOURNEY_USER_FOLDERS else None
+    if not email:
+        return ""
+    return "users/" + re.sub(r"[^a-z0-9@._-]", "_", str(email).lower())
+
+user_folder = journey_user_folder()
+if IS_CLOUD:
+    journey_store = GCSJourneyStore(bucket, f"{JOURNEYS_FOLDER}/{user_folder}".rstrip("/"), blob_cache)
+else:
+    journey_store = LocalJourneyStore(JOURNEY_DATA_DIR / user_folder)
+    journey_store.base_dir.mkdir(parents=True, exist_ok=True)
+
+# SHARED_CACHE_URL=redis://host:6379/0 (or sqlite:///path/shared.sqlite3 for replicas
+# on one host) shares journeys, listings and popups between app processes and
+# tells the others when a journey is saved (shared_cache.py)
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "")
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", 512 * 1024 * 1024))  # sqlite only
+
+@st.cache_resource(show_spinner=False)
+def get_shared_cache():
+    """Connection to the cross-process cache tier, if one is configured"""
+    try:
+        kwargs = {"max_bytes": SHARED_CACHE_MAX_BYTES} if SHARED_CACHE_URL.startswith("sqlite://") else {}
+        shared = open_shared_cache(SHARED_CACHE_URL, **kwargs)
+    except Exception as e:
+        logger.error(f"❌ Shared cache unavailable, caching per process only: {e}")
+        return None
+    if shared is not None:
+        logger.info(f"🔗 Shared cache: {SHARED_CACHE_URL.split('@')[-1]}")
+    return shared
+
+shared_cache = get_shared_cache()
+
+@st.cache_resource(show_spinner=False)
+def get_journey_cache():
+    """One cache per process, shared by every session (no per-hit pickling)"""
+    return JourneyCache(max_bytes=JOURNEY_CACHE_MAX_BYTES, shared=shared_cache)
+
+journey_cache = get_journey_cache()
+
+@st.cache_resource(show_spinner=False)
+def get_journey_lists():
+    """Journey listings shared by every session, re-listed every JOURNEY_LIST_TTL seconds"""
+    return JourneyListCache(ttl=JOURNEY_LIST_TTL, shared=shared_cache)
+
+journey_lists = get_journey_lists()
+
+# Every save is kept as a version in <folder>/.history/<journey>/ (journey_history.py)
+HISTORY_MAX_CHAIN = int(os.getenv("HISTORY_MAX_CHAIN", "100"))  # Deltas between two full checkpoints at most
+HISTORY_LIST_MAX = 200  # Versions offered in the history picker
+
+@st.cache_resource(show_spinner=False)
+def get_journey_history():
+    """One history writer per process; versions are found by journey ref, whatever the folder"""
+    files = GCSHistoryFiles(bucket) if IS_CLOUD else LocalHistoryFiles()
+    return JourneyHistory(files, max_chain=HISTORY_MAX_CHAIN)
+
+journey_history = get_journey_history()
+
+# Full archives are built on disk; only ones up to this size are handed to the browser
+EXPORT_DIR = Path(os.getenv("EXPORT_DIR", BASE_DIR / ".exports"))
+ARCHIVE_DOWNLOAD_MAX_BYTES = int(os.getenv("ARCHIVE_DOWNLOAD_MAX_BYTES", 512 * 1024 * 1024))
+
+# ==================== TILE PROXY ====================
+# TILE_PROXY=1 serves map tiles through a local caching proxy (tile_proxy.py).
+# TILE_PROXY_URL is the tile URL as the *browser* sees it; set it when the
+# app is reached through anything other than localhost.
+TILE_PROXY = os.getenv("TILE_PROXY") == "1"
+TILE_PROXY_PORT = int(os.getenv("TILE_PROXY_PORT", "8765"))
+TILE_PROXY_URL = os.getenv("TILE_PROXY_URL", f"http://localhost:{TILE_PROXY_PORT}/tiles/{{z}}/{{x}}/{{y}}.png")
+TILE_UPSTREAM = os.getenv("TILE_UPSTREAM", DEFAULT_UPSTREAM)
+TILE_CACHE_DIR = Path(os.getenv("TILE_CACHE_DIR", BASE_DIR / ".tile_cache"))
+TILE_CACHE_MAX_BYTES = int(os.getenv("TILE_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+TILE_ATTRIBUTION = os.getenv("TILE_ATTRIBUTION", "&copy; OpenStreetMap contributors")
+
+@st.cache_resource(show_spinner=False)
+def get_tile_proxy():
+    """One proxy server per process, shared by every session"""
+    proxy = TileProxy(TILE_CACHE_DIR, upstream=TILE_UPSTREAM, max_bytes=TILE_CACHE_MAX_BYTES)
+    try:
+        proxy.serve(port=TILE_PROXY_PORT)
+    except OSError as e:
+        logger.error(f"❌ Tile proxy could not listen on port {TILE_PROXY_PORT}: {e}")
+        return None
+    return proxy
+
+tile_proxy = get_tile_proxy() if TILE_PROXY else None
+
+# VECTOR_TILES=1 draws journeys of VECTOR_TILE_MIN_EVENTS memories or more
+# from vector tiles (vector_tiles.py) instead of one folium marker per memory
+VECTOR_TILES = os.getenv("VECTOR_TILES") == "1"
+VECTOR_TILE_PORT = int(os.getenv("VECTOR_TILE_PORT", "8766"))
+VECTOR_TILE_URL = os.getenv("VECTOR_TILE_URL", f"http://localhost:{VECTOR_TILE_PORT}/mvt/{{token}}/{{z}}/{{x}}/{{y}}.pbf")
+VECTOR_TILE_MIN_EVENTS = int(os.getenv("VECTOR_TILE_MIN_EVENTS", "2000"))
+
+@st.cache_resource(show_spinner=False)
+def get_vector_tiles():
+    """One vector tile server per process, shared by every session"""
+    source = VectorTileSource()
+    try:
+        source.serve(port=VECTOR_TILE_PORT)
+    except OSError as e:
+        logger.error(f"❌ Vector tile server could not listen on port {VECTOR_TILE_PORT}: {e}")
+        return None
+    return source
+
+vector_tiles = get_vector_tiles() if VECTOR_TILES else None
+
+# ==================== WRITE-BEHIND AUTOSAVE ====================
+AUTOSAVE_DELAY = float(os.getenv("AUTOSAVE_DELAY", "1.5"))  # Edits closer together than this share one write
+AUTOSAVE_MAX_DELAY = 10.0  # ...but none waits longer than this
+
+@st.cache_resource(show_spinner=False)
+def get_autosave():
+    """One writer thread per process; flushes what's left at shutdown"""
+    return WriteBehindBuffer(journey_store, journey_cache, journey_history,
+                             delay=AUTOSAVE_DELAY, max_delay=AUTOSAVE_MAX_DELAY)
+
+autosave = get_autosave()
+
+if "session_key" not in st.session_state:
+    st.session_state.session_key = uuid.uuid4().hex
+
 #DEFAULT_ACTIVE_JSON="life_events.json"
 
 import streamlit as st
@@ -146,24 +319,14 @@ if "device_type" not in st.session_state:
 # Then set the initial sidebar based on device
 initial_sidebar = "collapsed" if st.session_state.device_type == "mobile" else "expanded"
 
-# ==================== JSON FILE PATH WITH ARGUMENT SUPPORT ====================
-parser = argparse.ArgumentParser(description="My Life Journey App")
-parser.add_argument(
-    "--file",
-    type=str,
-    default=DEFAULT_ACTIVE_JSON,
-    help=f"Path to the life events JSON file (default: {DEFAULT_ACTIVE_JSON})"
-)
-args = parser.parse_args()
-
 
 # st.sidebar.caption(f"📄 Using data file: `{JSON_FILE.name}`") # todo
 #if "selected_json_file" not in st.session_state:
 #    st.session_state.selected_json_file = DEFAULT_ACTIVE_JSON
 
-JSON_BLOB_NAME = get_json_path(st.session_state.selected_json_file) if IS_CLOUD else str(BASE_DIR / st.session_state.selected_json_file)
+JSON_BLOB_NAME = journey_store.ref(st.session_state.selected_json_file)
 
-JSON_FILE = BASE_DIR / st.session_state.selected_json_file
+JSON_FILE = Path(JSON_BLOB_NAME)
 # st.sidebar.caption(f"📄 Using data file: `{st.session_state.selected_json_file}`")
 
 
@@ -182,101 +345,120 @@ if not display_name.strip():
 
 # ==================== SCAN FOR JSON FILES ====================
 def get_local_json_files():
-    """Scan the current directory for .json files (excluding hidden and system files)"""
-    json_files = []
-    for item in BASE_DIR.iterdir():
-        if item.is_file() and item.suffix.lower() == ".json" and not item.name.startswith("."):
-            json_files.append(item.name)
-    return sorted(json_files)
-
-local_json_files = get_local_json_files()
+    """Journey names in this user's folder (local or GCS), from the shared listing cache"""
+    return list(journey_lists.names(journey_store))
 
 # ==================== ROBUST DATA INITIALIZATION ====================
 def ensure_valid_json():
-    if not JSON_FILE.exists() or JSON_FILE.stat().st_size == 0:
-        default_data = {
-            "autobiography": {
-                "title": "My Life Journey",
-                "author": "Your Name",
-                "created_date": datetime.now().strftime("%Y-%m-%d"),
-                "last_updated": datetime.now().strftime("%Y-%m-%d")
-            },
-            "events": []
-        }
-        # todo JSON_FILE.write_text(json.dumps(default_data, indent=4, ensure_ascii=False), encoding="utf-8")
-        save_data_to_storage(st.session_state.data)
+    # No stored version means the journey was never written (or is unreadable)
+    if st.session_state.journey_version is None:
+        if journey_store.version(JSON_BLOB_NAME) is not None:
+            # It exists but failed to load: show the error, never write an empty journey over it
+            logger.error(f"❌ {JSON_BLOB_NAME} exists but could not be read; leaving it untouched")
+            st.error(f"⚠️ **{Path(JSON_BLOB_NAME).name}** could not be read. It is shown empty here and will not be "
+                     f"overwritten — reload the page to try again.")
+            return
+        save_data_to_storage(st.session_state.journey)
+        journey_lists.invalidate(journey_store)
 
 # Load data from GCS or local
-@st.cache_data(show_spinner=False)
-def load_data_from_file(blob_or_path):
+def load_journey_snapshot(blob_or_path):
+    """(version, journey); the version is what our next save is conditional on"""
     try:
-        #if os.getenv("K_SERVICE1"):
-        logger.info(f"📂 Attempting to load data from: {blob_or_path}")
-        if IS_CLOUD:
-            data_bytes = download_from_gcs(blob_or_path)
-            text = data_bytes.decode("utf-8")
-        else:
-            text = Path(blob_or_path).read_text(encoding="utf-8")
-        if not text.strip():
-            raise ValueError("Empty")
-        data = json.loads(text)
-        data["events"] = sorted(data["events"], key=lambda x: x.get("date", "0000-00-00"))
-        return data
+        # Served from the shared cache unless the stored version changed;
+        # parsing sorts by date once, every consumer reads the columns in order
+        return journey_cache.snapshot(journey_store, blob_or_path)
     except Exception as e:
-        # Create default if missing
-        default_data = {
-            "autobiography": {
-                "title": "My Life Journey",
-                "author": "Your Name",
-                "created_date": datetime.now().strftime("%Y-%m-%d"),
-                "last_updated": datetime.now().strftime("%Y-%m-%d")
-            },
-            "events": []
-        }
-        save_data_to_storage(default_data)
-        return default_data
+        logger.warning(f"Could not load {blob_or_path}: {e}")
+        # Create default if missing, but never overwrite a journey we failed to read
+        default_journey = Journey.from_dict(default_journey_dict())
+        try:
+            version = journey_store.write(blob_or_path, default_journey.to_json(), if_version=NO_OBJECT)
+            journey_cache.put(blob_or_path, version, default_journey, publish=True)
+            return version, default_journey
+        except Exception as e:
+            logger.warning(f"Could not create {blob_or_path}: {e}")
+            return None, default_journey
 
-def save_data_to_storage(data):
-    json_text = json.dumps(data, indent=4, ensure_ascii=False)
+def load_data_from_file(blob_or_path):
+    return load_journey_snapshot(blob_or_path)[1]
+
+def save_data_to_storage(journey):
+    """Save conditionally on the version this session loaded, merging concurrent edits"""
     #if os.getenv("K_SERVICE1"):
     if IS_CLOUD:
         logger.info(f" Save to cloud {JSON_BLOB_NAME}")
-        upload_to_gcs(json_text.encode("utf-8"), JSON_BLOB_NAME, "application/json")
     else:
         logger.info(f" Save to local {JSON_FILE}")
-        Path(JSON_FILE).write_text(json_text, encoding="utf-8")
-
-if "data" not in st.session_state:
-    #st.session_state.data = load_data_from_file(JSON_FILE)
-    st.session_state.data = load_data_from_file(JSON_BLOB_NAME)
-
-#data = st.session_state.data
+    version, saved, conflicts = save_with_merge(
+        journey_store, JSON_BLOB_NAME, journey,
+        base=st.session_state.get("journey_base"),
+        base_version=st.session_state.get("journey_version")
+    )
+    if saved is not journey:
+        st.toast("🔀 This journey was changed in another session — both sets of changes were kept.")
+    if conflicts:
+        logger.warning(f"Edited concurrently in {JSON_BLOB_NAME}, kept our fields for events {conflicts}")
+    # Replace only this journey's cache entry with what we just wrote
+    journey_cache.put(JSON_BLOB_NAME, version, saved, publish=True)
+    journey_history.record(JSON_BLOB_NAME, saved, previous=st.session_state.get("journey_base"))
+    st.session_state.journey = st.session_state.journey_base = saved
+    st.session_state.journey_version = version
+    return saved
+
+def autosave_key(ref=None):
+    return (st.session_state.session_key, ref or JSON_BLOB_NAME)
+
+def queue_save(journey):
+    """Show the edit right away; autosave writes it out shortly after"""
+    autosave.submit(autosave_key(), JSON_BLOB_NAME, journey,
+                    st.session_state.get("journey_base"), st.session_state.get("journey_version"))
+    st.session_state.journey = journey
+
+def flush_autosave():
+    """Before leaving the current journey (switch, rename, restore ...)"""
+    if not autosave.flush(autosave_key()):
+        st.warning("⚠️ Some edits are still being saved in the background.")
+
+def refresh_journey():
+    """Follow the published snapshot: sessions hold a reference to the shared
+    immutable journey, never their own copy, unless they have unsaved edits"""
+    if "journey" not in st.session_state:
+        st.session_state.journey_version, st.session_state.journey = load_journey_snapshot(JSON_BLOB_NAME)
+        st.session_state.journey_base = st.session_state.journey
+        return
+    entry = autosave.get(autosave_key())
+    if entry is not None and entry.pending:
+        st.session_state.journey = entry.journey  # may include a merge done mid-write
+        return
+    done = autosave.collect(autosave_key())
+    if done is not None:
+        version, saved, merged, conflicts = done
+        if merged:
+            st.toast("🔀 This journey was changed in another session — both sets of changes were kept.")
+        st.session_state.journey = st.session_state.journey_base = saved
+        st.session_state.journey_version = version
+        st.session_state.last_autosave = datetime.now()
+    if st.session_state.journey is not st.session_state.journey_base:
+        return  # local edits pending, the next save merges them
+    try:
+        version, journey = journey_cache.snapshot(journey_store, JSON_BLOB_NAME)
+    except Exception as e:
+        logger.warning(f"Could not refresh {JSON_BLOB_NAME}: {e}")
+        return
+    if version != st.session_state.journey_version:
+        logger.info(f"🔄 Picked up a newer snapshot of {JSON_BLOB_NAME}")
+        st.session_state.journey = st.session_state.journey_base = journey
+        st.session_state.journey_version = version
 
-# List journeys
-def get_local_json_files():
-    #if os.getenv("K_SERVICE1"):
-    if IS_CLOUD:
-        blobs = list_journey_blobs()
-        return [os.path.basename(b) for b in blobs]
-    else:
-        return sorted([f.name for f in BASE_DIR.iterdir() if f.is_file() and f.suffix == ".json" and not f.name.startswith(".")])
+refresh_journey()
 
 ensure_valid_json()
 
-data = st.session_state.data
+journey = st.session_state.journey
 
 local_json_files = get_local_json_files()
 
-# Calculate timeline year range (only if there are events)
-timeline_info = ""
-if data["events"]:
-    sorted_events = sorted(data["events"], key=lambda x: x["date"])
-    dates = [datetime.strptime(e["date"], "%Y-%m-%d") for e in sorted_events]
-    if dates:
-        start_year = min(dates).year
-        end_year = max(dates).year
-        timeline_info = f" ({start_year} – {end_year})"
-
 # Final dynamic title
 #full_title = f"🌍 {display_name} - Map{timeline_info}"
 # full_title = f"🌍 Life Events - Map {timeline_info}  - test version"
@@ -288,13 +470,10 @@ if st.session_state.selected_json_file:
 display_name = json_filename.replace(".json", "").replace("_", " ").replace("-", " ")
 display_name = " ".join(word.capitalize() for word in display_name.split())
 
-memory_count = len(st.session_state.data.get("events", []))
+memory_count = len(journey)
 
-if data["events"]:
-    sorted_events = sorted(data["events"], key=lambda x: x["date"])
-    dates = [datetime.strptime(e["date"], "%Y-%m-%d") for e in sorted_events]
-    start_year = min(dates).year
-    end_year = max(dates).year
+if len(journey):
+    start_year, end_year = journey.year_range()
     timeline_info = f" ({start_year}–{end_year})"
 else:
     timeline_info = ""
@@ -327,6 +506,9 @@ def get_media_bytes(media_path):
         parts = media_path[5:].split("/", 1)
         bucket_name = parts[0]
         blob_path = parts[1] if len(parts) > 1 else ""
+        if blob_cache is not None:
+            # Conditional download: unchanged media is served from local disk
+            return blob_cache.fetch(storage_client.bucket(bucket_name), blob_path)[0]
         blob = storage.Client().bucket(bucket_name).blob(blob_path)
         return blob.download_as_bytes()
     else:
@@ -335,6 +517,20 @@ def get_media_bytes(media_path):
             return None
         return path.read_bytes()
 
+# ==================== CACHE WARMING ====================
+WARMUP_JOURNEYS = int(os.getenv("WARMUP_JOURNEYS", "5"))  # Most recently updated journeys; 0 turns warming off
+WARMUP_MEDIA = int(os.getenv("WARMUP_MEDIA", "200"))  # Their photos pulled into the blob cache (cloud only)
+JOURNEY_LIST_POLL = 1.0  # Seconds between sidebar refreshes while previews are loading
+
+@st.cache_resource(show_spinner=False)
+def get_cache_warmer(folder_ref, _store):
+    """One warm-up per process and journey folder, started by its first session"""
+    media_loader = get_media_bytes if IS_CLOUD else None  # Local media is already on disk
+    return CacheWarmer(_store, journey_cache, journey_lists, media_loader,
+                       journeys=WARMUP_JOURNEYS, media=WARMUP_MEDIA).start()
+
+cache_warmer = get_cache_warmer(journey_store.ref(""), journey_store) if WARMUP_JOURNEYS > 0 else None
+
 def get_image_base64(p):
     try:
         data = get_media_bytes(p)
@@ -367,22 +563,65 @@ def get_color_by_year(d):
 
 
 # ==================== POPUP ====================
-def build_popup_html(event):
-    title = html.escape(event.get('title', 'Untitled'))
-    desc = html.escape(event.get('description', '') or 'No description')
-    loc = html.escape(event['location']['name'])
+def build_popup_html(journey, i):
+    return render_popup_html(journey.title(i), journey.descriptions[i], journey.location_name(i),
+                             journey.date_str(i), journey.photos(i), journey.videos(i))
+
+POPUP_CACHE_MAX_BYTES = int(os.getenv("POPUP_CACHE_MAX_BYTES", 128 * 1024 * 1024))  # Rendered popups per process
+
+@st.cache_resource(show_spinner=False)
+def get_popup_cache():
+    """Popup HTML shared by all sessions, bounded by size (it embeds base64 media)"""
+    return RenderCache(max_bytes=POPUP_CACHE_MAX_BYTES)
+
+popup_cache = get_popup_cache()
+
+def media_stamp(media_path):
+    """Cheap version of a media file: (mtime, size) locally, the blob cache's generation in GCS"""
+    if media_path.startswith("gs://"):
+        cached = blob_cache.lookup(media_path[5:].split("/", 1)[-1]) if blob_cache is not None else None
+        return cached[0] if cached is not None else None
+    try:
+        stat = os.stat(media_path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+# Keyed by the event's content and its media versions, so after an edit only the
+# changed event's popup (and its base64 media) is rebuilt, and a file replaced
+# at the same path is re-encoded
+def render_popup_html(title, description, location, date_str, photos, videos):
+    key = "popup:" + hashlib.sha256(json.dumps(
+        [title, description, location, date_str, photos, videos, [media_stamp(m) for m in (*photos, *videos)]],
+        ensure_ascii=False).encode("utf-8")).hexdigest()
+    popup = popup_cache.get(key)
+    if popup is not None:
+        return popup
+    # Popups with media are worth sharing: other replicas skip fetching and encoding it
+    share = shared_cache is not None and bool(photos or videos)
+    cached = shared_cache.get(key) if share else None
+    if cached is not None:
+        popup = cached.decode("utf-8")
+    else:
+        popup = build_media_popup_html(title, description, location, date_str, photos, videos)
+        if share:
+            shared_cache.set(key, popup.encode("utf-8"))
+    popup_cache.put(key, popup)
+    return popup
+
+def build_media_popup_html(title, description, location, date_str, photos, videos):
+    title = html.escape(title or 'Untitled')
+    desc = html.escape(description or 'No description')
+    loc = html.escape(location)
 
     popup = f"""
     <div style="width:380px;max-height:550px;overflow-y:auto;padding:8px;font-family:sans-serif;">
         <h3 style="text-align:center;margin:0 0 8px 0;">{title}</h3>
-        <p style="text-align:center;color:#555;margin:0 0 10px 0;">{event['date']} • {loc}</p>
+        <p style="text-align:center;color:#555;margin:0 0 10px 0;">{date_str} • {loc}</p>
         <p style="line-height:1.4;margin-bottom:15px;">{desc}</p>
         <hr style="margin:15px 0;">
     """
 
-    photos = event["media"].get("photos", [])
-    videos = event["media"].get("videos", [])
-
     if photos:
         popup += "<strong>Photos:</strong><div style='display:flex;flex-wrap:wrap;gap:8px;justify-content:center;margin-top:8px;'>"
         for p in photos:
@@ -424,25 +663,95 @@ def build_popup_html(event):
 
 
 # ==================== MAP CREATION WITH CURVED JOURNEY LINES ====================
-def create_map():
-    events = st.session_state.data["events"]
-    if not events:
-        m = folium.Map(location=[20, 0], zoom_start=2, tiles="OpenStreetMap")
+# The base map (tiles + initial view) stays identical while a journey is open,
+# so st_folium keeps the mounted Leaflet map and its pan/zoom. Markers and
+# lines are sent as a feature group that the component swaps in place.
+def create_base_map(bounds):
+    if tile_proxy is not None:
+        tiles = dict(tiles=TILE_PROXY_URL, attr=TILE_ATTRIBUTION, max_zoom=19)
+    else:
+        tiles = dict(tiles="OpenStreetMap")
+    if bounds is None:
+        m = folium.Map(location=[20, 0], zoom_start=2, **tiles)
+        return m
+
+    m = folium.Map(**tiles)
+    m.fit_bounds(bounds, padding=(80, 80))
+    return m
+
+
+def journey_bounds(journey):
+    if not len(journey):
+        return None
+    return [[float(journey.lat.min()), float(journey.lon.min())],
+            [float(journey.lat.max()), float(journey.lon.max())]]
+
+
+# Style functions get each feature's properties (see vector_tiles.py)
+VECTOR_TILE_OPTIONS = """{
+    "token": %s,
+    "interactive": true,
+    "maxZoom": 19,
+    "vectorTileLayerStyles": {
+        "tracks": function(p) {
+            return {color: p.color, weight: 2, opacity: 0.8};
+        },
+        "events": function(p) {
+            var r = p.count ? Math.min(5 + 2 * Math.log2(p.count), 14) : 5;
+            return {radius: r, fill: true, fillColor: p.color, fillOpacity: 0.9, color: "#fff", weight: 1};
+        }
+    }
+}"""
+
+
+class VectorTilePopups(folium.MacroElement):
+    """Popup with the title and date of a clicked vector-tile memory or trip"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        {{ this._parent.get_name() }}.on("click", function(e) {
+            var p = e.layer.properties, box = document.createElement("div");
+            if (p.label) {
+                box.textContent = p.label;
+            } else {
+                box.textContent = p.n + ". " + p.title + " (" + p.date + ")"
+                    + (p.count ? " and " + (p.count - 1) + " more here" : "");
+            }
+            L.popup().setLatLng(e.latlng).setContent(box).openOn(this._map);
+        });
+        {% endmacro %}
+    """)
+
+
+def create_journey_layer(journey, show_heatmap=False):
+    m = folium.FeatureGroup(name="Journey")
+    if not len(journey):
         return m
 
-    sorted_events = sorted(events, key=lambda x: x["date"])
-    coords = [[e["location"]["latitude"], e["location"]["longitude"]] for e in sorted_events]
+    if show_heatmap:
+        # A few thousand pre-binned cells, however many memories there are
+        points, _ = heat_points(journey)
+        HeatMap(points, radius=20, blur=15, min_opacity=0.3).add_to(m)
+
+    if vector_tiles is not None and len(journey) >= VECTOR_TILE_MIN_EVENTS:
+        # Memories and trip paths are fetched a tile at a time for the current view
+        token = vector_tiles.register(journey, year_color=lambda y: get_color_by_year(f"{y:04d}"))
+        grid = VectorGridProtobuf(VECTOR_TILE_URL, "Journey", VECTOR_TILE_OPTIONS % json.dumps(token))
+        grid.add_to(m)
+        VectorTilePopups().add_to(grid)
+        return m
+
+    coords = journey.coords().tolist()
 
-    m = folium.Map(tiles="OpenStreetMap")
     cluster = MarkerCluster().add_to(m)
 
     # Add numbered markers
-    for idx, e in enumerate(sorted_events, start=1):
+    for idx, (point, date_str) in enumerate(zip(coords, map(journey.date_str, range(len(journey)))), start=1):
         folium.Marker(
-            [e["location"]["latitude"], e["location"]["longitude"]],
-            popup=folium.Popup(build_popup_html(e), max_width=450),
-            tooltip=f"{idx}. {e['title']} ({e['date']})",
-            icon=folium.Icon(color=get_color_by_year(e["date"]), icon="circle", prefix="fa")
+            point,
+            popup=folium.Popup(build_popup_html(journey, idx - 1), max_width=450),
+            tooltip=f"{idx}. {journey.title(idx - 1)} ({date_str})",
+            icon=folium.Icon(color=get_color_by_year(date_str), icon="circle", prefix="fa")
         ).add_to(cluster)
 
         # Number label above marker
@@ -462,7 +771,7 @@ def create_map():
         </div>
         """
         folium.Marker(
-            [e["location"]["latitude"], e["location"]["longitude"]],
+            point,
             icon=folium.DivIcon(
                 html=label_html,
                 icon_size=(None, None),
@@ -470,34 +779,37 @@ def create_map():
             )
         ).add_to(m)
 
-    # === CURVED + ANIMATED JOURNEY LINE USING ANTPath ===
-    if len(coords) > 1:
-        # Import and add AntPath plugin (curved, animated, pulsing flow)
-        from folium.plugins import AntPath
-
-        AntPath(
-            locations=coords,
-            color="#50E3C2",           # Teal/cyan flowing color
-            weight=2,                  # Thin but visible
-            opacity=0.8,
-            pulse_color="#ffffff",
-            delay=800,                 # Animation speed
-            dash_array=[10, 20],
-            smooth_factor=50,           # Higher = more curved/smoother
-            hardware_accelerated=True,
-            tooltip="Your life journey →"
-        ).add_to(m)
-
-        # Optional: Add a subtle static curved base line (great circle feel)
-        folium.PolyLine(
-            locations=coords,
-            weight=3,
-            color="#4A90E2",
-            opacity=0.4,
-            smooth_factor=50           # Very high for natural Earth curve
-        ).add_to(m)
+    # === CURVED + ANIMATED JOURNEY LINES, ONE PER TRIP ===
+    # Great-circle arcs, cut where they cross the antimeridian so long legs
+    # don't wrap the wrong way round; an edit only recomputes its own trip
+    for trip in segment_trips(journey):
+        if len(trip) < 2:
+            continue
+        for segment in trip_path(journey, trip):
+            if len(segment) < 2:
+                continue
+            AntPath(
+                locations=segment,
+                color=trip.color,          # One flowing color per trip
+                weight=2,                  # Thin but visible
+                opacity=0.8,
+                pulse_color="#ffffff",
+                delay=800,                 # Animation speed
+                dash_array=[10, 20],
+                smooth_factor=1,           # Leaflet's simplification would flatten the arcs
+                hardware_accelerated=True,
+                tooltip=trip.label()
+            ).add_to(m)
+
+            # Subtle static base line under the animation
+            folium.PolyLine(
+                locations=segment,
+                weight=3,
+                color="#4A90E2",
+                opacity=0.4,
+                smooth_factor=1
+            ).add_to(m)
 
-    m.fit_bounds(coords, padding=(80, 80))
     return m
 
 # ==================== RESPONSIVE CSS BASED ON DETECTED DEVICE ====================
@@ -592,6 +904,13 @@ css += """
         margin: 40px 0 15px 0;
         box-shadow: 0 2px 6px rgba(0,0,0,0.1);
     }
+    .timeline-trip {
+        position: absolute;
+        top: -3px;
+        height: 14px;
+        border-radius: 7px;
+        opacity: 0.75;
+    }
     .timeline-tick {
         position: absolute;
         top: -20px;
@@ -670,323 +989,333 @@ st.set_page_config(
 
 st.title(full_title)
 
-# ==================== TIMELINE BAR ON TOP ====================
-if data["events"]:
-    sorted_events = sorted(data["events"], key=lambda x: x["date"])
-    dates = [datetime.strptime(e["date"], "%Y-%m-%d") for e in sorted_events]
-
-    if dates:
-        min_date = min(dates) - timedelta(days=365 * 2)
-        max_date = max(dates) + timedelta(days=365 * 5)
-        total_span = (max_date - min_date).days or 1
-
-        st.markdown("<div class='timeline-container'>", unsafe_allow_html=True)
-
-        timeline_html = '<div class="timeline-bar">'
-
-        for idx, (event, dt) in enumerate(zip(sorted_events, dates), start=1):
-            position = ((dt - min_date).days / total_span) * 100
-            escaped_title = html.escape(event.get('title', 'Untitled'))
+# ==================== FRAGMENT HELPERS ====================
+def rerun_fragment():
+    """Rerun only the calling fragment (full rerun if we're not inside a fragment rerun)"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
-            timeline_html += f'<div class="timeline-tick" style="left: {position}%;"></div>'
-            timeline_html += f'''
-            <div class="timeline-label-frame" style="left: {position}%;">
-                <div class="timeline-label">
-                    <strong>{idx}.</strong> <span>{event["date"]}</span>
-                    <div class="timeline-title">{escaped_title}</div>
+# ==================== TIMELINE BAR ON TOP ====================
+@st.fragment
+def timeline_section(journey):
+    if len(journey):
+        ordinals = journey.ordinals
+        if len(ordinals):
+            min_date = int(ordinals[0]) - 365 * 2
+            max_date = int(ordinals[-1]) + 365 * 5
+            total_span = (max_date - min_date) or 1
+            positions = (ordinals - min_date) / total_span * 100
+
+            st.markdown("<div class='timeline-container'>", unsafe_allow_html=True)
+
+            timeline_html = '<div class="timeline-bar">'
+
+            # One band per trip with more than one memory
+            for trip in segment_trips(journey):
+                if len(trip) < 2:
+                    continue
+                left = (trip.first_ordinal - min_date) / total_span * 100
+                width = max((trip.last_ordinal - trip.first_ordinal) / total_span * 100, 0.4)
+                timeline_html += (f'<div class="timeline-trip" title="{html.escape(trip.label())}" '
+                                  f'style="left: {left}%; width: {width}%; background: {trip.color};"></div>')
+
+            for idx, position in enumerate(positions.tolist(), start=1):
+                escaped_title = html.escape(journey.title(idx - 1) or 'Untitled')
+
+                timeline_html += f'<div class="timeline-tick" style="left: {position}%;"></div>'
+                timeline_html += f'''
+                <div class="timeline-label-frame" style="left: {position}%;">
+                    <div class="timeline-label">
+                        <strong>{idx}.</strong> <span>{journey.date_str(idx - 1)}</span>
+                        <div class="timeline-title">{escaped_title}</div>
+                    </div>
                 </div>
-            </div>
-            '''
+                '''
 
-        timeline_html += '</div>'
-        st.markdown(timeline_html, unsafe_allow_html=True)
+            timeline_html += '</div>'
+            st.markdown(timeline_html, unsafe_allow_html=True)
 
-        years_span = (max(dates) - min(dates)).days // 365
-        #st.caption(f"Events span ~{years_span} years • Hover on label frame to show memory title")
+            years_span = (int(ordinals[-1]) - int(ordinals[0])) // 365
+            #st.caption(f"Events span ~{years_span} years • Hover on label frame to show memory title")
 
-        st.markdown("</div>", unsafe_allow_html=True)
-else:
-    st.info("Add memories to see the extended timeline.")
+            st.markdown("</div>", unsafe_allow_html=True)
+    else:
+        st.info("Add memories to see the extended timeline.")
+
+timeline_section(journey)
 
 # ==================== MAP ====================
-map_key = f"main_map_{st.session_state.force_map_refresh}"
-main_map = create_map()
-
-map_data = st_folium(
-    main_map,
-    key=map_key,
-    width=None,
-    height=1200,
-    use_container_width=True,
-    returned_objects=["last_clicked"]
-    #returned_objects = ["last_clicked", "center", "zoom"]
-)
-# Now check click + mode
 if "app_mode" not in st.session_state:
     st.session_state.app_mode = "View Mode"  # Default
 
-if st.session_state.app_mode and map_data and map_data.get("last_clicked"):
-    pass
-    # for display status purpose (not clean code)
-else:
-    if map_data and map_data.get("last_clicked") and not is_edit_mode:
-        st.sidebar.info("🔒 In **View Mode** — map clicks are disabled. Switch to **Edit Mode** to add memories.")
+# Panning and zooming never rerun anything. In View Mode the map doesn't even
+# report clicks; in Edit Mode a new click opens the add form in the sidebar.
+@st.fragment
+def map_section(journey, map_key, edit_mode, show_heatmap=False):
+    if st.session_state.get("map_bounds_key") != map_key:
+        st.session_state.map_bounds_key = map_key
+        st.session_state.map_bounds = journey_bounds(journey)
+        if tile_proxy is not None and st.session_state.map_bounds is not None:
+            # Warm the tiles the map is about to open on, in the background
+            tile_proxy.prefetch(st.session_state.map_bounds)
+    main_map = create_base_map(st.session_state.map_bounds)
+
+    map_data = st_folium(
+        main_map,
+        key=map_key,
+        width=None,
+        height=1200,
+        use_container_width=True,
+        feature_group_to_add=create_journey_layer(journey, show_heatmap),
+        returned_objects=["last_clicked"] if edit_mode else []
+        #returned_objects = ["last_clicked", "center", "zoom"]
+    )
+
+    # The component keeps reporting the last click, so only act on a new one
+    click = map_data.get("last_clicked") if map_data else None
+    if edit_mode and click and click != st.session_state.get("last_map_click"):
+        st.session_state.last_map_click = click
+        st.session_state.pending_click = click
+        st.rerun()  # The add form lives in the sidebar, outside this fragment
 
-if map_data and map_data.get("center"):
-    st.session_state.map_center = [map_data["center"]["lat"], map_data["center"]["lng"]]
-    st.session_state.map_zoom = map_data.get("zoom", 2)
+# Only a journey switch/restore remounts the map; edits update the journey layer
+map_key = f"main_map_{st.session_state.selected_json_file}_{st.session_state.force_map_refresh}"
+map_section(journey, map_key, st.session_state.app_mode == "Edit Mode", st.session_state.get("show_heatmap", False))
 
 # ==================== ADD NEW MEMORY ====================
-if st.session_state.app_mode == "Edit Mode" and map_data and map_data.get("last_clicked"):
-    click = map_data["last_clicked"]
-    lat, lon = round(click["lat"], 6), round(click["lng"], 6)
-    default_name = f"{lat:.5f}, {lon:.5f}"
-
-    st.sidebar.header("➕ Add New Memory")
-    with st.sidebar.form("add_form", clear_on_submit=False):
-        title = st.text_input("Title*", "")
-        date = st.date_input("Date*", datetime.today(),
-                             min_value=datetime(1930, 1, 1).date(),
-                             max_value=None)
-        loc_name = st.text_input("Location Name*", default_name)
-        description = st.text_area("Description")
-        photos = st.file_uploader("Photos", accept_multiple_files=True, type=["jpg", "jpeg", "png", "gif"])
-        videos = st.file_uploader("Videos", accept_multiple_files=True, type=["mp4", "mov", "webm"])
-
-        col_save, col_cancel = st.columns([1, 1])
-        with col_save:
-            save_clicked = st.form_submit_button("💾 Save Memory")
-        with col_cancel:
-            cancel_clicked = st.form_submit_button("❌ Cancel", type="secondary")
-
-        if save_clicked:
-            if not title.strip():
-                st.error("Title required")
-            else:
-                photo_paths = []
-                for up in photos or []:
-                    fname = f"{int(time.time())}_{up.name}"
-                    # path = UPLOADS_PHOTOS / fname
-                    # path.write_bytes(up.getbuffer())
-                    # photo_paths.append(str(path))
-                    file_bytes = up.getbuffer()
-
-                    #if os.getenv("K_SERVICE1"):
-                    if IS_CLOUD:
-                        photo_paths.append(upload_to_gcs(file_bytes, f"photos/{fname}", up.type))
-                    else:
-                        path = UPLOADS_PHOTOS / fname
-                        path.write_bytes(file_bytes)
-                        photo_paths.append(str(path))
-
-                video_paths = []
-                for up in videos or []:
-                    fname = f"{int(time.time())}_{up.name}"
-                    # path = UPLOADS_VIDEOS / fname
-                    # path.write_bytes(up.getbuffer())
-                    # video_paths.append(str(path))
-                    file_bytes = up.getbuffer()
-                    #if os.getenv("K_SERVICE1"):
-                    if IS_CLOUD:
-                        video_paths.append(upload_to_gcs(file_bytes, f"videos/{fname}", up.type))
-                    else:
-                        path = UPLOADS_VIDEOS / fname
-                        path.write_bytes(file_bytes)
-                        video_paths.append(str(path))
-
-
-                new_id = max((e["id"] for e in st.session_state.data["events"]), default=0) + 1
-                new_event = {
-                    "id": new_id,
-                    "title": title,
-                    "date": date.strftime("%Y-%m-%d"),
-                    "location": {"name": loc_name, "latitude": lat, "longitude": lon},
-                    "description": description,
-                    "media": {"photos": photo_paths, "videos": video_paths}
-                }
-                st.session_state.data["events"].append(new_event)
-                # todo JSON_FILE.write_text(json.dumps(st.session_state.data, indent=4, ensure_ascii=False), encoding="utf-8")
-                save_data_to_storage(st.session_state.data)
-                st.session_state.force_map_refresh += 1
-                st.success("Memory added!")
-                st.rerun()
-
-        if cancel_clicked:
-            st.rerun()
+@st.fragment
+def add_memory_form(journey, click):
+    if click:
+        lat, lon = round(click["lat"], 6), round(click["lng"], 6)
+        default_name = f"{lat:.5f}, {lon:.5f}"
+
+        st.header("➕ Add New Memory")
+        with st.form("add_form", clear_on_submit=False):
+            title = st.text_input("Title*", "")
+            date = st.date_input("Date*", datetime.today(),
+                                 min_value=datetime(1930, 1, 1).date(),
+                                 max_value=None)
+            loc_name = st.text_input("Location Name*", default_name)
+            description = st.text_area("Description")
+            photos = st.file_uploader("Photos", accept_multiple_files=True, type=["jpg", "jpeg", "png", "gif"])
+            videos = st.file_uploader("Videos", accept_multiple_files=True, type=["mp4", "mov", "webm"])
+
+            col_save, col_cancel = st.columns([1, 1])
+            with col_save:
+                save_clicked = st.form_submit_button("💾 Save Memory")
+            with col_cancel:
+                cancel_clicked = st.form_submit_button("❌ Cancel", type="secondary")
+
+            if save_clicked:
+                if not title.strip():
+                    st.error("Title required")
+                else:
+                    photo_paths = []
+                    for up in photos or []:
+                        fname = f"{int(time.time())}_{up.name}"
+                        # path = UPLOADS_PHOTOS / fname
+                        # path.write_bytes(up.getbuffer())
+                        # photo_paths.append(str(path))
+                        file_bytes = up.getbuffer()
+
+                        #if os.getenv("K_SERVICE1"):
+                        if IS_CLOUD:
+                            photo_paths.append(upload_to_gcs(file_bytes, f"photos/{fname}", up.type))
+                        else:
+                            path = UPLOADS_PHOTOS / fname
+                            path.write_bytes(file_bytes)
+                            photo_paths.append(str(path))
+
+                    video_paths = []
+                    for up in videos or []:
+                        fname = f"{int(time.time())}_{up.name}"
+                        # path = UPLOADS_VIDEOS / fname
+                        # path.write_bytes(up.getbuffer())
+                        # video_paths.append(str(path))
+                        file_bytes = up.getbuffer()
+                        #if os.getenv("K_SERVICE1"):
+                        if IS_CLOUD:
+                            video_paths.append(upload_to_gcs(file_bytes, f"videos/{fname}", up.type))
+                        else:
+                            path = UPLOADS_VIDEOS / fname
+                            path.write_bytes(file_bytes)
+                            video_paths.append(str(path))
+
+
+                    new_id = journey.next_id()
+                    new_event = {
+                        "id": new_id,
+                        "title": title,
+                        "date": date.strftime("%Y-%m-%d"),
+                        "location": {"name": loc_name, "latitude": lat, "longitude": lon},
+                        "description": description,
+                        "media": {"photos": photo_paths, "videos": video_paths}
+                    }
+                    queue_save(journey.with_event(new_event))
+                    st.session_state.pending_click = None
+                    st.success("Memory added!")
+                    st.rerun()  # Map, timeline and memory list all changed
+
+            if cancel_clicked:
+                st.session_state.pending_click = None
+                rerun_fragment()
 
 # ==================== EDITING EXISTING EVENT ====================
-if st.session_state.editing_event_id:
-    event = next((e for e in st.session_state.data["events"] if e["id"] == st.session_state.editing_event_id), None)
-    if event:
-        st.sidebar.header(f"✏️ Editing: {event['title']}")
-
-        cur_lat = event["location"]["latitude"]
-        cur_lon = event["location"]["longitude"]
-        st.sidebar.markdown(f"**Current:** Lat {cur_lat:.6f} | Lon {cur_lon:.6f}")
-
-        new_lat = st.sidebar.number_input("Latitude", value=cur_lat, step=0.000001, format="%.6f")
-        new_lon = st.sidebar.number_input("Longitude", value=cur_lon, step=0.000001, format="%.6f")
-
-        for mtype, label in [("photos", "Photos"), ("videos", "Videos")]:
-            st.sidebar.markdown(f"### Current {label}")
-            paths = event["media"].get(mtype, []).copy()
-            if paths:
-                cols = st.sidebar.columns(3 if mtype == "photos" else 2)
-                for i, p in enumerate(paths):
-                    if os.path.exists(p):
-                        with cols[i % len(cols)]:
-                            if mtype == "photos":
-                                st.image(p, width=150)
-                            else:
-                                st.video(p)
-                            if st.button("Remove", key=f"del_{mtype}_{i}_{event['id']}"):
-                                os.remove(p)
-                                event["media"][mtype].remove(p)
-                                # todo JSON_FILE.write_text(json.dumps(st.session_state.data, indent=4, ensure_ascii=False),
-                                #                     encoding="utf-8")
-                                save_data_to_storage(st.session_state.data)
-                                st.rerun()
-            else:
-                st.sidebar.info(f"No {label.lower()}")
-
-        with st.sidebar.form("edit_form"):
-            new_title = st.text_input("Title", event["title"])
-            new_date = st.date_input("Date", datetime.strptime(event["date"], "%Y-%m-%d").date(),
-                                     min_value=datetime(1920, 1, 1).date(),
-                                     max_value=None)
-            new_loc = st.text_input("Location Name", event["location"]["name"])
-            new_desc = st.text_area("Description", event.get("description", ""))
-            add_photos = st.file_uploader("Add Photos", accept_multiple_files=True, type=["jpg", "jpeg", "png", "gif"],
-                                          key=f"add_ph_{event['id']}")
-            add_videos = st.file_uploader("Add Videos", accept_multiple_files=True, type=["mp4", "mov", "webm"],
-                                          key=f"add_vid_{event['id']}")
-
-            if st.form_submit_button("💾 Save Changes", type="primary"):
-                event["location"]["latitude"] = new_lat
-                event["location"]["longitude"] = new_lon
-                event["title"] = new_title
-                event["date"] = new_date.strftime("%Y-%m-%d")
-                event["location"]["name"] = new_loc
-                event["description"] = new_desc
-
-                for up in add_photos or []:
-                    fname = f"{int(time.time())}_{up.name}"
-                    # path = UPLOADS_PHOTOS / fname
-                    # path.write_bytes(up.getbuffer())
-                    # event["media"]["photos"].append(str(path))
-                    file_bytes = up.getbuffer()
-                    #if os.getenv("K_SERVICE1"):
-                    if IS_CLOUD:
-                        event["media"]["photos"].append(upload_to_gcs(file_bytes, f"photos/{fname}", up.type))
-                    else:
-                        path = UPLOADS_PHOTOS / fname
-                        path.write_bytes(file_bytes)
-                        event["media"]["photos"].append(str(path))
-
-                for up in add_videos or []:
-                    fname = f"{int(time.time())}_{up.name}"
-                    # path = UPLOADS_VIDEOS / fname
-                    # path.write_bytes(up.getbuffer())
-                    # event["media"]["videos"].append(str(path))
-                    file_bytes = up.getbuffer()
-                    #if os.getenv("K_SERVICE1"):
-                    if IS_CLOUD:
-                        event["media"]["videos"].append(upload_to_gcs(file_bytes, f"videos/{fname}", up.type))
-                    else:
-                        path = UPLOADS_VIDEOS / fname
-                        path.write_bytes(file_bytes)
-                        event["media"]["videos"].append(str(path))
-
-
-
+# Edit form, memory list and delete confirmation share one fragment: opening
+# or cancelling an edit/delete only reruns this panel. Saving reruns the app.
+@st.fragment
+def memory_panel(journey, selected_json_file):
+    if st.session_state.editing_event_id:
+        row = journey.row_of(st.session_state.editing_event_id)
+        # Mutable dict view of the one event being edited; written back with with_event()
+        event = journey.event(row) if row is not None else None
+        if event:
+            st.header(f"✏️ Editing: {event['title']}")
+
+            cur_lat = event["location"]["latitude"]
+            cur_lon = event["location"]["longitude"]
+            st.markdown(f"**Current:** Lat {cur_lat:.6f} | Lon {cur_lon:.6f}")
+
+            new_lat = st.number_input("Latitude", value=cur_lat, step=0.000001, format="%.6f")
+            new_lon = st.number_input("Longitude", value=cur_lon, step=0.000001, format="%.6f")
+
+            for mtype, label in [("photos", "Photos"), ("videos", "Videos")]:
+                st.markdown(f"### Current {label}")
+                paths = event["media"].get(mtype, []).copy()
+                if paths:
+                    cols = st.columns(3 if mtype == "photos" else 2)
+                    for i, p in enumerate(paths):
+                        if os.path.exists(p):
+                            with cols[i % len(cols)]:
+                                if mtype == "photos":
+                                    st.image(p, width=150)
+                                else:
+                                    st.video(p)
+                                if st.button("Remove", key=f"del_{mtype}_{i}_{event['id']}"):
+                                    # Shared (restored) media is left for `journey_cli.py media gc`
+                                    delete_media([p])
+                                    event["media"][mtype].remove(p)
+                                    queue_save(journey.with_event(event))
+                                    st.rerun()
+                else:
+                    st.info(f"No {label.lower()}")
+
+            with st.form("edit_form"):
+                new_title = st.text_input("Title", event["title"])
+                new_date = st.date_input("Date", datetime.strptime(event["date"], "%Y-%m-%d").date(),
+                                         min_value=datetime(1920, 1, 1).date(),
+                                         max_value=None)
+                new_loc = st.text_input("Location Name", event["location"]["name"])
+                new_desc = st.text_area("Description", event.get("description", ""))
+                add_photos = st.file_uploader("Add Photos", accept_multiple_files=True, type=["jpg", "jpeg", "png", "gif"],
+                                              key=f"add_ph_{event['id']}")
+                add_videos = st.file_uploader("Add Videos", accept_multiple_files=True, type=["mp4", "mov", "webm"],
+                                              key=f"add_vid_{event['id']}")
+
+                if st.form_submit_button("💾 Save Changes", type="primary"):
+                    event["location"]["latitude"] = new_lat
+                    event["location"]["longitude"] = new_lon
+                    event["title"] = new_title
+                    event["date"] = new_date.strftime("%Y-%m-%d")
+                    event["location"]["name"] = new_loc
+                    event["description"] = new_desc
+
+                    for up in add_photos or []:
+                        fname = f"{int(time.time())}_{up.name}"
+                        # path = UPLOADS_PHOTOS / fname
+                        # path.write_bytes(up.getbuffer())
+                        # event["media"]["photos"].append(str(path))
+                        file_bytes = up.getbuffer()
+                        #if os.getenv("K_SERVICE1"):
+                        if IS_CLOUD:
+                            event["media"]["photos"].append(upload_to_gcs(file_bytes, f"photos/{fname}", up.type))
+                        else:
+                            path = UPLOADS_PHOTOS / fname
+                            path.write_bytes(file_bytes)
+                            event["media"]["photos"].append(str(path))
+
+                    for up in add_videos or []:
+                        fname = f"{int(time.time())}_{up.name}"
+                        # path = UPLOADS_VIDEOS / fname
+                        # path.write_bytes(up.getbuffer())
+                        # event["media"]["videos"].append(str(path))
+                        file_bytes = up.getbuffer()
+                        #if os.getenv("K_SERVICE1"):
+                        if IS_CLOUD:
+                            event["media"]["videos"].append(upload_to_gcs(file_bytes, f"videos/{fname}", up.type))
+                        else:
+                            path = UPLOADS_VIDEOS / fname
+                            path.write_bytes(file_bytes)
+                            event["media"]["videos"].append(str(path))
+
+
+
+
+                    queue_save(journey.with_event(event))
+                    st.session_state.editing_event_id = None
+                    st.success("Changes saved!")
+                    st.rerun()
 
-                # todo JSON_FILE.write_text(json.dumps(st.session_state.data, indent=4, ensure_ascii=False), encoding="utf-8")
-                save_data_to_storage(st.session_state.data)
-                st.session_state.force_map_refresh += 1
+            if st.button("Cancel Editing"):
                 st.session_state.editing_event_id = None
-                st.success("Changes saved!")
-                st.rerun()
-
-        if st.sidebar.button("Cancel Editing"):
-            st.session_state.editing_event_id = None
-            st.rerun()
-
-# ==================== SIDEBAR SUMMARY WITH EDIT AND DELETE BUTTONS ====================
-
-st.sidebar.markdown("---")
-st.sidebar.subheader(f"🗺️ Journey ({st.session_state.selected_json_file}) has {len(st.session_state.data['events'])} places")
-
-sorted_events = sorted(st.session_state.data["events"], key=lambda x: x["date"])
-for idx, event in enumerate(sorted_events, start=1):
-    with st.sidebar.expander(f"{idx}. {event['date']} — {event['title']}", expanded=False):
-        st.caption(f"📍 {event['location']['name']}")
-        for p in event["media"].get("photos", [])[:3]:
-            if os.path.exists(p):
-                st.image(p, width=200)
-        for v in event["media"].get("videos", [])[:1]:
-            if os.path.exists(v):
-                st.video(v)
-
-        # Edit and Delete buttons side by side
-        col_edit, col_delete = st.columns([2, 1])
-        with col_edit:
-            if st.button("✏️ Edit", key=f"edit_sidebar_{event['id']}"):
-                st.session_state.editing_event_id = event["id"]
-                st.rerun()
-        with col_delete:
-            if st.button("🗑️ Delete", key=f"delete_sidebar_{event['id']}"):
-                st.session_state.confirm_delete_id = event["id"]
-                st.rerun()
-
-# Confirmation dialog for deletion
-if "confirm_delete_id" in st.session_state:
-    delete_event = next((e for e in st.session_state.data["events"] if e["id"] == st.session_state.confirm_delete_id),
-                        None)
-    if delete_event:
-        for idx, event in enumerate(sorted_events, start=1):
-            if event["id"] == st.session_state.confirm_delete_id:
-                with st.sidebar.expander(f"{idx}. {event['date']} — {event['title']} (Confirm Delete)", expanded=True):
-                    st.warning("⚠️ Are you sure you want to permanently delete this memory?")
-                    st.write(f"**{event['title']}** • {event['date']} • {event['location']['name']}")
-
-                    col_yes, col_no = st.columns(2)
-                    with col_yes:
-                        if st.button("Yes, delete permanently", type="primary", key=f"confirm_yes_{event['id']}"):
-                            # for p in event["media"].get("photos", []) + event["media"].get("videos", []):
-                            #     if os.path.exists(p):
-                            #         os.remove(p)
-                            # Delete media files (GCS or local)
-                            for p in event["media"].get("photos", []) + event["media"].get("videos", []):
-                                try:
-                                    if p.startswith("gs://"):
-                                        parts = p[5:].split("/", 1)
-                                        bucket_name = parts[0]
-                                        blob_path = parts[1] if len(parts) > 1 else ""
-                                        storage.Client().bucket(bucket_name).blob(blob_path).delete()
-                                    else:
-                                        path = Path(p)
-                                        if path.exists():
-                                            path.unlink()
-                                except Exception:
-                                    pass  # Best-effort deletion
-
-
-                            st.session_state.data["events"] = [e for e in st.session_state.data["events"] if
-                                                               e["id"] != event["id"]]
-                            # todo JSON_FILE.write_text(json.dumps(st.session_state.data, indent=4, ensure_ascii=False),
-                            #                     encoding="utf-8")
-                            save_data_to_storage(st.session_state.data)
-                            st.session_state.force_map_refresh += 1
-                            if "confirm_delete_id" in st.session_state:
-                                del st.session_state.confirm_delete_id
-                            st.success("Memory deleted")
-                            st.rerun()
-                    with col_no:
-                        if st.button("No, keep it", key=f"confirm_no_{event['id']}"):
-                            if "confirm_delete_id" in st.session_state:
-                                del st.session_state.confirm_delete_id
-                            st.rerun()
-                break
+                rerun_fragment()
+
+    # ==================== SIDEBAR SUMMARY WITH EDIT AND DELETE BUTTONS ====================
+
+    st.markdown("---")
+    st.subheader(f"🗺️ Journey ({selected_json_file}) has {len(journey)} places")
+
+    for idx, event_id in enumerate(journey.ids.tolist(), start=1):
+        with st.expander(f"{idx}. {journey.date_str(idx - 1)} — {journey.title(idx - 1)}", expanded=False):
+            st.caption(f"📍 {journey.location_name(idx - 1)}")
+            for p in journey.photos(idx - 1)[:3]:
+                if os.path.exists(p):
+                    st.image(p, width=200)
+            for v in journey.videos(idx - 1)[:1]:
+                if os.path.exists(v):
+                    st.video(v)
+
+            # Edit and Delete buttons side by side
+            col_edit, col_delete = st.columns([2, 1])
+            with col_edit:
+                if st.button("✏️ Edit", key=f"edit_sidebar_{event_id}"):
+                    st.session_state.editing_event_id = event_id
+                    rerun_fragment()
+            with col_delete:
+                if st.button("🗑️ Delete", key=f"delete_sidebar_{event_id}"):
+                    st.session_state.confirm_delete_id = event_id
+                    rerun_fragment()
+
+    # Confirmation dialog for deletion
+    if "confirm_delete_id" in st.session_state:
+        row = journey.row_of(st.session_state.confirm_delete_id)
+        if row is not None:
+            idx, event = row + 1, journey.event(row)
+            with st.expander(f"{idx}. {event['date']} — {event['title']} (Confirm Delete)", expanded=True):
+                st.warning("⚠️ Are you sure you want to permanently delete this memory?")
+                st.write(f"**{event['title']}** • {event['date']} • {event['location']['name']}")
+
+                col_yes, col_no = st.columns(2)
+                with col_yes:
+                    if st.button("Yes, delete permanently", type="primary", key=f"confirm_yes_{event['id']}"):
+                        # Delete media files (GCS or local), batched; failures are reported
+                        report = delete_media(event["media"].get("photos", []) + event["media"].get("videos", []),
+                                              storage_client if IS_CLOUD else None)
+                        if report["failed"]:
+                            st.warning(f"{len(report['failed'])} media file(s) could not be deleted.")
+
+                        queue_save(journey.without_event(event["id"]))
+                        if "confirm_delete_id" in st.session_state:
+                            del st.session_state.confirm_delete_id
+                        st.success("Memory deleted")
+                        st.rerun()
+                with col_no:
+                    if st.button("No, keep it", key=f"confirm_no_{event['id']}"):
+                        if "confirm_delete_id" in st.session_state:
+                            del st.session_state.confirm_delete_id
+                        rerun_fragment()
 
 
 # Optional: last modified
@@ -995,284 +1324,445 @@ if "confirm_delete_id" in st.session_state:
 #    st.sidebar.caption(f"Last saved: {mtime.strftime('%Y-%m-%d %H:%M')}")
 
 
+# ==================== JOURNEY STATISTICS ====================
+# Computed once per saved version of the journey and shared by every session
+@st.fragment
+def stats_panel(journey):
+    stats = journey_stats(journey)
+    if stats is None:
+        return
+    with st.expander("📊 Journey Statistics", expanded=False):
+        col_km, col_regions = st.columns(2)
+        col_km.metric("Distance traveled", f"{stats['total_km']:,.0f} km")
+        col_regions.metric("Regions visited", stats["regions"])
+
+        def place(row):
+            return f"**{journey.title(row)}** ({journey.date_str(row)})"
+
+        def days(n):
+            return f"{n:.0f} day{'' if round(n) == 1 else 's'}"
+
+        far = stats["farthest"]
+        st.markdown(f"🧭 Farthest from home: {place(far['row'])}, {far['km']:,.0f} km")
+        if stats["longest_leg"]:
+            leg = stats["longest_leg"]
+            st.markdown(f"✈️ Longest leg: {place(leg['from'])} → {place(leg['to'])}, {leg['km']:,.0f} km")
+        if stats["longest_gap"]:
+            gap = stats["longest_gap"]
+            st.markdown(f"⏳ Longest gap between memories: {days(gap['days'])}, "
+                        f"after {place(gap['from'])} (typical gap {days(stats['median_gap_days'])})")
+        if stats["longest_stay"]:
+            stay = stats["longest_stay"]
+            st.markdown(f"🏠 Longest stay: {days(stay['days'])} around {journey.location_name(stay['from'])} "
+                        f"({stay['events']} memories)")
+
+        st.markdown("**Per year**")
+        st.dataframe({
+            "Year": [str(y) for y in stats["per_year"]],
+            "Memories": [v["events"] for v in stats["per_year"].values()],
+            "Distance (km)": [round(v["km"]) for v in stats["per_year"].values()],
+        }, hide_index=True, width="stretch")
+        st.markdown("**Busiest regions**")
+        st.dataframe({
+            "Region": [r["region"] for r in stats["region_years"]],
+            "Year": [str(r["year"]) for r in stats["region_years"]],
+            "Memories": [r["events"] for r in stats["region_years"]],
+        }, hide_index=True, width="stretch")
+
+
 ## ==================== AVAILABLE JOURNEY FILES AS CLICKABLE BUTTONS ====================
 # SAFETY CHECK: Ensure selected_json_file always exists in session state
 if "selected_json_file" not in st.session_state:
     st.session_state.selected_json_file = DEFAULT_ACTIVE_JSON
 
 # Optional: Support --file argument to pre-select a different journey on launch
-#if args.file and (BASE_DIR / args.file).exists():
-#    st.session_state.selected_json_file = args.file
-
-# Refresh the list of available JSON files
-local_json_files = get_local_json_files()
 
 # ==================== MY JOURNEYS (ROBUST PREVIEW) ====================
-st.sidebar.subheader("📍 My Journeys")
-
-local_json_files = get_local_json_files()
+def journey_preview(json_name, blob_or_path):
+    """(title, count text, has_error) for one journey in the list"""
+    # Try to load preview data safely
+    try:
+        temp_journey = load_data_from_file(blob_or_path)  # This auto-creates default if missing
+        event_count = len(temp_journey)
+        count_text = f"{event_count} place{'s' if event_count != 1 else ''}"
+        has_error = False
+    except Exception as e:
+        logger.warning(f"Failed to preview {json_name}: {e}")
+        count_text = "0 places (load error)"
+        has_error = True
+    return json_name, count_text, has_error
+
+# With warming on, previews that aren't cached load in the background instead
+# of one after another in this run; the list refreshes itself until they're in
+def queue_journey_previews(journey_files, selected_json_file):
+    """Prefetch uncached previews; True while any of them is still loading"""
+    if cache_warmer is None:
+        return False
+    for json_name in journey_files:
+        if json_name != selected_json_file and journey_cache.peek(journey_store.ref(json_name)) is None:
+            cache_warmer.prefetch(json_name)
+    return any(map(cache_warmer.loading, journey_files))
+
+list_poll = JOURNEY_LIST_POLL if queue_journey_previews(local_json_files, st.session_state.selected_json_file) else None
+
+@st.fragment(run_every=list_poll)
+def journey_list(journey_files, selected_json_file):
+    st.subheader("📍 My Journeys")
+
+    if not journey_files:
+        st.info("No journeys found. Create one by adding memories!")
+    else:
+        for json_name in sorted(journey_files):
+            is_current = json_name == selected_json_file
+            blob_or_path = journey_store.ref(json_name)
 
-if not local_json_files:
-    st.sidebar.info("No journeys found. Create one by adding memories!")
-else:
-    for json_name in sorted(local_json_files):
-        is_current = json_name == st.session_state.selected_json_file
+            if cache_warmer is not None and cache_warmer.loading(json_name):
+                title, count_text, has_error = json_name, "loading…", False
+            else:
+                title, count_text, has_error = journey_preview(json_name, blob_or_path)
+            # Button styling
+            if is_current:
+                button_label = f"**→ {title}** • {count_text}"
+                if has_error:
+                    button_label += " ⚠️"
+                disabled = True
+            else:
+                button_label = f"{title} • {count_text}"
+                if has_error:
+                    button_label += " ⚠️"
+                disabled = False
+
+            if st.button(
+                button_label,
+                key=f"journey_switch_{json_name}",
+                disabled=disabled,
+                use_container_width=True
+            ):
+                if not is_current:
+                    flush_autosave()
+                    st.session_state.selected_json_file = json_name
+                    if "journey" in st.session_state:
+                        del st.session_state["journey"]
+                    st.session_state.force_map_refresh += 1
+                    st.rerun()
 
-        # Try to load preview data safely
+    if list_poll is not None and not queue_journey_previews(journey_files, selected_json_file):
+        st.rerun()  # Every preview is cached now; a full run stops the polling
+
+# ==================== VERSION HISTORY ====================
+HISTORY_PREVIEWS = 2  # Loaded versions kept per session (each is a whole journey)
+
+def history_preview(number):
+    """(state, deltas applied, load ms, (added, changed, removed)) of version ``number``
+    against this session's journey. Versions never change, so a loaded one is kept;
+    the comparison is redone only when the journey does"""
+    journey = st.session_state.journey
+    previews = st.session_state.setdefault("history_previews", [])
+    entry = next((p for p in previews if p["ref"] == JSON_BLOB_NAME and p["number"] == number), None)
+    if entry is None:
+        started = time.perf_counter()
+        state, applied = journey_history.load(JSON_BLOB_NAME, number)
+        entry = {"ref": JSON_BLOB_NAME, "number": number, "state": state, "applied": applied,
+                 "ms": (time.perf_counter() - started) * 1000, "journey": None}
+        previews[:] = [entry] + previews[:HISTORY_PREVIEWS - 1]
+    if entry["journey"] is not journey:
+        entry["changes"], entry["journey"] = changes(journey.to_dict(), entry["state"]), journey
+    return entry["state"], entry["applied"], entry["ms"], entry["changes"]
+
+def media_exists(ref):
+    if ref.startswith("gs://"):
+        bucket_name, blob_path = parse_gs_ref(ref)
+        return storage_client.bucket(bucket_name).blob(blob_path).exists()
+    return Path(ref).exists()
+
+def strip_missing_media(state, present):
+    """Drop media references of a restored version whose files were deleted since
+    (with the memories that used them); ``present`` are refs known to exist.
+    Returns how many were dropped"""
+    candidates = {r for e in state["events"] for kind in ("photos", "videos")
+                  for r in (e.get("media") or {}).get(kind, []) if r not in present}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        missing = {r for r, ok in zip(candidates, pool.map(media_exists, candidates)) if not ok}
+    for e in state["events"]:
+        media = e.get("media") or {}
+        for kind in ("photos", "videos"):
+            if kind in media:
+                media[kind] = [r for r in media[kind] if r not in missing]
+    return len(missing)
+
+# A collapsed expander still runs its body: nothing is listed or loaded until asked for
+@st.fragment
+def version_history(selected_json_file):
+    notice = st.session_state.pop("history_notice", None)
+    if notice:
+        st.toast(f"⚠️ {notice}")  # The expander may well be collapsed
+    if not st.toggle("Show saved versions", key=f"history_show_{selected_json_file}"):
+        st.caption("Every save of this journey is kept as a version you can preview and restore.")
+        return
+    versions = journey_history.versions(JSON_BLOB_NAME)
+    if not versions:
+        st.info("No earlier versions yet — every save of this journey adds one.")
+        return
+    st.caption(f"{len(versions)} saved version{'s' if len(versions) != 1 else ''} of the current journey")
+    labels = {v.number: v.label() for v in versions[:HISTORY_LIST_MAX]}
+    version_number = st.selectbox("Version", options=list(labels), format_func=labels.get,
+                                  key=f"history_version_{selected_json_file}")
+    try:
+        state, applied, took_ms, (added, changed, removed) = history_preview(version_number)
+    except Exception as e:
+        st.error("Could not load this version.")
+        logger.error(f"History version {version_number} of {JSON_BLOB_NAME} failed to load: {e}")
+        return
+    title = state.get("autobiography", {}).get("title", selected_json_file)
+    st.markdown(f"**{title}** • {len(state['events'])} memories")
+    # Relative to now: what restoring this version would bring back, revert and drop
+    st.caption(f"Restoring brings back {added}, reverts {changed} and drops {removed} memories "
+               f"• rebuilt from {applied} delta(s) in {took_ms:.0f} ms")
+    unchanged = not (added or changed or removed) \
+        and state.get("autobiography") == dict(st.session_state.journey.meta)
+
+    if st.button("⏪ Restore this version", key=f"history_restore_{selected_json_file}",
+                 use_container_width=True, disabled=unchanged):
+        flush_autosave()  # Pending edits become a version of their own first
         try:
-            blob_or_path = get_json_path(json_name) if IS_CLOUD else str(BASE_DIR / json_name)
-            temp_data = load_data_from_file(blob_or_path)  # This auto-creates default if missing
-            event_count = len(temp_data.get("events", []))
-            title = temp_data.get("autobiography", {}).get("title", json_name.replace(".json", ""))
-            title = " ".join(word.capitalize() for word in title.replace("-", " ").replace("_", " ").split())
-            count_text = f"{event_count} place{'s' if event_count != 1 else ''}"
-            has_error = False
-        except Exception as e:
-            logger.warning(f"Failed to preview {json_name}: {e}")
-            event_count = 0
-            title = json_name.replace(".json", "").replace("_", " ").replace("-", " ")
-            title = " ".join(word.capitalize() for word in title.split())
-            count_text = "0 places (load error)"
-            has_error = True
-        title = json_name
-        # Button styling
-        if is_current:
-            button_label = f"**→ {title}** • {count_text}"
-            if has_error:
-                button_label += " ⚠️"
-            disabled = True
-        else:
-            button_label = f"{title} • {count_text}"
-            if has_error:
-                button_label += " ⚠️"
-            disabled = False
-
-        if st.sidebar.button(
-            button_label,
-            key=f"journey_switch_{json_name}",
-            disabled=disabled,
-            use_container_width=True
-        ):
-            if not is_current:
-                st.session_state.selected_json_file = json_name
-                st.cache_data.clear()
-                if "data" in st.session_state:
-                    del st.session_state["data"]
-                st.session_state.force_map_refresh += 1
-                st.rerun()
-
-st.sidebar.subheader("✨ Journey Operations")
-# ==================== CREATE NEW JOURNEY ====================
-#st.sidebar.markdown("---")
-with st.sidebar.expander("➕ Create New Journey", expanded=False):
-    st.write("Enter a name for your new journey. It will start empty.")
-
-    new_journey_name = st.text_input(
-        "Journey Name*",
-        placeholder="e.g., My 2026 Adventures",
-        help="Use letters, numbers, spaces, or hyphens. The file will be saved as a .json."
-    )
+            current_version, current = journey_cache.snapshot(journey_store, JSON_BLOB_NAME)
+            state = json.loads(json.dumps(state))  # The preview stays as it was saved
+            # Photos of memories deleted since were deleted with them
+            dropped = strip_missing_media(state, set(current.media_refs()))
+            restored = Journey.from_dict(state)
+            version = journey_store.write(JSON_BLOB_NAME, restored.to_json(), if_version=current_version)
+            journey_cache.put(JSON_BLOB_NAME, version, restored, publish=True)
+            # The journey as it was stays a version too, so a restore can be undone
+            journey_history.record(JSON_BLOB_NAME, restored, previous=current)
+            st.session_state.journey = st.session_state.journey_base = restored
+            st.session_state.journey_version = version
+            st.session_state.force_map_refresh += 1
+            if dropped:
+                st.session_state.history_notice = (f"Restored v{version_number}, but {dropped} photo(s)/video(s) "
+                                                   f"deleted since then could not be brought back.")
+            st.rerun()
+        except WriteConflict:
+            st.error("The journey was saved in another session meanwhile. Please try again.")
+
+# ==================== JOURNEY OPERATIONS ====================
+# Typing a name or picking a journey in here only reruns this region
+@st.fragment
+def journey_operations(journey_files, selected_json_file):
+    st.subheader("✨ Journey Operations")
+    # ==================== CREATE NEW JOURNEY ====================
+    #st.markdown("---")
+    with st.expander("➕ Create New Journey", expanded=False):
+        st.write("Enter a name for your new journey. It will start empty.")
 
-    if new_journey_name:
-        # Clean the input to make a safe filename
-        clean_name = (
-            new_journey_name.strip()
-            .lower()
-            .replace(" ", "-")
-            .replace("_", "-")
-            .replace("/", "")
-            .replace("\\", "")
+        new_journey_name = st.text_input(
+            "Journey Name*",
+            placeholder="e.g., My 2026 Adventures",
+            help="Use letters, numbers, spaces, or hyphens. The file will be saved as a .json."
         )
-        if not clean_name:
-            st.error("Please enter a valid name.")
-        else:
-            new_filename = f"{clean_name}.json"
-            new_file_path = BASE_DIR / new_filename
 
-            if new_file_path.exists():
-                st.warning(f"A journey named **{new_filename}** already exists. Choose a different name.")
+        if new_journey_name:
+            # Clean the input to make a safe filename
+            clean_name = (
+                new_journey_name.strip()
+                .lower()
+                .replace(" ", "-")
+                .replace("_", "-")
+                .replace("/", "")
+                .replace("\\", "")
+            )
+            if not clean_name:
+                st.error("Please enter a valid name.")
             else:
-                col_create, col_cancel = st.columns(2)
-                with col_create:
-                    if st.button("✅ Create Journey", type="primary", use_container_width=True):
-                        try:
-                            # Default JSON structure
-                            default_data = {
-                                "autobiography": {
-                                    "title": new_journey_name,
-                                    "author": "Your Name",
-                                    "created_date": datetime.now().strftime("%Y-%m-%d"),
-                                    "last_updated": datetime.now().strftime("%Y-%m-%d")
-                                },
-                                "events": []
-                            }
-
-                            # Write the new JSON file
-                            new_file_path.write_text(
-                                json.dumps(default_data, indent=4, ensure_ascii=False),
-                                encoding="utf-8"
-                            )
-
-                            # Switch to the new journey
-                            st.session_state.selected_json_file = new_filename
-                            save_data_to_storage(st.session_state.data)
-                            # todo JSON_FILE.write_text(json.dumps(default_data, indent=4, ensure_ascii=False),
-                            #                     encoding="utf-8")
-
-                            # Clear cache and reset state
-                            st.cache_data.clear()
-                            if "data" in st.session_state:
-                                del st.session_state["data"]
-                            if "editing_event_id" in st.session_state:
-                                del st.session_state["editing_event_id"]
-                            keys_to_reset = ["map_center", "map_zoom", "force_map_refresh"]
-                            for k in keys_to_reset:
-                                if k in st.session_state:
-                                    del st.session_state[k]
-
-                            st.success(f"✅ Created and switched to: **{new_journey_name}** (0 places)")
-                            st.rerun()
+                new_filename = f"{clean_name}.json"
 
-                        except Exception as e:
-                            st.error(f"Failed to create journey: {e}")
-
-                with col_cancel:
-                    if st.button("❌ Cancel", type="secondary", use_container_width=True):
-                        st.rerun()
+                if new_filename in journey_files:
+                    st.warning(f"A journey named **{new_filename}** already exists. Choose a different name.")
+                else:
+                    col_create, col_cancel = st.columns(2)
+                    with col_create:
+                        if st.button("✅ Create Journey", type="primary", use_container_width=True):
+                            try:
+                                # Default JSON structure
+                                default_data = default_journey_dict(new_journey_name)
+
+                                # Write the new JSON file (locally or in GCS), never over an existing one
+                                journey_store.write(journey_store.ref(new_filename),
+                                                    Journey.from_dict(default_data).to_json(),
+                                                    if_version=NO_OBJECT)
+                                journey_lists.invalidate(journey_store)
+
+                                # Switch to the new journey
+                                flush_autosave()
+                                st.session_state.selected_json_file = new_filename
+                                # todo JSON_FILE.write_text(json.dumps(default_data, indent=4, ensure_ascii=False),
+                                #                     encoding="utf-8")
 
-# ==================== RENAME JOURNEY (FIXED ORDER + SAFE) ====================
-with st.sidebar.expander("✏️ Rename a Journey", expanded=False):
-    st.write("Change the name of an existing journey. This renames the file and updates the title.")
+                                # Drop any stale cache entry for the new file and reset state
+                                journey_cache.invalidate(journey_store.ref(new_filename))
+                                if "journey" in st.session_state:
+                                    del st.session_state["journey"]
+                                if "editing_event_id" in st.session_state:
+                                    del st.session_state["editing_event_id"]
+                                keys_to_reset = ["map_center", "map_zoom", "force_map_refresh"]
+                                for k in keys_to_reset:
+                                    if k in st.session_state:
+                                        del st.session_state[k]
+
+                                st.success(f"✅ Created and switched to: **{new_journey_name}** (0 places)")
+                                st.rerun()
 
-    available_journeys = get_local_json_files()
+                            except Exception as e:
+                                st.error(f"Failed to create journey: {e}")
 
-    if not available_journeys:
-        st.info("No journeys available to rename.")
-    else:
-        # Select journey to rename
-        journey_to_rename = st.selectbox(
-            "Select journey to rename",
-            options=available_journeys,
-            index=available_journeys.index(st.session_state.selected_json_file)
-            if st.session_state.selected_json_file in available_journeys else 0,
-            help="Choose the journey you want to rename"
-        )
+                    with col_cancel:
+                        if st.button("❌ Cancel", type="secondary", use_container_width=True):
+                            rerun_fragment()
 
-        # === LOAD AND PREVIEW THE SELECTED JOURNEY FIRST ===
-        blob_or_path = get_json_path(journey_to_rename) if IS_CLOUD else str(BASE_DIR / journey_to_rename)
-        try:
-            current_data = load_data_from_file(blob_or_path)
-            current_title = current_data.get("autobiography", {}).get("title", journey_to_rename.replace(".json", ""))
-            event_count = len(current_data.get("events", []))
+    # ==================== RENAME JOURNEY (FIXED ORDER + SAFE) ====================
+    with st.expander("✏️ Rename a Journey", expanded=False):
+        st.write("Change the name of an existing journey. This renames the file and updates the title.")
 
-            # Format nice display name
-            current_display = journey_to_rename.replace(".json", "").replace("_", " ").replace("-", " ")
-            current_display = " ".join(word.capitalize() for word in current_display.split())
+        available_journeys = journey_files
 
-            st.info(f"**Current:** {current_title} • {event_count} memory{'s' if event_count != 1 else ''} • File: `{journey_to_rename}`")
-        except Exception as e:
-            st.error(f"Could not load journey data: {e}")
-            current_display = journey_to_rename.replace(".json", "")
-            current_title = current_display
-            current_data = None
+        if not available_journeys:
+            st.info("No journeys available to rename.")
+        else:
+            # Select journey to rename
+            journey_to_rename = st.selectbox(
+                "Select journey to rename",
+                options=available_journeys,
+                index=available_journeys.index(selected_json_file)
+                if selected_json_file in available_journeys else 0,
+                help="Choose the journey you want to rename"
+            )
 
-        # === NOW USE current_display SAFELY ===
-        new_journey_name = st.text_input(
-            "New Journey Name*",
-            value=current_title,  # Pre-fill with actual title, not filename
-            placeholder="e.g., Europe Adventure 2025",
-            help="This will become the new display title and filename"
-        )
+            # === LOAD AND PREVIEW THE SELECTED JOURNEY FIRST ===
+            blob_or_path = journey_store.ref(journey_to_rename)
+            try:
+                current_data = load_data_from_file(blob_or_path)
+                current_title = current_data.meta.get("title", journey_to_rename.replace(".json", ""))
+                event_count = len(current_data)
+
+                # Format nice display name
+                current_display = journey_to_rename.replace(".json", "").replace("_", " ").replace("-", " ")
+                current_display = " ".join(word.capitalize() for word in current_display.split())
+
+                st.info(f"**Current:** {current_title} • {event_count} memory{'s' if event_count != 1 else ''} • File: `{journey_to_rename}`")
+            except Exception as e:
+                st.error(f"Could not load journey data: {e}")
+                current_display = journey_to_rename.replace(".json", "")
+                current_title = current_display
+                current_data = None
+
+            # === NOW USE current_display SAFELY ===
+            new_journey_name = st.text_input(
+                "New Journey Name*",
+                value=current_title,  # Pre-fill with actual title, not filename
+                placeholder="e.g., Europe Adventure 2025",
+                help="This will become the new display title and filename"
+            )
 
-        if new_journey_name and new_journey_name.strip():
-            if new_journey_name.strip() == current_title:
-                st.info("New name is the same as current — nothing to do.")
-            else:
-                # Clean for safe filename
-                clean_name = (
-                    new_journey_name.strip()
-                    .lower()
-                    .replace(" ", "-")
-                    .replace("_", "-")
-                    .replace("/", "")
-                    .replace("\\", "")
-                    .replace(".", "")
-                )
-                if not clean_name:
-                    st.error("Invalid name – please use letters, numbers, spaces, or hyphens.")
+            if new_journey_name and new_journey_name.strip():
+                if new_journey_name.strip() == current_title:
+                    st.info("New name is the same as current — nothing to do.")
                 else:
-                    new_filename = f"{clean_name}.json"
-                    new_blob_name = get_json_path(new_filename) if IS_CLOUD else str(BASE_DIR / new_filename)
-
-                    # Check if new filename already exists
-                    if new_filename in available_journeys:
-                        st.warning(f"A journey named **{new_filename}** already exists. Choose a different name.")
+                    # Clean for safe filename
+                    clean_name = (
+                        new_journey_name.strip()
+                        .lower()
+                        .replace(" ", "-")
+                        .replace("_", "-")
+                        .replace("/", "")
+                        .replace("\\", "")
+                        .replace(".", "")
+                    )
+                    if not clean_name:
+                        st.error("Invalid name – please use letters, numbers, spaces, or hyphens.")
                     else:
-                        col_rename, col_cancel = st.columns(2)
-                        with col_rename:
-                            if st.button("✏️ Rename Journey", type="primary", use_container_width=True):
-                                if current_data is None:
-                                    st.error("Cannot rename: failed to load current journey data.")
-                                else:
-                                    try:
-                                        # Update title in data
-                                        current_data["autobiography"]["title"] = new_journey_name.strip()
-                                        current_data["autobiography"]["last_updated"] = datetime.now().strftime("%Y-%m-%d")
-
-                                        json_text = json.dumps(current_data, indent=4, ensure_ascii=False)
-
-                                        # Save to new location
-                                        if IS_CLOUD:
-                                            upload_to_gcs(json_text.encode("utf-8"), get_json_path(new_filename), "application/json")
-                                            # Delete old blob
-                                            bucket.blob(get_json_path(journey_to_rename)).delete()
-                                            st.success(f"✅ Journey renamed to **{new_journey_name}** in cloud!")
-                                        else:
-                                            (BASE_DIR / new_filename).write_text(json_text, encoding="utf-8")
-                                            (BASE_DIR / journey_to_rename).unlink(missing_ok=True)
-                                            st.success(f"✅ Journey renamed to **{new_journey_name}** locally!")
-
-                                        # If renaming the currently active journey, update session
-                                        if journey_to_rename == st.session_state.selected_json_file:
-                                            st.session_state.selected_json_file = new_filename
-                                            st.cache_data.clear()
-                                            if "data" in st.session_state:
-                                                del st.session_state["data"]
-
-                                        st.rerun()
-
-                                    except Exception as e:
-                                        st.error(f"Rename failed: {e}")
-                                        logger.error(f"Rename error: {e}")
-
-                        with col_cancel:
-                            st.button("❌ Cancel", type="secondary", use_container_width=True)
-        else:
-            st.warning("Please enter a new journey name.")
-
-# ==================== UPLOAD & RESTORE JSON (GCS COMPATIBLE) ====================
-with st.sidebar.expander("📤 Upload a saved Journey", expanded=False):
-    st.write("Restore a previously backed-up `.json` file. This will **replace** the current journey's data.")
+                        new_filename = f"{clean_name}.json"
+                        new_blob_name = journey_store.ref(new_filename)
+
+                        # Check if new filename already exists
+                        if new_filename in available_journeys:
+                            st.warning(f"A journey named **{new_filename}** already exists. Choose a different name.")
+                        else:
+                            col_rename, col_cancel = st.columns(2)
+                            with col_rename:
+                                if st.button("✏️ Rename Journey", type="primary", use_container_width=True):
+                                    if current_data is None:
+                                        st.error("Cannot rename: failed to load current journey data.")
+                                    else:
+                                        try:
+                                            if journey_to_rename == selected_json_file:
+                                                # Rename what's saved, including edits still in the buffer
+                                                flush_autosave()
+                                            source_version, current_data = load_journey_snapshot(blob_or_path)
+
+                                            # Move server-side (GCS rewrite / local rename), only if it's
+                                            # still the version we loaded and never over another journey
+                                            moved_version = journey_store.move(blob_or_path, new_blob_name,
+                                                                               if_version=source_version)
+
+                                            # The title lives in the document: one conditional write on the copy
+                                            renamed = current_data.with_meta(
+                                                title=new_journey_name.strip(),
+                                                last_updated=datetime.now().strftime("%Y-%m-%d")
+                                            )
+                                            _, renamed, _ = save_with_merge(journey_store, new_blob_name, renamed,
+                                                                            base=current_data,
+                                                                            base_version=moved_version)
+                                            # Its versions move along, then the retitled one follows them
+                                            journey_history.move(blob_or_path, new_blob_name)
+                                            journey_history.record(new_blob_name, renamed, previous=current_data)
+                                            where = "in cloud" if IS_CLOUD else "locally"
+                                            st.success(f"✅ Journey renamed to **{new_journey_name}** {where}!")
+
+                                            journey_cache.invalidate(journey_store.ref(journey_to_rename))
+                                            journey_cache.invalidate(journey_store.ref(new_filename))
+                                            journey_lists.invalidate(journey_store)
+
+                                            # If renaming the currently active journey, update session
+                                            if journey_to_rename == selected_json_file:
+                                                st.session_state.selected_json_file = new_filename
+                                                if "journey" in st.session_state:
+                                                    del st.session_state["journey"]
+
+                                            st.rerun()
+
+                                        except WriteConflict:
+                                            st.error("The journey changed (or the new name was taken) while renaming. "
+                                                     "Nothing was lost — please try again.")
+                                        except Exception as e:
+                                            st.error(f"Rename failed: {e}")
+                                            logger.error(f"Rename error: {e}")
+
+                            with col_cancel:
+                                st.button("❌ Cancel", type="secondary", use_container_width=True)
+            else:
+                st.warning("Please enter a new journey name.")
 
-    uploaded_file = st.file_uploader(
-        "Select a backup JSON file to restore",
-        type=["json"],
-        key="json_restore_uploader"
-    )
+    # ==================== UPLOAD & RESTORE JSON OR ARCHIVE (GCS COMPATIBLE) ====================
+    with st.expander("📤 Upload a saved Journey", expanded=False):
+        st.write("Restore a previously backed-up `.json` file or a full `.zip` archive (with photos and videos). "
+                 "This will **replace** the journey with the same name.")
 
-    if uploaded_file is not None:
-        try:
-            uploaded_bytes = uploaded_file.read()
-            uploaded_data = json.loads(uploaded_bytes.decode("utf-8"))
+        uploaded_file = st.file_uploader(
+            "Select a backup JSON or archive to restore",
+            type=["json", "zip"],
+            key="json_restore_uploader"
+        )
 
-            if not all(key in uploaded_data for key in ["autobiography", "events"]):
-                st.error("Invalid backup: missing 'autobiography' or 'events' section.")
-            elif not isinstance(uploaded_data["events"], list):
-                st.error("Invalid backup: 'events' must be a list.")
-            else:
-                title = uploaded_data["autobiography"].get("title", uploaded_file.name.replace(".json", ""))
-                event_count = len(uploaded_data["events"])
-                st.success(f"Valid backup: **{uploaded_file.name}** — {title} ({event_count} memories)")
+        if uploaded_file is not None:
+            try:
+                # Parsed incrementally, event by event; remembered per upload across reruns
+                preview = st.session_state.get("restore_preview")
+                if preview is None or preview[0] != uploaded_file.file_id:
+                    preview = (uploaded_file.file_id, inspect_upload(uploaded_file))
+                    st.session_state.restore_preview = preview
+                title, event_count, is_archive = preview[1]
+                title = title or Path(uploaded_file.name).stem
+                kind = "archive" if is_archive else "backup"
+                st.success(f"Valid {kind}: **{uploaded_file.name}** — {title} ({event_count} memories)")
 
                 st.warning("⚠️ This will **replace all data** in the current journey.")
 
@@ -1280,24 +1770,43 @@ with st.sidebar.expander("📤 Upload a saved Journey", expanded=False):
                 with col1:
                     if st.button("✅ Yes, Restore Now", type="primary", use_container_width=True):
                         try:
-                            # Upload directly to GCS under journeys/ with original name (or cleaned)
-                            restore_filename = uploaded_file.name
-                            blob_name = get_json_path(restore_filename)
-
-                            if IS_CLOUD:
-                                upload_to_gcs(uploaded_bytes, blob_name, "application/json")
-                                st.success(f"✅ Restored **{title}** to cloud storage!")
-                            else:
-                                (BASE_DIR / restore_filename).write_bytes(uploaded_bytes)
-                                st.success(f"✅ Restored **{title}** locally!")
+                            # Archive media is re-uploaded (skipping what's already stored) and relinked
+                            sink = GCSMediaSink(bucket) if IS_CLOUD else LocalMediaSink(UPLOADS_PHOTOS, UPLOADS_VIDEOS)
+                            bar = st.progress(0.0, text="Restoring…")
+                            archived_name, restored, report = restore_upload(
+                                uploaded_file, sink,
+                                progress=lambda done, total: bar.progress(done / total, text=f"Media {done}/{total}")
+                            )
+                            bar.empty()
+                            restore_filename = archived_name if is_archive and archived_name \
+                                else f"{Path(uploaded_file.name).stem}.json"
+                            flush_autosave()  # Buffered edits must land before, not on top of, the restore
+                            restore_ref = journey_store.ref(restore_filename)
+                            try:
+                                replaced = journey_cache.load(journey_store, restore_ref)
+                            except Exception:
+                                replaced = None  # A new journey
+                            restored = Journey.from_dict(restored)
+                            journey_store.write(restore_ref, restored.to_json())
+                            # What it replaced stays in the history
+                            journey_history.record(restore_ref, restored, previous=replaced)
+
+                            where = "cloud storage" if IS_CLOUD else "locally"
+                            st.success(f"✅ Restored **{title}** {where}!")
+                            if is_archive:
+                                logger.info(f"Restored {restore_filename}: {report}")
+                            if report["failed"] or report["missing"]:
+                                st.warning(f"{len(report['failed']) + len(report['missing'])} media file(s) "
+                                           f"could not be restored.")
 
                             # Switch to the restored journey
                             st.session_state.selected_json_file = restore_filename
 
-                            # Full reload
-                            st.cache_data.clear()
-                            if "data" in st.session_state:
-                                del st.session_state["data"]
+                            # Full reload of just the restored journey
+                            journey_cache.invalidate(journey_store.ref(restore_filename))
+                            journey_lists.invalidate(journey_store)
+                            if "journey" in st.session_state:
+                                del st.session_state["journey"]
                             st.session_state.force_map_refresh += 1
 
                             st.rerun()
@@ -1310,196 +1819,215 @@ with st.sidebar.expander("📤 Upload a saved Journey", expanded=False):
                     if st.button("❌ Cancel", type="secondary", use_container_width=True):
                         st.info("Restore cancelled.")
 
-        except json.JSONDecodeError:
-            st.error("Invalid JSON file — could not parse.")
-        except Exception as e:
-            st.error(f"Error reading file: {e}")
+            except ValueError as e:
+                st.error(f"Invalid backup: {e}")
+            except Exception as e:
+                st.error(f"Error reading file: {e}")
 
-# ==================== DELETE JOURNEY FILE (GCS + Local Compatible) ====================
-with st.sidebar.expander("🗑️ Delete a saved Journey", expanded=False):
-    st.warning("⚠️ This will **permanently delete** a journey file and all its photos/videos.")
+    # ==================== VERSION HISTORY ====================
+    with st.expander("🕘 Version History", expanded=False):
+        version_history(selected_json_file)
 
-    # Get current list of journeys (from GCS or local)
-    available_journeys = get_local_json_files()
-    available_for_deletion = [
-        f for f in available_journeys
-        if f != st.session_state.selected_json_file
-    ]
+    # ==================== DELETE JOURNEY FILE (GCS + Local Compatible) ====================
+    with st.expander("🗑️ Delete a saved Journey", expanded=False):
+        st.warning("⚠️ This will **permanently delete** a journey file and all its photos/videos.")
 
-    if not available_for_deletion:
-        st.info("No other journey files available to delete.")
-    else:
-        file_to_delete = st.selectbox(
-            "Select a journey to delete",
-            options=available_for_deletion,
-            help="Only inactive journeys can be deleted"
-        )
-
-        # Load preview data
-        blob_or_path = get_json_path(file_to_delete) if IS_CLOUD else str(BASE_DIR / file_to_delete)
-        try:
-            preview_data = load_data_from_file(blob_or_path)
-            event_count = len(preview_data.get("events", []))
-            title = preview_data.get("autobiography", {}).get("title", file_to_delete.replace(".json", ""))
-            st.write(f"**{title}** • {event_count} memories • File: `{file_to_delete}`")
-        except:
-            st.write(f"File: `{file_to_delete}` (preview unavailable)")
-
-        col_confirm, col_cancel = st.columns(2)
-
-        with col_confirm:
-            if st.button("🗑️ Delete Permanently", type="primary", use_container_width=True):
-                try:
-                    # 1. Delete all media files (photos + videos)
-                    for event in preview_data.get("events", []):
-                        for media_type in ["photos", "videos"]:
-                            for media_url in event.get("media", {}).get(media_type, []):
-                                try:
-                                    if media_url.startswith("gs://"):
-                                        # GCS path
-                                        parts = media_url[5:].split("/", 1)
-                                        bucket_name = parts[0]
-                                        blob_path = parts[1]
-                                        storage.Client().bucket(bucket_name).blob(blob_path).delete()
-                                    else:
-                                        # Local path
-                                        Path(media_url).unlink(missing_ok=True)
-                                except Exception as e:
-                                    logger.warning(f"Failed to delete media {media_url}: {e}")
-
-                    # 2. Delete the journey JSON itself
-                    if IS_CLOUD:
-                        blob_name = get_json_path(file_to_delete)
-                        bucket.blob(blob_name).delete()
-                        st.success(f"✅ Journey **{file_to_delete}** deleted permanently from cloud.")
-                    else:
-                        (BASE_DIR / file_to_delete).unlink()
-                        st.success(f"✅ Journey **{file_to_delete}** deleted permanently.")
+        # Get current list of journeys (from GCS or local)
+        available_journeys = journey_files
+        available_for_deletion = [
+            f for f in available_journeys
+            if f != selected_json_file
+        ]
 
-                    # Refresh journey list
-                    st.rerun()
+        if not available_for_deletion:
+            st.info("No other journey files available to delete.")
+        else:
+            file_to_delete = st.selectbox(
+                "Select a journey to delete",
+                options=available_for_deletion,
+                help="Only inactive journeys can be deleted"
+            )
 
-                except Exception as e:
-                    st.error(f"Failed to delete: {e}")
-                    logger.error(f"Delete journey failed: {e}")
-
-        with col_cancel:
-            st.button("Cancel", type="secondary", use_container_width=True)
-
-# # ==================== BACKUP / DOWNLOAD (WORKS ON CLOUD + LOCAL) ====================
-#
-# if IS_CLOUD:
-#     # Fetch current journey data from GCS
-#     try:
-#         current_blob_name = get_json_path(st.session_state.selected_json_file)
-#         json_bytes = download_from_gcs(current_blob_name)
-#
-#         st.sidebar.download_button(
-#             label="💾 Backup Current Journey",
-#             data=json_bytes,
-#             file_name=f"{st.session_state.selected_json_file.replace('.json', '')}_backup_{datetime.now().strftime('%Y%m%d')}.json",
-#             mime="application/json",
-#             use_container_width=True
-#         )
-#         st.sidebar.caption("Downloads your current journey as a JSON backup.")
-#     except Exception as e:
-#         st.sidebar.error(f"Failed to prepare backup: {e}")
-#         logger.error(f"Backup download failed: {e}")
-# else:
-#     # Local fallback — safe because files are writable locally
-#     try:
-#         with open(JSON_FILE, "rb") as f:
-#             st.sidebar.download_button(
-#                 label="💾 Backup Current Journey",
-#                 data=f,
-#                 file_name=f"{JSON_FILE.stem}_backup_{datetime.now().strftime('%Y%m%d')}.json",
-#                 mime="application/json",
-#                 use_container_width=True
-#             )
-#         st.sidebar.caption("Downloads your current journey as a JSON backup.")
-#     except Exception as e:
-#         st.sidebar.error(f"Backup failed (local): {e}")
-
-# ==================== DOWNLOAD JOURNEY BACKUP (SELECT ANY JOURNEY) ====================
-with st.sidebar.expander("📥 Download Journey Backup", expanded=False):
-    st.write("Select any journey and download its complete JSON backup for safekeeping or sharing.")
-
-    available_journeys = get_local_json_files()
-
-    if not available_journeys:
-        st.info("No journeys available to download.")
-    else:
-        # Dropdown to select which journey to download
-        journey_to_download = st.selectbox(
-            "Choose a journey to backup",
-            options=available_journeys,
-            format_func=lambda x: x.replace(".json", "").replace("_", " ").replace("-", " ").title(),
-            help="All journeys are listed, including the current one"
-        )
+            # Load preview data
+            blob_or_path = journey_store.ref(file_to_delete)
+            try:
+                preview_data = load_data_from_file(blob_or_path)
+                event_count = len(preview_data)
+                title = preview_data.meta.get("title", file_to_delete.replace(".json", ""))
+                st.write(f"**{title}** • {event_count} memories • File: `{file_to_delete}`")
+            except:
+                st.write(f"File: `{file_to_delete}` (preview unavailable)")
+
+            col_confirm, col_cancel = st.columns(2)
+
+            with col_confirm:
+                if st.button("🗑️ Delete Permanently", type="primary", use_container_width=True):
+                    try:
+                        # 1. Delete all media files (photos + videos), 100 per request
+                        report = delete_media(preview_data.media_refs(), storage_client if IS_CLOUD else None)
+                        if report["failed"]:
+                            st.warning(f"{len(report['failed'])} media file(s) could not be deleted; "
+                                       f"the orphan cleanup will pick them up.")
+
+                        # 2. Delete the journey JSON itself
+                        if IS_CLOUD:
+                            bucket.blob(journey_store.ref(file_to_delete)).delete()
+                            st.success(f"✅ Journey **{file_to_delete}** deleted permanently from cloud.")
+                        else:
+                            Path(journey_store.ref(file_to_delete)).unlink()
+                            st.success(f"✅ Journey **{file_to_delete}** deleted permanently.")
+
+                        autosave.discard_ref(journey_store.ref(file_to_delete))
+                        journey_history.drop(journey_store.ref(file_to_delete))
+                        journey_cache.invalidate(journey_store.ref(file_to_delete))
+                        journey_lists.invalidate(journey_store)
+
+                        # Refresh journey list
+                        st.rerun()
 
-        # Load the selected journey data safely
-        try:
-            blob_or_path = get_json_path(journey_to_download) if IS_CLOUD else str(BASE_DIR / journey_to_download)
-            if IS_CLOUD:
-                json_bytes = download_from_gcs(get_json_path(journey_to_download))
-            else:
-                json_bytes = Path(blob_or_path).read_bytes()
-
-            # Load metadata for nice display
-            temp_data = json.loads(json_bytes.decode("utf-8"))
-            title = temp_data.get("autobiography", {}).get("title", journey_to_download.replace(".json", ""))
-            title_display = " ".join(word.capitalize() for word in title.replace("-", " ").replace("_", " ").split())
-            event_count = len(temp_data.get("events", []))
-
-            # Show info
-            is_current = journey_to_download == st.session_state.selected_json_file
-            current_label = " (current)" if is_current else ""
-            st.markdown(f"**{title_display}{current_label}**")
-            st.caption(f"{event_count} memor{'y' if event_count == 1 else 'ies'} • File: `{journey_to_download}`")
-
-            # Generate timestamped filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-            base_name = journey_to_download.replace(".json", "")
-            backup_filename = f"{base_name}_backup_{timestamp}.json"
-
-            # Download button
-            st.download_button(
-                label="📥 Download Backup Now",
-                data=json_bytes,
-                file_name=backup_filename,
-                mime="application/json",
-                use_container_width=True,
-                key=f"download_backup_{journey_to_download}"
+                    except Exception as e:
+                        st.error(f"Failed to delete: {e}")
+                        logger.error(f"Delete journey failed: {e}")
+
+            with col_cancel:
+                st.button("Cancel", type="secondary", use_container_width=True)
+
+    # # ==================== BACKUP / DOWNLOAD (WORKS ON CLOUD + LOCAL) ====================
+    #
+    # if IS_CLOUD:
+    #     # Fetch current journey data from GCS
+    #     try:
+    #         current_blob_name = get_json_path(st.session_state.selected_json_file)
+    #         json_bytes = download_from_gcs(current_blob_name)
+    #
+    #         st.download_button(
+    #             label="💾 Backup Current Journey",
+    #             data=json_bytes,
+    #             file_name=f"{st.session_state.selected_json_file.replace('.json', '')}_backup_{datetime.now().strftime('%Y%m%d')}.json",
+    #             mime="application/json",
+    #             use_container_width=True
+    #         )
+    #         st.caption("Downloads your current journey as a JSON backup.")
+    #     except Exception as e:
+    #         st.error(f"Failed to prepare backup: {e}")
+    #         logger.error(f"Backup download failed: {e}")
+    # else:
+    #     # Local fallback — safe because files are writable locally
+    #     try:
+    #         with open(JSON_FILE, "rb") as f:
+    #             st.download_button(
+    #                 label="💾 Backup Current Journey",
+    #                 data=f,
+    #                 file_name=f"{JSON_FILE.stem}_backup_{datetime.now().strftime('%Y%m%d')}.json",
+    #                 mime="application/json",
+    #                 use_container_width=True
+    #             )
+    #         st.caption("Downloads your current journey as a JSON backup.")
+    #     except Exception as e:
+    #         st.error(f"Backup failed (local): {e}")
+
+    # ==================== DOWNLOAD JOURNEY BACKUP (SELECT ANY JOURNEY) ====================
+    with st.expander("📥 Download Journey Backup", expanded=False):
+        st.write("Select any journey and download its complete JSON backup for safekeeping or sharing.")
+
+        available_journeys = journey_files
+
+        if not available_journeys:
+            st.info("No journeys available to download.")
+        else:
+            # Dropdown to select which journey to download
+            journey_to_download = st.selectbox(
+                "Choose a journey to backup",
+                options=available_journeys,
+                format_func=lambda x: x.replace(".json", "").replace("_", " ").replace("-", " ").title(),
+                help="All journeys are listed, including the current one"
             )
 
-        except Exception as e:
-            st.error("Could not load journey data for download.")
-            logger.error(f"Failed to prepare download for {journey_to_download}: {e}")
+            # Load the selected journey data safely
+            try:
+                blob_or_path = journey_store.ref(journey_to_download)
+                if IS_CLOUD:
+                    json_bytes = download_from_gcs(blob_or_path)
+                else:
+                    json_bytes = Path(blob_or_path).read_bytes()
+
+                # Load metadata for nice display
+                temp_data = json.loads(json_bytes.decode("utf-8"))
+                title = temp_data.get("autobiography", {}).get("title", journey_to_download.replace(".json", ""))
+                title_display = " ".join(word.capitalize() for word in title.replace("-", " ").replace("_", " ").split())
+                event_count = len(temp_data.get("events", []))
+
+                # Show info
+                is_current = journey_to_download == selected_json_file
+                current_label = " (current)" if is_current else ""
+                st.markdown(f"**{title_display}{current_label}**")
+                st.caption(f"{event_count} memor{'y' if event_count == 1 else 'ies'} • File: `{journey_to_download}`")
+
+                # Generate timestamped filename
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+                base_name = journey_to_download.replace(".json", "")
+                backup_filename = f"{base_name}_backup_{timestamp}.json"
+
+                # Download button
+                st.download_button(
+                    label="📥 Download Backup Now",
+                    data=json_bytes,
+                    file_name=backup_filename,
+                    mime="application/json",
+                    use_container_width=True,
+                    key=f"download_backup_{journey_to_download}"
+                )
 
-# ==================== MODE SELECTION (INLINE ON ONE LINE) ====================
-# Create a single row with label and radio buttons
-col_label, col_radio = st.sidebar.columns([1, 3])  # Adjust ratio: 1 for label, 3 for buttons
+                # === FULL ARCHIVE: JSON + PHOTOS + VIDEOS ===
+                st.caption("Or include every photo and video in a ZIP archive:")
+                if st.button("📦 Prepare Full Archive", key=f"prepare_archive_{journey_to_download}",
+                             use_container_width=True):
+                    cleanup_exports(EXPORT_DIR)
+                    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+                    archive_path = EXPORT_DIR / f"{base_name}_{st.session_state.session_key[:8]}.zip"
+                    bar = st.progress(0.0, text="Collecting media…")
+                    try:
+                        # Streamed to disk with GCS media prefetched ahead, so memory stays flat
+                        manifest = write_archive_file(
+                            load_data_from_file(blob_or_path), archive_path,
+                            MediaFetcher(storage_client if IS_CLOUD else None, BASE_DIR),
+                            name=journey_to_download,
+                            progress=lambda done, total: bar.progress(done / total, text=f"Media {done}/{total}")
+                        )
+                        st.session_state.archive_ready = (journey_to_download, str(archive_path), len(manifest["missing"]))
+                    except Exception as e:
+                        st.error(f"Could not build the archive: {e}")
+                        logger.error(f"Archive export of {journey_to_download} failed: {e}")
+                    bar.empty()
+
+                ready = st.session_state.get("archive_ready")
+                if ready and ready[0] == journey_to_download and Path(ready[1]).exists():
+                    archive_path = Path(ready[1])
+                    size = archive_path.stat().st_size
+                    if ready[2]:
+                        st.warning(f"{ready[2]} media file(s) could not be read and were left out.")
+                    if size <= ARCHIVE_DOWNLOAD_MAX_BYTES:
+                        st.download_button(
+                            label=f"📥 Download Archive ({size / 1024 / 1024:.1f} MB)",
+                            data=lambda: archive_path.read_bytes(),  # Read only when clicked
+                            file_name=f"{base_name}_archive_{timestamp}.zip",
+                            mime="application/zip",
+                            on_click="ignore",
+                            use_container_width=True,
+                            key=f"download_archive_{journey_to_download}"
+                        )
+                    else:
+                        st.info(f"The archive is {size / 1024 ** 3:.1f} GB, too large to download through the browser. "
+                                f"Run `python journey_cli.py archive {journey_to_download} --out <folder>` instead.")
 
-with col_label:
-    pass
-    # st.markdown("<div style='padding-top: 8px; font-weight: 600;'>Mode:</div>", unsafe_allow_html=True)
-    # The padding-top aligns it vertically with the radio buttons
-
-with col_radio:
-#    mode = st.radio(
-#        label="Mode selection (hidden)",           # Hidden real label
-#        options=["View Mode", "Edit Mode"],
-#        index=0 if st.session_state.app_mode == "View Mode" else 1,
-#        horizontal=True,
-#        label_visibility="collapsed",              # Hide the actual label
-#        key="mode_radio"
-#    )
-#    # Update session state when mode changes
-#    if mode != st.session_state.app_mode:
-#        st.session_state.app_mode = mode
-#        st.rerun()
-
-    mode = st.sidebar.radio(
+            except Exception as e:
+                st.error("Could not load journey data for download.")
+                logger.error(f"Failed to prepare download for {journey_to_download}: {e}")
+
+# ==================== MODE SELECTION (INLINE ON ONE LINE) ====================
+@st.fragment
+def mode_selector():
+    mode = st.radio(
         label="App mode",                  # Hidden or visible as needed
         options=["👁️ View Mode", "✏️ Edit Mode"],
         index=0 if st.session_state.app_mode == "View Mode" else 1,
@@ -1507,12 +2035,45 @@ with col_radio:
         label_visibility="collapsed",      # Hide the main label since we have markdown above
         key="mode_radio"
     )
-# Clean the returned value (remove emoji for clean comparison/storage)
-clean_mode = mode.split(" ", 1)[1] if " " in mode else mode  # → "View Mode" or "Edit Mode"
-
-if clean_mode != st.session_state.app_mode:
-    st.session_state.app_mode = clean_mode
-    st.rerun()
+    # Clean the returned value (remove emoji for clean comparison/storage)
+    clean_mode = mode.split(" ", 1)[1] if " " in mode else mode  # → "View Mode" or "Edit Mode"
+
+    if clean_mode != st.session_state.app_mode:
+        st.session_state.app_mode = clean_mode
+        st.rerun()  # Map click handling and the add form depend on the mode
+
+    show_heatmap = st.toggle("🔥 Density heatmap", value=st.session_state.get("show_heatmap", False),
+                             key="heatmap_toggle")
+    if show_heatmap != st.session_state.get("show_heatmap", False):
+        st.session_state.show_heatmap = show_heatmap
+        st.rerun()  # The heat layer is part of the map, outside this fragment
+
+# ==================== SIDEBAR LAYOUT ====================
+# ==================== SAVE STATUS ====================
+@st.fragment(run_every=2)
+def save_status():
+    """Polls while edits are buffered; one full rerun once they're written"""
+    entry = autosave.get(autosave_key())
+    if entry is None or not entry.pending:
+        st.rerun()  # Adopt the saved snapshot, stop polling
+    elif entry.error:
+        st.caption(f"⚠️ Saving failed, retrying… ({entry.error})")
+    else:
+        st.caption("⏳ Saving changes…")
+
+with st.sidebar:
+    save_entry = autosave.get(autosave_key())
+    if save_entry is not None and save_entry.pending:
+        save_status()
+    elif st.session_state.get("last_autosave"):
+        st.caption(f"✅ All changes saved ({st.session_state.last_autosave:%H:%M:%S})")
+    if st.session_state.app_mode == "Edit Mode" and st.session_state.get("pending_click"):
+        add_memory_form(journey, st.session_state.pending_click)
+    memory_panel(journey, st.session_state.selected_json_file)
+    stats_panel(journey)
+    journey_list(local_json_files, st.session_state.selected_json_file)
+    journey_operations(local_json_files, st.session_state.selected_json_file)
+    mode_selector()
 
 st.sidebar.markdown("---")
 
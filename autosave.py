@@ -0,0 +1,212 @@
+"""Write-behind autosave for journey edits.
+
+Edits are handed to a ``WriteBehindBuffer`` instead of being uploaded on the
+UI thread. Edits arriving within ``delay`` seconds of each other coalesce into
+one write (but no edit waits longer than ``max_delay``); a background thread
+does the write with ``save_with_merge``, publishes the saved snapshot to the
+journey cache and records it in the journey's history. Failed writes stay
+pending and are retried with backoff.
+
+Pending saves are keyed per session and journey, so each keeps the base
+version its edits started from. ``flush`` writes one out synchronously
+(journey switch, rename, ...) and ``flush_all`` is registered with ``atexit``
+so a shutdown doesn't drop buffered edits.
+"""
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from journey_merge import save_with_merge, three_way_merge
+from journey_model import Journey
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 60.0
+KEEP_FINISHED_FOR = 600.0  # Results nobody collected (session gone) are dropped after this
+
+
+class _PendingSave:
+    __slots__ = ("ref", "journey", "base", "base_version", "first_dirty", "due",
+                 "dirty", "inflight", "attempts", "error", "result", "finished_at")
+
+    def __init__(self, ref, journey, base, base_version):
+        self.ref = ref
+        self.journey = journey
+        self.base = base
+        self.base_version = base_version
+        self.first_dirty = self.due = time.monotonic()
+        self.dirty = True
+        self.inflight = False
+        self.attempts = 0
+        self.error = None
+        self.result = None  # (version, saved_journey, merged, conflicts) once written
+        self.finished_at = None
+
+    @property
+    def pending(self):
+        return self.dirty or self.inflight
+
+
+class WriteBehindBuffer:
+    """Coalesces journey saves and writes them from a background thread"""
+
+    def __init__(self, store, cache=None, history=None, delay=1.5, max_delay=10.0, workers=4):
+        self.store = store
+        self.cache = cache
+        self.history = history
+        self.delay = delay
+        self.max_delay = max_delay
+        self._entries = {}  # key -> _PendingSave
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="autosave")
+        self._thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush_all)
+
+    # ==================== SESSION SIDE ====================
+    def submit(self, key, ref, journey, base, base_version):
+        """Queue ``journey`` as the new content of ``ref``; returns immediately"""
+        now = time.monotonic()
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is None or not entry.pending:
+                if entry is not None and entry.result is not None:
+                    # Uncollected earlier save: our edits are based on it
+                    base_version, base = entry.result[0], entry.result[1]
+                entry = self._entries[key] = _PendingSave(ref, journey, base, base_version)
+            else:
+                entry.journey = journey
+                if not entry.dirty:
+                    entry.dirty, entry.first_dirty = True, now
+            entry.due = min(now + self.delay, entry.first_dirty + self.max_delay)
+            self._cond.notify_all()
+
+    def get(self, key):
+        with self._cond:
+            return self._entries.get(key)
+
+    def collect(self, key):
+        """Pop the finished result for ``key``: (version, saved, merged, conflicts) or None"""
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is None or entry.pending:
+                return None
+            del self._entries[key]
+            return entry.result
+
+    def discard_ref(self, ref):
+        """Forget pending saves of a journey that is being deleted"""
+        with self._cond:
+            for key in [k for k, e in self._entries.items() if e.ref == ref]:
+                if self._entries[key].inflight:
+                    logger.warning(f"Discarding {ref} while a save of it is in flight")
+                del self._entries[key]
+
+    def flush(self, key, timeout=30.0):
+        """Write ``key`` out now and wait for it; False if it's still pending"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is None:
+                return True
+            attempts = entry.attempts
+            entry.due = time.monotonic()
+            self._cond.notify_all()
+            while entry.pending and self._entries.get(key) is entry:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (entry.attempts > attempts and not entry.inflight):
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def flush_all(self, timeout=30.0):
+        """Write out everything pending (called at interpreter exit).
+
+        Runs the writes in the calling thread: by the time ``atexit`` handlers
+        run, the thread pool no longer accepts work.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            mine = [e for e in self._entries.values() if e.dirty and not e.inflight]
+            for entry in mine:
+                entry.inflight, entry.dirty = True, False
+            busy = [k for k, e in self._entries.items() if e.inflight and e not in mine]
+        if mine or busy:
+            logger.info(f"💾 Flushing {len(mine) + len(busy)} pending saves")
+        for entry in mine:
+            self._write(entry)
+        ok = not any(e.pending for e in mine)
+        for key in busy:
+            ok &= self.flush(key, max(deadline - time.monotonic(), 0.1))
+        if not ok:
+            logger.error("Some journey edits could not be saved before shutdown")
+        return ok
+
+    # ==================== WRITER ====================
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._due_batch()
+                while not batch:
+                    self._cond.wait(self._next_wakeup())
+                    batch = self._due_batch()
+                for entries in batch.values():
+                    for entry in entries:
+                        entry.inflight, entry.dirty = True, False
+            # One task per journey, so concurrent sessions' saves of the same
+            # journey don't race each other into conflicts
+            for entries in batch.values():
+                self._pool.submit(self._write_all, entries)
+
+    def _due_batch(self):
+        now = time.monotonic()
+        inflight_refs = {e.ref for e in self._entries.values() if e.inflight}
+        batch = {}
+        for key, entry in list(self._entries.items()):
+            if not entry.pending and now - (entry.finished_at or now) > KEEP_FINISHED_FOR:
+                del self._entries[key]
+            elif entry.dirty and not entry.inflight and entry.due <= now and entry.ref not in inflight_refs:
+                batch.setdefault(entry.ref, []).append(entry)
+        return batch
+
+    def _next_wakeup(self):
+        dues = [e.due for e in self._entries.values() if e.dirty and not e.inflight]
+        return max(min(dues) - time.monotonic(), 0.05) if dues else KEEP_FINISHED_FOR
+
+    def _write_all(self, entries):
+        for entry in entries:
+            self._write(entry)
+
+    def _write(self, entry):
+        with self._cond:
+            journey, base, base_version = entry.journey, entry.base, entry.base_version
+        try:
+            version, saved, conflicts = save_with_merge(self.store, entry.ref, journey,
+                                                        base=base, base_version=base_version)
+        except Exception as e:
+            with self._cond:
+                entry.attempts += 1
+                entry.error = str(e)
+                entry.inflight, entry.dirty = False, True
+                entry.due = time.monotonic() + min(2 ** entry.attempts, MAX_RETRY_DELAY)
+                self._cond.notify_all()
+            logger.warning(f"Autosave of {entry.ref} failed (attempt {entry.attempts}): {e}")
+            return
+
+        if self.cache is not None:
+            self.cache.put(entry.ref, version, saved, publish=True)
+        if self.history is not None:
+            self.history.record(entry.ref, saved, previous=base)
+        logger.info(f"💾 Autosaved {entry.ref}")
+        with self._cond:
+            entry.inflight, entry.attempts, entry.error = False, 0, None
+            entry.result = (version, saved, saved is not journey, conflicts)
+            entry.base, entry.base_version = saved, version
+            if entry.dirty and saved is not journey:
+                # Edited again while we were writing a merge: fold the merge in
+                merged, _ = three_way_merge(journey.to_dict(), entry.journey.to_dict(), saved.to_dict())
+                entry.journey = Journey.from_dict(merged)
+            entry.finished_at = time.monotonic()
+            self._cond.notify_all()
@@ -0,0 +1,139 @@
+"""On-disk cache for GCS objects (journey JSON and media).
+
+Objects are stored under the cache directory keyed by blob name and
+generation, with a small SQLite index so the cache survives Streamlit
+restarts and can be shared by several processes on the same host. A cached
+copy is revalidated with a conditional download (``if_generation_not_match``),
+so an unchanged object costs one 304 instead of a full download.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from google.api_core.exceptions import NotModified
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+class DiskBlobCache:
+    """Size-bounded (LRU by last access) cache of blob bytes.
+
+    ``revalidate_after`` seconds after a successful check a cached object is
+    served without asking GCS again; journey reads skip the check entirely
+    when the caller already knows the current generation.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, revalidate_after=60.0):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite3"), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " name TEXT PRIMARY KEY, generation INTEGER, size INTEGER,"
+            " file TEXT, last_access REAL, checked_at REAL)"
+        )
+
+    # ==================== INDEX ====================
+    def lookup(self, name):
+        """(generation, path, checked_at) of the cached copy, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT generation, file, checked_at FROM entries WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None:
+            return None
+        path = self.root / row[1]
+        if not path.exists():
+            self.discard(name)
+            return None
+        return row[0], path, row[2]
+
+    def store(self, name, generation, data):
+        fname = f"{hashlib.sha256(name.encode('utf-8')).hexdigest()[:32]}-{generation}.bin"
+        tmp = self.root / f".{fname}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, self.root / fname)
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT file FROM entries WHERE name = ?", (name,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (name, generation, len(data), fname, now, now)
+            )
+        if old and old[0] != fname:
+            (self.root / old[0]).unlink(missing_ok=True)
+        self.evict()
+
+    def touch(self, name, checked=False):
+        now = time.time()
+        with self._lock:
+            if checked:
+                self._db.execute("UPDATE entries SET last_access = ?, checked_at = ? WHERE name = ?",
+                                 (now, now, name))
+            else:
+                self._db.execute("UPDATE entries SET last_access = ? WHERE name = ?", (now, name))
+
+    def discard(self, name):
+        with self._lock:
+            row = self._db.execute("SELECT file FROM entries WHERE name = ?", (name,)).fetchone()
+            self._db.execute("DELETE FROM entries WHERE name = ?", (name,))
+        if row:
+            (self.root / row[0]).unlink(missing_ok=True)
+
+    def total_bytes(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """Drop least recently used objects until we're under ``max_bytes``"""
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for name, size, fname in self._db.execute(
+                    "SELECT name, size, file FROM entries ORDER BY last_access"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((name, fname))
+                total -= size
+            self._db.executemany("DELETE FROM entries WHERE name = ?", [(v[0],) for v in victims])
+        for name, fname in victims:
+            (self.root / fname).unlink(missing_ok=True)
+        logger.info(f"🧹 Evicted {len(victims)} cached blobs")
+
+    # ==================== FETCH ====================
+    def fetch(self, bucket, name, generation=None):
+        """Return (bytes, generation) for ``name``, downloading only when it changed.
+
+        Pass ``generation`` when it is already known (e.g. from a metadata
+        request) to serve a matching cached copy without any GCS call.
+        """
+        cached = self.lookup(name)
+        blob = bucket.blob(name)
+        if cached is not None:
+            cached_gen, path, checked_at = cached
+            fresh = time.time() - (checked_at or 0) < self.revalidate_after
+            if cached_gen == generation or (generation is None and fresh):
+                self.touch(name)
+                return path.read_bytes(), cached_gen
+            try:
+                data = blob.download_as_bytes(if_generation_not_match=cached_gen)
+            except NotModified:
+                self.touch(name, checked=True)
+                return path.read_bytes(), cached_gen
+        else:
+            data = blob.download_as_bytes()
+        self.store(name, blob.generation, data)
+        return data, blob.generation
@@ -0,0 +1,114 @@
+"""Background cache warming.
+
+The first view after a deploy or restart would otherwise pay for everything
+at once: listing the journeys, downloading and parsing each one for its
+sidebar preview, and downloading every photo its popups embed.
+``CacheWarmer`` does that work ahead of time on a daemon thread, once per
+process and journey folder:
+
+1. list the folder (into ``JourneyListCache``);
+2. load the ``journeys`` most recently updated journeys into ``JourneyCache``;
+3. pass up to ``media`` of their photos to ``media_loader``, which fills the
+   on-disk blob cache in the cloud.
+
+``prefetch`` queues a single journey the user is about to look at. A journey
+already being loaded is not queued twice, one that just failed is left alone
+for ``RETRY_AFTER`` seconds, and the loader is cheap when the snapshot is
+already cached.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNEYS = 5
+DEFAULT_MEDIA = 200
+DEFAULT_WORKERS = 4
+RETRY_AFTER = 60.0  # Seconds before a journey that failed to load is tried again
+
+
+class CacheWarmer:
+    def __init__(self, store, journey_cache, journey_lists=None, media_loader=None,
+                 journeys=DEFAULT_JOURNEYS, media=DEFAULT_MEDIA, workers=DEFAULT_WORKERS):
+        self.store = store
+        self.journey_cache = journey_cache
+        self.journey_lists = journey_lists
+        self.media_loader = media_loader
+        self.journeys = journeys
+        self.media = media
+        self.done = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warmup")
+        self._pending = {}  # ref -> Future
+        self._failed = {}  # ref -> when it last failed to load
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._warm, name="cache-warmup", daemon=True).start()
+        return self
+
+    def prefetch(self, name):
+        """Load journey ``name`` into the cache in the background; returns its Future (or None)"""
+        ref = self.store.ref(name)
+        with self._lock:
+            if time.monotonic() - self._failed.get(ref, float("-inf")) < RETRY_AFTER:
+                return None
+            future = self._pending.get(ref)
+            if future is None:
+                future = self._pending[ref] = self._pool.submit(self._load, ref)
+            return future
+
+    def loading(self, name):
+        """Whether ``name`` is still being prefetched"""
+        with self._lock:
+            return self.store.ref(name) in self._pending
+
+    def _load(self, ref):
+        try:
+            return self.journey_cache.load(self.store, ref)
+        except Exception as e:
+            logger.warning(f"Warm-up could not load {ref}: {e}")
+            with self._lock:
+                self._failed[ref] = time.monotonic()
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(ref, None)
+
+    def _load_media(self, ref):
+        try:
+            self.media_loader(ref)
+            return True
+        except Exception as e:
+            logger.warning(f"Warm-up could not fetch {ref}: {e}")
+            return False
+
+    def _warm(self):
+        started = time.monotonic()
+        loaded = fetched = 0
+        try:
+            if self.journey_lists is not None:
+                self.journey_lists.names(self.store)
+            recent = sorted(self.store.updated_names(), key=lambda item: item[1], reverse=True)
+            futures = [self.prefetch(name) for name, _ in recent[:self.journeys]]
+            journeys = [j for j in (f.result() for f in futures if f is not None) if j is not None]
+            loaded = len(journeys)
+
+            if self.media_loader is not None and self.media > 0:
+                # Newest journeys first, each photo once
+                refs = {}
+                for journey in journeys:
+                    for i in range(len(journey)):
+                        for ref in journey.photos(i):
+                            refs.setdefault(ref, None)
+                        if len(refs) >= self.media:
+                            break
+                    if len(refs) >= self.media:
+                        break
+                fetched = sum(self._pool.map(self._load_media, list(refs)[:self.media]))
+        except Exception as e:
+            logger.warning(f"Cache warm-up stopped early: {e}")
+        finally:
+            self.done.set()
+        logger.info(f"🔥 Warmed {loaded} journeys and {fetched} media in {time.monotonic() - started:.1f}s")
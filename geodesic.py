@@ -0,0 +1,89 @@
+"""Great-circle paths for drawing journeys on a Web Mercator map.
+
+A straight Leaflet polyline between two far-apart places is a rhumb-ish line
+on the map, and one that crosses the antimeridian runs the wrong way round
+the world. ``great_circle_path`` interpolates every leg along its great
+circle with spherical linear interpolation (slerp), vectorised over all legs
+at once, using more points for longer legs. It then cuts the path wherever
+it crosses ±180° longitude. Paths are cached per trip by ``trips.trip_path``.
+"""
+import numpy as np
+
+MAX_STEP_DEG = 1.0  # Longest straight piece drawn, ~111 km
+MAX_POINTS_PER_LEG = 128
+MAX_TOTAL_POINTS = 200_000  # Beyond this, every leg gets proportionally fewer points
+
+
+def _to_xyz(lat, lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def _to_latlon(xyz):
+    lat = np.degrees(np.arctan2(xyz[:, 2], np.hypot(xyz[:, 0], xyz[:, 1])))
+    lon = np.degrees(np.arctan2(xyz[:, 1], xyz[:, 0]))
+    return lat, lon
+
+
+def interpolate_legs(lat, lon, max_step_deg=MAX_STEP_DEG, max_points=MAX_POINTS_PER_LEG,
+                     max_total=MAX_TOTAL_POINTS):
+    """Densify consecutive points along great circles; returns (lat, lon) arrays.
+
+    Each leg gets ``ceil(angle / max_step_deg)`` pieces (at most
+    ``max_points``), so nearby memories cost no extra vertices. Densification
+    is scaled back to keep the whole path near ``max_total`` vertices.
+    """
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    if len(lat) < 2:
+        return lat.copy(), lon.copy()
+    xyz = _to_xyz(lat, lon)
+    a, b = xyz[:-1], xyz[1:]
+    # atan2(|a×b|, a·b) stays accurate for tiny and near-antipodal angles
+    omega = np.arctan2(np.linalg.norm(np.cross(a, b), axis=1), np.einsum("ij,ij->i", a, b))
+    pieces = np.clip(np.ceil(np.degrees(omega) / max_step_deg), 1, max_points).astype(np.int64)
+    pieces[omega > np.pi - 1e-9] = 1  # Antipodes: no single great circle, draw it straight
+    extra = int(pieces.sum()) - len(pieces)
+    if extra > max_total:
+        pieces = 1 + (pieces - 1) * max_total // extra
+
+    # One row per output vertex (except the final point): its leg and position t in [0, 1)
+    leg = np.repeat(np.arange(len(pieces)), pieces)
+    starts = np.cumsum(pieces) - pieces
+    t = (np.arange(len(leg)) - starts[leg]) / pieces[leg]
+
+    w = omega[leg]
+    sin_w = np.sin(w)
+    curved = sin_w > 1e-12
+    wa = np.where(curved, np.sin((1 - t) * w) / np.where(curved, sin_w, 1), 1 - t)
+    wb = np.where(curved, np.sin(t * w) / np.where(curved, sin_w, 1), t)
+    points = wa[:, None] * a[leg] + wb[:, None] * b[leg]
+
+    out_lat, out_lon = _to_latlon(points)
+    # Exact input coordinates at leg starts and the end, not round-tripped ones
+    out_lat[starts], out_lon[starts] = lat[:-1], lon[:-1]
+    return np.append(out_lat, lat[-1]), np.append(out_lon, lon[-1])
+
+
+def split_antimeridian(lat, lon):
+    """Cut a path where it jumps across ±180°; returns a list of [[lat, lon], ...]"""
+    if len(lat) == 0:
+        return []
+    jumps = np.flatnonzero(np.abs(np.diff(lon)) > 180)
+    if not len(jumps):
+        return [np.column_stack((lat, lon)).tolist()]
+    # Where each (short) jumping piece i -> i+1 meets the antimeridian
+    edge = np.where(lon[jumps] > 0, 180.0, -180.0)
+    next_lon = lon[jumps + 1] + 2 * edge
+    f = (edge - lon[jumps]) / (next_lon - lon[jumps])
+    cross_lat = lat[jumps] + f * (lat[jumps + 1] - lat[jumps])
+    # End each segment on its side of the map and start the next on the other
+    at = np.repeat(jumps + 1, 2)
+    lat = np.insert(lat, at, np.repeat(cross_lat, 2))
+    lon = np.insert(lon, at, np.column_stack((edge, -edge)).ravel())
+    cuts = jumps + 2 + 2 * np.arange(len(jumps))
+    return [piece.tolist() for piece in np.split(np.column_stack((lat, lon)), cuts)]
+
+
+def great_circle_path(lat, lon):
+    """Great-circle polyline segments through the points, split at the antimeridian"""
+    return split_antimeridian(*interpolate_legs(lat, lon))
@@ -0,0 +1,97 @@
+"""Memory density as a multi-resolution grid pyramid.
+
+Coordinates are binned into Web Mercator cells of ``CELL_PX`` screen pixels
+at every zoom level from ``MAX_ZOOM`` down to 0. The finest level is binned
+once. Each coarser level merges 2×2 cells of the one below, so only the
+first level sorts every memory. Levels are sparse (only non-empty cells
+are kept), so zoom 16 doesn't need a dense 2^20 × 2^20 array.
+
+The map gets the finest level that fits in ``MAX_CELLS`` cells, as weighted
+``[lat, lon, weight]`` points. That is a small fixed-size payload whether
+the journey has 50 memories or 500k. The pyramid is memoised per ``Journey``
+snapshot.
+"""
+import threading
+import weakref
+
+import numpy as np
+
+MAX_ZOOM = 16
+CELL_PX = 16  # Cell edge in screen pixels at its own zoom level
+MAX_CELLS = 4000
+_CELL_BITS = 8 - 4  # log2(256 / CELL_PX)
+_MAX_LAT = 85.05112878  # Web Mercator cut-off
+
+_memo = weakref.WeakKeyDictionary()  # Journey -> {"pyramid": ..., max_cells: points}
+_memo_lock = threading.Lock()
+
+
+def _mercator(lat, lon):
+    """Fractions of the world map: x east from -180°, y south from the top"""
+    lat = np.radians(np.clip(lat, -_MAX_LAT, _MAX_LAT))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return np.clip(x, 0.0, 1.0 - 1e-12), np.clip(y, 0.0, 1.0 - 1e-12)
+
+
+def build_pyramid(lat, lon, max_zoom=MAX_ZOOM):
+    """``[(zoom, cx, cy, counts), ...]`` from ``max_zoom`` down to zoom 0"""
+    if not len(lat):
+        return []
+    bits = max_zoom + _CELL_BITS
+    x, y = _mercator(lat, lon)
+    cx = (x * (1 << bits)).astype(np.int64)
+    cy = (y * (1 << bits)).astype(np.int64)
+    keys, counts = np.unique((cx << 32) | cy, return_counts=True)
+    levels = []
+    for zoom in range(max_zoom, -1, -1):
+        cx, cy = keys >> 32, keys & 0xFFFFFFFF
+        levels.append((zoom, cx, cy, counts))
+        if zoom:
+            # Each level only sorts the (already merged) cells of the level below
+            keys, inverse = np.unique(((cx >> 1) << 32) | (cy >> 1), return_inverse=True)
+            counts = np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64)
+    return levels
+
+
+def cell_centers(zoom, cx, cy):
+    """(lat, lon) of the centres of cells at ``zoom``"""
+    scale = float(1 << (zoom + _CELL_BITS))
+    lon = (cx + 0.5) / scale * 360.0 - 180.0
+    n = np.pi * (1.0 - 2.0 * (cy + 0.5) / scale)
+    lat = np.degrees(np.arctan(np.sinh(n)))
+    return lat, lon
+
+
+def pick_level(levels, max_cells=MAX_CELLS):
+    """Finest level with at most ``max_cells`` non-empty cells"""
+    for level in levels:
+        if len(level[3]) <= max_cells:
+            return level
+    return levels[-1]
+
+
+def heat_points(journey, max_cells=MAX_CELLS):
+    """``([[lat, lon, weight], ...], zoom)`` for a heatmap layer, memoised per snapshot.
+
+    Weights are square-root scaled to 0..1, so one place with hundreds of
+    memories doesn't wash out everything else.
+    """
+    if not len(journey):
+        return [], 0
+    with _memo_lock:
+        memo = _memo.setdefault(journey, {})
+        cached = memo.get(max_cells)
+        levels = memo.get("pyramid")
+    if cached is not None:
+        return cached
+    if levels is None:
+        levels = build_pyramid(journey.lat, journey.lon)
+    zoom, cx, cy, counts = pick_level(levels, max_cells)
+    lat, lon = cell_centers(zoom, cx, cy)
+    weight = np.sqrt(counts / counts.max())
+    result = (np.column_stack((lat, lon, np.round(weight, 3))).tolist(), zoom)
+    with _memo_lock:
+        memo["pyramid"] = levels
+        memo[max_cells] = result
+    return result
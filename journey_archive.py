@@ -0,0 +1,197 @@
+"""Self-contained journey archives (ZIP with the journey JSON and its media).
+
+Layout::
+
+    journey.json          the journey, media references rewritten to media/...
+    media/photos/<name>   every referenced photo
+    media/videos/<name>   every referenced video
+    manifest.json         original reference, size and sha256 of each media file
+                          (and the references that couldn't be read, under missing)
+
+The archive is written as a stream: media is copied into the ZIP in
+``CHUNK_SIZE`` pieces and never held in memory as a whole. GCS media is
+downloaded ``prefetch`` objects ahead on a thread pool, each into a spooled
+temp file (RAM up to ``SPOOL_MAX_BYTES``, disk beyond), so memory stays
+around ``prefetch * SPOOL_MAX_BYTES`` whatever the journey size. The output
+only needs ``write``, so a pipe or socket works as well as a file.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT = "journey-archive"
+ARCHIVE_VERSION = 1
+JOURNEY_MEMBER = "journey.json"
+MANIFEST_MEMBER = "manifest.json"
+CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_PREFETCH = 4
+
+
+# ==================== MEDIA SOURCES ====================
+class MediaFetcher:
+    """Opens media references for reading: local paths or ``gs://bucket/path``.
+
+    ``client`` is a ``google.cloud.storage.Client``; it's only needed when the
+    journey references GCS media.
+    """
+
+    def __init__(self, client=None, base_dir=None):
+        self.client = client
+        self.base_dir = Path(base_dir) if base_dir else None
+        self._buckets = {}
+
+    def is_remote(self, ref):
+        return ref.startswith("gs://")
+
+    def local_path(self, ref):
+        """Filesystem path of a local reference (relative ones resolve against ``base_dir``)"""
+        path = Path(ref)
+        if not path.is_absolute() and self.base_dir is not None:
+            path = self.base_dir / path
+        return path
+
+    def open(self, ref):
+        """Readable binary file object positioned at 0; FileNotFoundError if missing"""
+        if self.is_remote(ref):
+            return self._download(ref)
+        return open(self.local_path(ref), "rb")
+
+    def _download(self, ref):
+        from google.api_core.exceptions import NotFound
+        bucket_name, _, blob_path = ref[5:].partition("/")
+        if self.client is None:
+            from google.cloud import storage
+            self.client = storage.Client()
+        bucket = self._buckets.setdefault(bucket_name, self.client.bucket(bucket_name))
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        try:
+            bucket.blob(blob_path).download_to_file(spool)
+        except NotFound:
+            spool.close()
+            raise FileNotFoundError(ref)
+        spool.seek(0)
+        return spool
+
+
+def _prefetched(fetcher, refs, prefetch):
+    """Yield (ref, file_or_exception) in order, fetching remote refs ahead"""
+    with ThreadPoolExecutor(max_workers=max(prefetch, 1), thread_name_prefix="archive") as pool:
+        window = deque()
+
+        def schedule(ref):
+            window.append((ref, pool.submit(fetcher.open, ref) if fetcher.is_remote(ref) else None))
+
+        refs = iter(refs)
+        for ref in refs:
+            schedule(ref)
+            if len(window) >= prefetch:
+                break
+        while window:
+            ref, future = window.popleft()
+            next_ref = next(refs, None)
+            if next_ref is not None:
+                schedule(next_ref)
+            try:
+                yield ref, future.result() if future is not None else fetcher.open(ref)
+            except Exception as e:
+                yield ref, e
+
+
+# ==================== WRITING ====================
+def _member_name(ref, kind, used):
+    name = PurePosixPath(ref.split("?", 1)[0]).name or "media"
+    member, n = f"media/{kind}/{name}", 1
+    while member in used:
+        stem, dot, ext = name.rpartition(".")
+        member = f"media/{kind}/{stem or ext}-{n}{dot}{ext if stem else ''}"
+        n += 1
+    used.add(member)
+    return member
+
+
+def write_archive(journey, out, fetcher, name="journey.json", prefetch=DEFAULT_PREFETCH, progress=None):
+    """Stream ``journey`` and its media as a ZIP into the writable ``out``.
+
+    ``progress(done, total)`` is called after each media file. Media that
+    can't be read is listed under ``missing`` in the manifest and skipped.
+    Returns the manifest dict.
+    """
+    data = journey.to_dict()
+    members, used, order = {}, set(), []
+    for e in data["events"]:
+        media = e.get("media") or {}
+        for kind in ("photos", "videos"):
+            for ref in media.get(kind, []):
+                if ref not in members:
+                    members[ref] = _member_name(ref, kind, used)
+                    order.append(ref)
+            if kind in media:
+                media[kind] = [members[r] for r in media[kind]]
+
+    manifest = {
+        "format": ARCHIVE_FORMAT,
+        "version": ARCHIVE_VERSION,
+        "journey": name,
+        "title": data["autobiography"].get("title", ""),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "media": [],
+        "missing": [],
+    }
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        zf.writestr(JOURNEY_MEMBER, json.dumps(data, indent=4, ensure_ascii=False).encode("utf-8"))
+        for done, (ref, src) in enumerate(_prefetched(fetcher, order, prefetch), start=1):
+            if isinstance(src, Exception):
+                logger.warning(f"Archive: skipping unreadable media {ref}: {src}")
+                manifest["missing"].append({"path": members[ref], "ref": ref})
+            else:
+                # Photos and videos are already compressed, store them as-is
+                info = zipfile.ZipInfo(members[ref], date_time=datetime.now().timetuple()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                digest, size = hashlib.sha256(), 0
+                with src, zf.open(info, "w", force_zip64=True) as dst:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                        dst.write(chunk)
+                        size += len(chunk)
+                manifest["media"].append({"path": members[ref], "ref": ref,
+                                          "size": size, "sha256": digest.hexdigest()})
+            if progress is not None:
+                progress(done, len(order))
+        zf.writestr(MANIFEST_MEMBER, json.dumps(manifest, indent=2, ensure_ascii=False))
+    logger.info(f"📦 Archived {name}: {len(manifest['media'])} media, {len(manifest['missing'])} missing")
+    return manifest
+
+
+def write_archive_file(journey, path, fetcher, **kwargs):
+    """``write_archive`` into ``path`` atomically (temp file + rename)"""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as out:
+            manifest = write_archive(journey, out, fetcher, **kwargs)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return manifest
+
+
+def cleanup_exports(folder, keep_seconds=3600):
+    """Remove archives older than ``keep_seconds`` from an export folder"""
+    folder = Path(folder)
+    if not folder.exists():
+        return
+    cutoff = datetime.now().timestamp() - keep_seconds
+    for p in folder.glob("*.zip"):
+        if p.stat().st_mtime < cutoff:
+            p.unlink(missing_ok=True)
@@ -0,0 +1,273 @@
+"""Process-wide cache of parsed journeys.
+
+Entries are keyed by journey ref and tagged with the storage version they were
+parsed from (mtime/size locally, generation in GCS). A hit hands out the
+cached ``Journey`` itself: journeys are immutable, so every session can share
+the same snapshot without the pickle round trip ``st.cache_data`` does.
+
+A save ``put``s the new snapshot, which publishes it: every other session
+picks it up on its next ``snapshot`` call. Sessions edit copy-on-write
+(``Journey.with_event``), so an editing session only owns the columns it
+actually changed.
+
+``JourneyListCache`` does the same for the journey list: one listing per
+folder, shared by every session for a few seconds instead of re-listed on
+every rerun.
+
+Both take an optional ``SharedCache`` (shared_cache.py) for deployments with
+several replicas: journey bytes and listings are looked up there before
+storage, and saves, renames and deletes are broadcast so other replicas
+recheck the journey (or re-list the folder) at once instead of after their
+own ``revalidate_after``/``ttl``.
+
+``RenderCache`` bounds rendered marker popups (base64 photos and videos can
+be megabytes each) by size.
+"""
+import json
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from journey_model import Journey
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_LIST_TTL = 30.0
+DEFAULT_RENDER_MAX_BYTES = 128 * 1024 * 1024
+
+
+class JourneyCache:
+    """LRU of (ref, version) -> Journey bounded by an approximate byte budget.
+
+    ``revalidate_after`` is how long (seconds) a hit is trusted before the
+    store is asked for the current version again; a version check is a stat
+    locally but a metadata request in GCS, so we don't repeat it every rerun.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, revalidate_after=5.0, shared=None):
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.shared = shared
+        self._entries = OrderedDict()  # ref -> [version, journey, size, checked_at]
+        self._live = {}  # ref -> (version, weakref to journey), outlives LRU eviction
+        self._bytes = 0
+        self._lock = threading.RLock()
+        if shared is not None:
+            shared.subscribe(self._on_message)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+    def get(self, ref, version):
+        with self._lock:
+            entry = self._entries.get(ref)
+            if entry is None or entry[0] != version:
+                return self._revive(ref, version)
+            self._entries.move_to_end(ref)
+            return entry[1]
+
+    def put(self, ref, version, journey, publish=False):
+        """Cache ``journey`` as ``ref`` at ``version``; ``publish`` after writing it to storage"""
+        if publish and self.shared is not None:
+            self.shared.set(_journey_key(ref, version), journey.to_json())
+            self.shared.publish("journey", ref)
+        size = journey.nbytes()
+        with self._lock:
+            self._drop(ref)
+            self._entries[ref] = [version, journey, size, time.monotonic()]
+            self._live[ref] = (version, weakref.ref(journey))
+            self._bytes += size
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_ref, _ = next(iter(self._entries.items()))
+                logger.info(f"🧹 Evicting cached journey {old_ref}")
+                self._drop(old_ref)
+        return journey
+
+    def peek(self, ref):
+        """The cached snapshot of ``ref`` without asking the store, or None"""
+        with self._lock:
+            entry = self._entries.get(ref)
+            return entry[1] if entry is not None else None
+
+    def invalidate(self, ref):
+        with self._lock:
+            self._drop(ref)
+            self._live.pop(ref, None)
+        if self.shared is not None:
+            self.shared.publish("journey", ref)
+
+    def _on_message(self, kind, ref):
+        """Another replica changed ``ref``: check its version on the next ``snapshot``"""
+        if kind != "journey":
+            return
+        with self._lock:
+            entry = self._entries.get(ref)
+            if entry is not None:
+                entry[3] = float("-inf")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._live.clear()
+            self._bytes = 0
+
+    def load(self, store, ref):
+        """Return the current snapshot of ``ref``, reading it only if its version changed"""
+        return self.snapshot(store, ref)[1]
+
+    def snapshot(self, store, ref):
+        """Like ``load`` but returns ``(version, journey)`` for conditional saves"""
+        with self._lock:
+            entry = self._entries.get(ref)
+            if entry is not None and time.monotonic() - entry[3] < self.revalidate_after:
+                self._entries.move_to_end(ref)
+                return entry[0], entry[1]
+
+        version = store.version(ref)
+        if version is not None:
+            cached = self.get(ref, version)
+            if cached is not None:
+                with self._lock:
+                    if ref in self._entries:
+                        self._entries[ref][3] = time.monotonic()
+                return version, cached
+
+        data = None
+        if self.shared is not None and version is not None:
+            data = self.shared.get(_journey_key(ref, version))
+        if data is not None:
+            logger.info(f"📂 Loading journey from the shared cache: {ref}")
+        else:
+            logger.info(f"📂 Loading journey from: {ref}")
+            data, version = store.read(ref, version)
+            if self.shared is not None:
+                self.shared.set(_journey_key(ref, version), data)
+        return version, self.put(ref, version, Journey.from_json(data))
+
+    def _revive(self, ref, version):
+        """An evicted snapshot some session still holds is reused, not re-read"""
+        live = self._live.get(ref)
+        journey = live[1]() if live is not None and live[0] == version else None
+        if journey is None:
+            return None
+        logger.info(f"♻️ Reusing live snapshot of {ref}")
+        self.put(ref, version, journey)
+        return journey
+
+    def _drop(self, ref):
+        entry = self._entries.pop(ref, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+
+def _journey_key(ref, version):
+    return f"journey:{ref}@{version}"
+
+
+class JourneyListCache:
+    """Sorted journey names per store folder, trusted for ``ttl`` seconds.
+
+    Sessions that ask while a folder is being listed wait for that listing
+    instead of starting their own. Create/rename/delete call ``invalidate`` so
+    the change shows up right away in this process.
+    """
+
+    def __init__(self, ttl=DEFAULT_LIST_TTL, shared=None):
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = {}  # folder -> (names, listed_at)
+        self._listing = {}  # folder -> lock held while listing it
+        self._invalidated = {}  # folder -> when it last changed here
+        self._lock = threading.Lock()
+        if shared is not None:
+            shared.subscribe(self._on_message)
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        listed_at = entry[1]
+        # A listing that started before an invalidate may have missed the change
+        if time.monotonic() - listed_at < self.ttl and listed_at > self._invalidated.get(key, 0.0):
+            return entry[0]
+        return None
+
+    def names(self, store):
+        key = store.ref("")
+        names = self._fresh(key)
+        if names is not None:
+            return names
+        with self._lock:
+            listing = self._listing.setdefault(key, threading.Lock())
+        with listing:
+            names = self._fresh(key)
+            if names is not None:
+                return names  # Someone else listed it while we waited
+            started = time.monotonic()
+            shared = self.shared.get(f"list:{key}") if self.shared is not None else None
+            if shared is not None:
+                names = tuple(json.loads(shared))
+            else:
+                names = tuple(sorted(store.names()))
+                if self.shared is not None:
+                    self.shared.set(f"list:{key}", json.dumps(names).encode("utf-8"), ttl=self.ttl)
+            self._entries[key] = (names, started)
+            logger.info(f"📋 Listed {len(names)} journeys in {key} ({time.monotonic() - started:.2f}s)")
+            return names
+
+    def invalidate(self, store):
+        key = store.ref("")
+        self._drop(key)
+        if self.shared is not None:
+            self.shared.delete(f"list:{key}")
+            self.shared.publish("list", key)
+
+    def _on_message(self, kind, key):
+        if kind == "list":
+            self._drop(key)
+
+    def _drop(self, key):
+        self._invalidated[key] = time.monotonic()
+        self._entries.pop(key, None)
+
+
+class RenderCache:
+    """LRU of rendered strings (popup HTML with embedded media) within ``max_bytes``.
+
+    Callers put everything the output depends on into the key, media versions
+    included, so entries never need invalidating; they just age out.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_RENDER_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> text
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def put(self, key, text):
+        if len(text) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = text
+            self._bytes += len(text)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
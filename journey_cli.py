@@ -0,0 +1,415 @@
+"""Headless maintenance for journeys, sharing the app's storage layer.
+
+    python journey_cli.py validate --all
+    python journey_cli.py --jobs 8 compact 'trip-*.json'
+    python journey_cli.py --bucket journey-journal migrate-format --all --dry-run
+    python journey_cli.py import ~/backups/*.json ~/backups/*.zip
+    python journey_cli.py export --all --out ./backup
+    python journey_cli.py archive life_events.json --out ./backup   # ZIP with media
+    python journey_cli.py site life_events.json --out ./site        # static website, rebuilt incrementally
+    python journey_cli.py media check --all
+    python journey_cli.py media relink --all --old-prefix uploads/ --new-prefix gs://journey-journal/
+    python journey_cli.py --bucket journey-journal media gc --report gc.jsonl [--delete]
+
+Journeys are addressed by file name (``life_events.json``) or glob. Locally
+they live in ``--data-dir`` (the app folder by default); with ``--bucket``
+they are read from ``<folder>/`` in GCS. Every rewrite is conditional on the
+version that was read, so a journey saved from the app meanwhile is skipped
+rather than overwritten. ``--jobs N`` spreads journeys over N processes.
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from journey_archive import MediaFetcher, write_archive_file
+from journey_restore import GCSMediaSink, LocalMediaSink, restore_upload
+from journey_model import Journey, migrate_journey_dict, validate_journey_dict
+from journey_storage import LocalJourneyStore, GCSJourneyStore, NO_OBJECT, WriteConflict
+from media_gc import collect
+from static_export import export_site
+
+logger = logging.getLogger("journey_cli")
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_BUCKET_FOLDER = "journeys"
+
+_store = None  # One per worker process, built by _init_worker
+
+
+# ==================== STORAGE ====================
+def make_store(data_dir=None, bucket=None, folder=DEFAULT_BUCKET_FOLDER, credentials=None):
+    if bucket:
+        from google.cloud import storage
+        client = (storage.Client.from_service_account_json(credentials) if credentials
+                  else storage.Client())
+        return GCSJourneyStore(client.bucket(bucket), folder)
+    return LocalJourneyStore(data_dir or BASE_DIR)
+
+
+def list_journeys(store, recursive=False):
+    """Journey names in the store's folder; with ``recursive`` also those in
+    sub-folders (per-user folders), as relative paths"""
+    return sorted(store.all_names() if recursive else store.names())
+
+
+def _init_worker(store_config):
+    global _store
+    logging.basicConfig(level=logging.WARNING)
+    _store = make_store(**store_config)
+
+
+def _read(name):
+    ref, raw, version = _read_bytes(name)
+    return ref, json.loads(raw.decode("utf-8")), version
+
+
+def _read_bytes(name):
+    ref = _store.ref(name)
+    raw, version = _store.read(ref)
+    return ref, raw, version
+
+
+def _media_dir():
+    """Where relative (local) media paths live: the --data-dir of a local store"""
+    return _store.base_dir if isinstance(_store, LocalJourneyStore) else BASE_DIR
+
+
+def _rewrite(ref, old_bytes, new_bytes, version, opts):
+    """Conditionally write ``new_bytes`` if it differs; returns a status word"""
+    if new_bytes == old_bytes:
+        return "unchanged"
+    if opts.dry_run:
+        return "would rewrite"
+    try:
+        _store.write(ref, new_bytes, if_version=version)
+    except WriteConflict:
+        raise RuntimeError("changed while we were working on it, left alone")
+    return "rewritten"
+
+
+# ==================== OPERATIONS (one journey each) ====================
+def op_validate(name, opts):
+    _, data, _ = _read(name)
+    problems = validate_journey_dict(data)
+    if problems:
+        raise ValueError("; ".join(problems[:10]) + (f" (+{len(problems) - 10} more)" if len(problems) > 10 else ""))
+    return f"ok, {len(data['events'])} events"
+
+
+def op_compact(name, opts):
+    """Canonical form: date order, duplicate media refs and stray whitespace removed"""
+    ref, old_bytes, version = _read_bytes(name)
+    data = json.loads(old_bytes.decode("utf-8"))
+    problems = validate_journey_dict(data)
+    if problems:
+        raise ValueError(f"invalid, run validate first ({problems[0]})")
+    for e in data["events"]:
+        e["title"] = str(e.get("title", "")).strip()
+        e["location"]["name"] = str(e["location"].get("name", "")).strip()
+        media = e.get("media") or {}
+        for kind in ("photos", "videos"):
+            if kind in media:
+                media[kind] = list(dict.fromkeys(media[kind]))
+    new = Journey.from_dict(data).to_json()
+    status = _rewrite(ref, old_bytes, new, version, opts)
+    return f"{status} ({len(old_bytes)} -> {len(new)} bytes)" if status != "unchanged" else status
+
+
+def op_reindex(name, opts):
+    """Renumber event ids 1..N in date order (open app sessions must reload)"""
+    ref, old_bytes, version = _read_bytes(name)
+    data = json.loads(old_bytes.decode("utf-8"))
+    journey = Journey.from_dict(data)
+    events = list(journey.events())
+    for i, e in enumerate(events, start=1):
+        e["id"] = i
+    new = Journey.from_dict({"autobiography": data.get("autobiography", {}), "events": events}).to_json()
+    return _rewrite(ref, old_bytes, new, version, opts)
+
+
+def op_migrate(name, opts):
+    ref, data, version = _read(name)
+    migrated, changes = migrate_journey_dict(data)
+    if not changes:
+        return "already current"
+    problems = validate_journey_dict(migrated)
+    if problems:
+        raise ValueError(f"still invalid after migration: {problems[0]}")
+    new = Journey.from_dict(migrated).to_json()
+    status = _rewrite(ref, None, new, version, opts)
+    return f"{status}: {len(changes)} changes ({changes[0]}{', ...' if len(changes) > 1 else ''})"
+
+
+def op_export(name, opts):
+    ref = _store.ref(name)
+    data, _ = _store.read(ref)
+    out = Path(opts.out) / name
+    if not opts.dry_run:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_bytes(data)
+    return f"-> {out} ({len(data)} bytes)"
+
+
+def op_archive(name, opts):
+    """ZIP with the journey and its media, streamed to disk"""
+    ref = _store.ref(name)
+    journey = Journey.from_json(_store.read(ref)[0])
+    out = Path(opts.out) / f"{Path(name).stem}.zip"
+    if opts.dry_run:
+        return f"would archive {len(list(journey.media_refs()))} media -> {out}"
+    client = _store.bucket.client if isinstance(_store, GCSJourneyStore) else None
+    out.parent.mkdir(parents=True, exist_ok=True)
+    manifest = write_archive_file(journey, out, MediaFetcher(client, _media_dir()), name=name, prefetch=opts.prefetch)
+    missing = f", {len(manifest['missing'])} missing" if manifest["missing"] else ""
+    return f"-> {out} ({len(manifest['media'])} media{missing}, {out.stat().st_size} bytes)"
+
+
+def op_site(name, opts):
+    """Static website in <out>/<journey name>/; a rebuild only redoes what changed"""
+    ref = _store.ref(name)
+    journey = Journey.from_json(_store.read(ref)[0])
+    out = Path(opts.out) / Path(name).stem
+    if opts.dry_run:
+        return f"would export {len(journey)} memories -> {out}"
+    client = _store.bucket.client if isinstance(_store, GCSJourneyStore) else None
+    summary = export_site(journey, out, MediaFetcher(client, _media_dir()), workers=opts.workers)
+    missing = f", {len(summary['media_missing'])} media missing" if summary["media_missing"] else ""
+    return (f"-> {out} ({summary['popups_rendered']}/{summary['events']} popups rendered, "
+            f"{summary['media_copied']} media copied{missing})")
+
+
+def _media_sink():
+    if isinstance(_store, GCSJourneyStore):
+        return GCSMediaSink(_store.bucket)
+    uploads = _store.base_dir / "uploads"
+    return LocalMediaSink(uploads / "photos", uploads / "videos")
+
+
+def op_import(path, opts):
+    """``path`` is a local JSON file or archive; it becomes journey ``<file name>.json``"""
+    name, report = f"{Path(path).stem}.json", None
+    if zipfile.is_zipfile(path):
+        if opts.dry_run:
+            return f"would import archive as {name}"
+        with open(path, "rb") as fh:
+            archived, data, report = restore_upload(fh, _media_sink())
+        name, changes = archived or name, []
+    else:
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+        data, changes = migrate_journey_dict(raw)
+        problems = validate_journey_dict(data)
+        if problems:
+            raise ValueError(f"invalid: {problems[0]}")
+    if opts.dry_run:
+        return f"would import as {name}"
+    try:
+        _store.write(_store.ref(name), Journey.from_dict(data).to_json(),
+                     if_version=None if opts.force else NO_OBJECT)
+    except WriteConflict:
+        raise RuntimeError(f"{name} already exists (use --force to replace it)")
+    if report is not None:
+        lost = len(report["missing"]) + len(report["failed"])
+        return (f"imported as {name} ({report['uploaded']} media uploaded, {report['deduplicated']} already stored"
+                + (f", {lost} missing)" if lost else ")"))
+    return f"imported as {name}" + (f" ({len(changes)} format fixes)" if changes else "")
+
+
+def _media_exists(ref):
+    if ref.startswith("gs://"):
+        bucket_name, blob_path = ref[5:].split("/", 1)
+        bucket = _store.bucket if isinstance(_store, GCSJourneyStore) and _store.bucket.name == bucket_name \
+            else _gcs_bucket(bucket_name)
+        return bucket.blob(blob_path).exists()
+    path = Path(ref)
+    return (path if path.is_absolute() else _media_dir() / path).exists()
+
+
+def _gcs_bucket(name):
+    from google.cloud import storage
+    return storage.Client().bucket(name)
+
+
+def op_media_check(name, opts):
+    _, data, _ = _read(name)
+    journey = Journey.from_dict(data)
+    refs = list(dict.fromkeys(journey.media_refs()))
+    missing = [r for r in refs if not _media_exists(r)]
+    if missing:
+        raise ValueError(f"{len(missing)}/{len(refs)} media missing, e.g. {missing[0]}")
+    return f"all {len(refs)} media present"
+
+
+def op_media_relink(name, opts):
+    """Rewrite media references starting with --old-prefix to --new-prefix"""
+    ref, data, version = _read(name)
+    count = 0
+    for e in data.get("events", []):
+        media = e.get("media") or {}
+        for kind in ("photos", "videos"):
+            refs = media.get(kind, [])
+            for i, r in enumerate(refs):
+                if r.startswith(opts.old_prefix):
+                    refs[i] = opts.new_prefix + r[len(opts.old_prefix):]
+                    count += 1
+    if not count:
+        return "no matching media"
+    new = Journey.from_dict(data).to_json()
+    return f"{_rewrite(ref, None, new, version, opts)}: {count} references"
+
+
+OPERATIONS = {
+    "validate": op_validate,
+    "compact": op_compact,
+    "reindex": op_reindex,
+    "migrate-format": op_migrate,
+    "export": op_export,
+    "archive": op_archive,
+    "site": op_site,
+    "import": op_import,
+    "media check": op_media_check,
+    "media relink": op_media_relink,
+}
+
+
+def run_media_gc(store, opts):
+    """Whole-store job: orphaned media and dangling references across all journeys"""
+    bucket = store.bucket if isinstance(store, GCSJourneyStore) else None
+    data_dir = Path(opts.data_dir).resolve()
+    uploads = data_dir / "uploads"
+    report = open(opts.report, "w", encoding="utf-8") if opts.report else None
+    try:
+        # Every journey, per-user folders included: media only they reference isn't orphaned
+        summary = collect(store, list_journeys(store, recursive=True), bucket=bucket,
+                          local_dirs=[uploads / "photos", uploads / "videos"], base_dir=data_dir,
+                          delete=opts.delete and not opts.dry_run, min_age=opts.min_age_hours * 3600,
+                          workers=max(opts.jobs, 4), report_to=report)
+    finally:
+        if report is not None:
+            report.close()
+    print(f"Scanned {summary['objects']} media objects and {summary['references']} references "
+          f"in {summary['journeys']} journeys")
+    for ref in summary["orphan_sample"]:
+        print(f"🗑️ orphan: {ref}")
+    for journey, ref in summary["dangling_sample"]:
+        print(f"❌ {journey}: missing {ref}")
+    print(f"{summary['orphans']} orphans ({summary['orphan_bytes'] / 1e6:.1f} MB), "
+          f"{summary['dangling']} dangling references"
+          + (f" (full list in {opts.report})" if opts.report else ""))
+    if opts.delete and not opts.dry_run:
+        print(f"{summary['deleted']} deleted, {summary['delete_failed']} failed")
+    elif summary["orphans"]:
+        print("Nothing deleted (use --delete)")
+    return 1 if summary["dangling"] or summary["delete_failed"] else 0
+
+
+def _run_one(command, target, opts):
+    try:
+        return target, True, OPERATIONS[command](target, opts)
+    except Exception as e:
+        return target, False, f"{type(e).__name__}: {e}" if not isinstance(e, (ValueError, RuntimeError)) else str(e)
+
+
+# ==================== COMMAND LINE ====================
+def build_parser():
+    parser = argparse.ArgumentParser(description="Batch operations on journeys (no browser needed)")
+    parser.add_argument("--data-dir", default=str(BASE_DIR), help="Folder with local journeys (default: app folder)")
+    parser.add_argument("--bucket", help="Use journeys in this GCS bucket instead of local files")
+    parser.add_argument("--folder", default=DEFAULT_BUCKET_FOLDER, help="Journey folder in the bucket")
+    parser.add_argument("--credentials", help="Service account JSON for GCS (default: ambient credentials)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Worker processes (default: 1)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change, write nothing")
+    # Also accepted after the command; SUPPRESS keeps the global value otherwise
+    shared = argparse.ArgumentParser(add_help=False)
+    shared.add_argument("--jobs", "-j", type=int, default=argparse.SUPPRESS)
+    shared.add_argument("--dry-run", action="store_true", default=argparse.SUPPRESS)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def journey_command(name, help_text, parent=sub):
+        p = parent.add_parser(name, help=help_text, parents=[shared])
+        p.add_argument("journeys", nargs="*", help="Journey names or globs, e.g. 'trip-*.json'")
+        p.add_argument("--all", action="store_true", help="Every journey in the store")
+        return p
+
+    journey_command("validate", "Check journeys against the schema")
+    journey_command("compact", "Rewrite journeys in canonical form")
+    journey_command("reindex", "Renumber event ids in date order")
+    journey_command("migrate-format", "Upgrade journeys saved in older layouts")
+    export = journey_command("export", "Copy journeys out of the store")
+    export.add_argument("--out", required=True, help="Destination folder")
+    archive = journey_command("archive", "Write journeys with their media as ZIP archives")
+    archive.add_argument("--out", required=True, help="Destination folder")
+    archive.add_argument("--prefetch", type=int, default=4, help="GCS media downloaded ahead (default: 4)")
+    site = journey_command("site", "Export journeys as static websites")
+    site.add_argument("--out", required=True, help="Destination folder (one subfolder per journey)")
+    site.add_argument("--workers", type=int, default=8, help="Threads copying media and rendering popups")
+    imp = sub.add_parser("import", help="Add local JSON files or archives to the store as journeys",
+                         parents=[shared])
+    imp.add_argument("files", nargs="+")
+    imp.add_argument("--force", action="store_true", help="Replace journeys that already exist")
+
+    media = sub.add_parser("media", help="Bulk media operations").add_subparsers(dest="media_command", required=True)
+    journey_command("check", "Report media references that don't resolve", media)
+    relink = journey_command("relink", "Rewrite media reference prefixes", media)
+    relink.add_argument("--old-prefix", required=True)
+    relink.add_argument("--new-prefix", required=True)
+    gc = media.add_parser("gc", help="Find orphaned media and references to media that is gone",
+                          parents=[shared])
+    gc.add_argument("--delete", action="store_true", help="Delete the orphans found")
+    gc.add_argument("--min-age-hours", type=float, default=24,
+                    help="Only treat media older than this as orphaned (default: 24)")
+    gc.add_argument("--report", help="Write every orphan and dangling reference to this JSON-lines file")
+    return parser
+
+
+def resolve_targets(store, opts):
+    if opts.command == "import":
+        return list(opts.files)
+    available = list_journeys(store)
+    if opts.all:
+        return available
+    targets = []
+    for pattern in opts.journeys:
+        hits = fnmatch.filter(available, pattern) if any(c in pattern for c in "*?[") else [pattern]
+        targets.extend(t for t in hits if t not in targets)
+    return targets
+
+
+def main(argv=None):
+    opts = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+    command = f"media {opts.media_command}" if opts.command == "media" else opts.command
+    store_config = {"data_dir": opts.data_dir, "bucket": opts.bucket,
+                    "folder": opts.folder, "credentials": opts.credentials}
+
+    _init_worker(store_config)
+    if command == "media gc":
+        return run_media_gc(_store, opts)
+    targets = resolve_targets(_store, opts)
+    if not targets:
+        print("No journeys selected (name them, use a glob, or --all)", file=sys.stderr)
+        return 2
+
+    if opts.jobs > 1 and len(targets) > 1:
+        with ProcessPoolExecutor(max_workers=opts.jobs, initializer=_init_worker,
+                                 initargs=(store_config,)) as pool:
+            results = pool.map(_run_one, [command] * len(targets), targets, [opts] * len(targets),
+                               chunksize=max(1, len(targets) // (opts.jobs * 4)))
+            results = list(results)
+    else:
+        results = [_run_one(command, t, opts) for t in targets]
+
+    failed = 0
+    for target, ok, message in results:
+        print(f"{'✅' if ok else '❌'} {target}: {message}")
+        failed += not ok
+    print(f"{len(results) - failed}/{len(results)} ok" + (" (dry run)" if opts.dry_run else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""Per-save version history of journeys.
+
+Every save appends a numbered version next to the journey::
+
+    <folder>/.history/<journey name>/00000001.json   full: the whole journey
+    <folder>/.history/<journey name>/00000002.json   delta: events added/changed, ids removed
+    ...
+
+The file is named by the number alone; the record's ``kind`` says which it
+is. A delta holds only the events that differ from the previous version
+(and the autobiography when it changed), so history grows with the size of
+the edits. Each delta names its checkpoint, and a new checkpoint is written
+once the deltas since the last one add up to more than the journey itself
+(or ``max_chain`` of them), so rebuilding any version reads one checkpoint
+and at most ``max_chain`` deltas, however long the history is.
+
+Versions are created exclusively (O_EXCL locally, ``if_generation_match=0``
+in GCS) and, being named by number only, a delta and a checkpoint can never
+both claim one: when another process appended first, the delta is
+recomputed against its version and numbered after it. Recording runs on a
+background thread, so saves never wait for it; ``flush`` waits for what's
+queued.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = ".history"
+MAX_CHAIN = 100
+CHECKPOINT_RATIO = 1.0  # Deltas since the last checkpoint may add up to this much of a full copy
+MAX_CACHED_HEADS = 16
+MAX_CREATE_ATTEMPTS = 5
+_RECORD_NAME = re.compile(r"^(\d{8})\.json$")
+
+
+# ==================== FILES ====================
+class LocalHistoryFiles:
+    """History of ``/path/name.json`` in ``/path/.history/name.json/``"""
+
+    def folder(self, ref):
+        ref = Path(ref)
+        return ref.parent / HISTORY_DIR / ref.name
+
+    def list(self, ref):
+        """(file name, modified timestamp) of every record"""
+        try:
+            with os.scandir(self.folder(ref)) as entries:
+                return [(e.name, e.stat().st_mtime) for e in entries if _RECORD_NAME.match(e.name)]
+        except FileNotFoundError:
+            return []
+
+    def read(self, ref, name):
+        return (self.folder(ref) / name).read_bytes()
+
+    def create(self, ref, name, data):
+        """Write a new record; False if ``name`` already exists"""
+        folder = self.folder(ref)
+        folder.mkdir(parents=True, exist_ok=True)
+        tmp = folder / f".{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp.write_bytes(data)
+        try:
+            os.link(tmp, folder / name)  # Atomic and never replaces an existing record
+        except FileExistsError:
+            return False
+        finally:
+            tmp.unlink()
+        return True
+
+    def move(self, ref, new_ref):
+        if self.folder(ref).exists():
+            self.folder(new_ref).parent.mkdir(parents=True, exist_ok=True)
+            os.rename(self.folder(ref), self.folder(new_ref))
+
+    def drop(self, ref):
+        shutil.rmtree(self.folder(ref), ignore_errors=True)
+
+
+class GCSHistoryFiles:
+    """History of ``<folder>/name.json`` under ``<folder>/.history/name.json/``"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def folder(self, ref):
+        ref = PurePosixPath(ref)
+        return f"{ref.parent}/{HISTORY_DIR}/{ref.name}/"
+
+    def _blobs(self, ref, fields="items(name,updated),nextPageToken"):
+        return self.bucket.client.list_blobs(self.bucket, prefix=self.folder(ref), fields=fields)
+
+    def list(self, ref):
+        prefix = self.folder(ref)
+        return [(blob.name[len(prefix):], blob.updated.timestamp() if blob.updated else 0.0)
+                for blob in self._blobs(ref) if _RECORD_NAME.match(blob.name[len(prefix):])]
+
+    def read(self, ref, name):
+        from google.api_core.exceptions import NotFound
+        try:
+            return self.bucket.blob(self.folder(ref) + name).download_as_bytes()
+        except NotFound:
+            raise FileNotFoundError(name)
+
+    def create(self, ref, name, data):
+        from google.api_core.exceptions import PreconditionFailed
+        try:
+            self.bucket.blob(self.folder(ref) + name).upload_from_string(
+                data, content_type="application/json", if_generation_match=0)
+        except PreconditionFailed:
+            return False
+        return True
+
+    def move(self, ref, new_ref):
+        prefix, new_prefix = self.folder(ref), self.folder(new_ref)
+        blobs = list(self._blobs(ref, fields="items(name),nextPageToken"))
+        for blob in blobs:
+            self.bucket.copy_blob(blob, self.bucket, new_prefix + blob.name[len(prefix):])
+        self.bucket.delete_blobs(blobs)
+
+    def drop(self, ref):
+        self.bucket.delete_blobs(list(self._blobs(ref, fields="items(name),nextPageToken")))
+
+
+# ==================== DELTAS ====================
+def _encode(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _document(state):
+    """Everything but the events (the autobiography block)"""
+    return {k: v for k, v in state.items() if k != "events"}
+
+
+def _digests(state):
+    """id -> fingerprint of each event, enough to tell which ones changed"""
+    return {e["id"]: hash(json.dumps(e, sort_keys=True, ensure_ascii=False)) for e in state["events"]}
+
+
+def diff(old_digests, state):
+    """(upserted events, removed ids, added count) turning ``old_digests`` into ``state``"""
+    upsert, added = [], 0
+    for event in state["events"]:
+        old = old_digests.get(event["id"])
+        if old is None:
+            added += 1
+            upsert.append(event)
+        elif old != hash(json.dumps(event, sort_keys=True, ensure_ascii=False)):
+            upsert.append(event)
+    ids = {e["id"] for e in state["events"]}
+    return upsert, [i for i in old_digests if i not in ids], added
+
+
+def changes(old_state, new_state):
+    """(added, changed, removed) event counts between two journey dicts"""
+    upsert, delete, added = diff(_digests(old_state), new_state)
+    return added, len(upsert) - added, len(delete)
+
+
+def apply_delta(state, record):
+    """``state`` (journey dict) moved forward by one delta record, in place"""
+    if "document" in record:
+        events = state["events"]
+        state.clear()
+        state.update(record["document"], events=events)
+    removed = set(record["delete"])
+    rows = {e["id"]: i for i, e in enumerate(state["events"]) if e["id"] not in removed}
+    events = [state["events"][i] for i in rows.values()]
+    rows = {event_id: i for i, event_id in enumerate(rows)}
+    for event in record["upsert"]:
+        row = rows.get(event["id"])
+        if row is None:
+            rows[event["id"]] = len(events)
+            events.append(event)
+        else:
+            events[row] = event
+    state["events"] = events
+    return state
+
+
+class Version:
+    def __init__(self, number, saved_at):
+        self.number = number
+        self.saved_at = saved_at  # Timestamp, from the record's file
+
+    def label(self):
+        return f"v{self.number} • {datetime.fromtimestamp(self.saved_at):%Y-%m-%d %H:%M:%S}"
+
+
+# ==================== HISTORY ====================
+class JourneyHistory:
+    def __init__(self, files, max_chain=MAX_CHAIN, checkpoint_ratio=CHECKPOINT_RATIO):
+        self.files = files
+        self.max_chain = max_chain
+        self.checkpoint_ratio = checkpoint_ratio
+        # ref -> (number, header, document, event digests) of the newest version we know of
+        self._heads = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+
+    # ---- queued: one writer thread keeps each journey's versions in save order ----
+    def record(self, ref, journey, previous=None):
+        """Queue a version for ``journey`` just saved as ``ref``. ``previous`` (what
+        was saved before) becomes the first version when ``ref`` has no history yet"""
+        return self._pool.submit(self._guard, self._record, ref, journey, previous)
+
+    def move(self, ref, new_ref):
+        """A renamed journey keeps its history"""
+        return self._pool.submit(self._guard, self._move, ref, new_ref)
+
+    def drop(self, ref):
+        """A deleted journey's history goes with it"""
+        return self._pool.submit(self._guard, self._drop, ref)
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written"""
+        return self._pool.submit(lambda: None).result(timeout)
+
+    def _guard(self, fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            logger.warning(f"History: {fn.__name__[1:]} {args[0]} failed: {e}")
+            return None
+
+    # ---- reading ----
+    def versions(self, ref):
+        """Every ``Version`` of ``ref``, newest first"""
+        found = []
+        for name, saved_at in self.files.list(ref):
+            found.append(Version(int(_RECORD_NAME.match(name).group(1)), saved_at))
+        return sorted(found, key=lambda v: v.number, reverse=True)
+
+    def load(self, ref, number):
+        """(journey dict, deltas applied) of version ``number``"""
+        record = self._read(ref, number)
+        if record["kind"] == "full":
+            return record["journey"], 0
+        checkpoint = record["checkpoint"]
+        state = self._read(ref, checkpoint, kind="full")["journey"]
+        for n in range(checkpoint + 1, number):
+            apply_delta(state, self._read(ref, n, kind="delta"))
+        return apply_delta(state, record), number - checkpoint
+
+    def _read(self, ref, number, kind=None):
+        try:
+            record = json.loads(self.files.read(ref, f"{number:08d}.json"))
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Version {number} of {ref}")
+        if kind is not None and record["kind"] != kind:
+            raise ValueError(f"Version {number} of {ref} is a {record['kind']}, expected a {kind}")
+        return record
+
+    # ---- writing ----
+    def _head(self, ref, reload=False):
+        with self._lock:
+            head = None if reload else self._heads.get(ref)
+            if head is not None:
+                self._heads.move_to_end(ref)
+                return head
+        versions = self.versions(ref)
+        if not versions:
+            return None
+        number = versions[0].number
+        state, _ = self.load(ref, number)
+        record = self._read(ref, number)
+        header = {k: record[k] for k in ("checkpoint", "chain_bytes", "full_bytes")}
+        return self._remember(ref, (number, header, _document(state), _digests(state)))
+
+    def _remember(self, ref, head):
+        with self._lock:
+            self._heads[ref] = head
+            self._heads.move_to_end(ref)
+            while len(self._heads) > MAX_CACHED_HEADS:
+                self._heads.popitem(last=False)
+        return head
+
+    def _record(self, ref, journey, previous):
+        state = journey.to_dict()
+        head = self._head(ref)
+        if head is None and previous is not None:
+            head = self._append(ref, None, previous.to_dict())
+            if head is False:
+                head = self._head(ref, reload=True)  # Another process wrote version 1 first
+        for _ in range(MAX_CREATE_ATTEMPTS):
+            if self._append(ref, head, state, check=True) is not False:
+                return
+            head = self._head(ref, reload=True)  # Another process appended first
+        logger.warning(f"History: gave up recording {ref} after {MAX_CREATE_ATTEMPTS} attempts")
+
+    def _append(self, ref, head, state, check=False):
+        """Write ``state`` after ``head``; the new head, ``head`` if nothing changed,
+        or False when that version number was taken meanwhile"""
+        saved_at = datetime.now().isoformat(timespec="seconds")
+        document, digests = _document(state), _digests(state)
+        record = None
+        if head is not None:
+            number, header, old_document, old_digests = head
+            upsert, delete, added = diff(old_digests, state)
+            if check and not upsert and not delete and document == old_document:
+                return head
+            delta = {"kind": "delta", "version": number + 1, "saved_at": saved_at,
+                     "checkpoint": header["checkpoint"], "added": added,
+                     "changed": len(upsert) - added, "removed": len(delete),
+                     "upsert": upsert, "delete": delete}
+            if document != old_document:
+                delta["document"] = document
+            data = _encode(delta)
+            chain_bytes = header["chain_bytes"] + len(data)
+            # Bounded replay: a fresh checkpoint once the chain outgrows a full copy
+            if (number + 1 - header["checkpoint"] <= self.max_chain
+                    and chain_bytes <= self.checkpoint_ratio * header["full_bytes"]):
+                record = delta
+                header = {"checkpoint": header["checkpoint"], "chain_bytes": chain_bytes,
+                          "full_bytes": header["full_bytes"]}
+        number = head[0] + 1 if head is not None else 1
+        if record is None:
+            record = {"kind": "full", "version": number, "saved_at": saved_at, "checkpoint": number,
+                      "journey": state}
+            data = _encode(record)
+            header = {"checkpoint": number, "chain_bytes": 0, "full_bytes": len(data)}
+        record.update(header)
+        data = _encode(record)
+        if not self.files.create(ref, f"{number:08d}.json", data):
+            return False
+        logger.info(f"🕘 Recorded {record['kind']} v{number} of {ref} ({len(data):,} bytes)")
+        return self._remember(ref, (number, header, document, digests))
+
+    def _move(self, ref, new_ref):
+        self.files.move(ref, new_ref)
+        with self._lock:
+            self._heads.pop(ref, None)
+            self._heads.pop(new_ref, None)
+
+    def _drop(self, ref):
+        self.files.drop(ref)
+        with self._lock:
+            self._heads.pop(ref, None)
@@ -0,0 +1,99 @@
+"""Optimistic concurrency for journey saves.
+
+Every session remembers the snapshot (and storage version) its edits started
+from. A save is a conditional write against that version; if someone else
+saved in between, we read their copy, merge event by event and try again.
+"""
+import logging
+
+from journey_model import Journey
+from journey_storage import NO_OBJECT, WriteConflict
+
+logger = logging.getLogger(__name__)
+
+MAX_SAVE_ATTEMPTS = 5
+
+
+def _merge_value(base, ours, theirs):
+    """Classic three-way pick; ``ours`` wins when both sides changed"""
+    if ours == theirs or theirs == base:
+        return ours, False
+    if ours == base:
+        return theirs, False
+    return ours, True
+
+
+def _merge_dicts(base, ours, theirs):
+    merged, conflict = {}, False
+    for key in list(ours) + [k for k in theirs if k not in ours]:
+        value, clash = _merge_value(base.get(key), ours.get(key), theirs.get(key))
+        if value is not None:
+            merged[key] = value
+        conflict |= clash
+    return merged, conflict
+
+
+def three_way_merge(base, ours, theirs):
+    """Merge journey dicts at event level, keyed by event id.
+
+    Events changed on only one side take that side. Events changed on both
+    sides are merged field by field, ours winning on the same field. An edit
+    beats a concurrent delete. Two new events that got the same id are both
+    kept, ours with a fresh id. Returns ``(merged_dict, conflicting_ids)``.
+    """
+    base_events = {e["id"]: e for e in base.get("events", [])}
+    our_events = {e["id"]: e for e in ours.get("events", [])}
+    their_events = {e["id"]: e for e in theirs.get("events", [])}
+    next_id = max(list(base_events) + list(our_events) + list(their_events), default=0) + 1
+
+    events, conflicts = [], []
+    for eid in list(their_events) + [i for i in our_events if i not in their_events]:
+        b, o, t = base_events.get(eid), our_events.get(eid), their_events.get(eid)
+        if b is None and o is not None and t is not None and o != t:
+            # Both sides added an event with the same new id
+            events.append(t)
+            events.append({**o, "id": next_id})
+            next_id += 1
+            continue
+        if o is None and t is not None and b is not None and t != b:
+            events.append(t)  # we deleted, they edited: keep their edit
+            continue
+        if t is None and o is not None and b is not None and o != b:
+            events.append(o)  # they deleted, we edited: keep our edit
+            continue
+        value, clash = _merge_value(b, o, t)
+        if clash:
+            value, _ = _merge_dicts(b or {}, o, t)
+            conflicts.append(eid)
+        if value is not None:
+            events.append(value)
+
+    meta, _ = _merge_dicts(base.get("autobiography", {}), ours.get("autobiography", {}),
+                           theirs.get("autobiography", {}))
+    return {"autobiography": meta, "events": events}, conflicts
+
+
+def save_with_merge(store, ref, ours, base=None, base_version=None, max_attempts=MAX_SAVE_ATTEMPTS):
+    """Conditionally write ``ours``; on conflict merge with the stored copy and retry.
+
+    ``base`` is the Journey our edits started from and ``base_version`` its
+    storage version (None to create a new journey: never written over an
+    existing one, that one is merged with instead). Returns
+    ``(version, saved_journey, conflicting_ids)``; ``saved_journey`` is
+    ``ours`` unless a merge happened.
+    """
+    expected = base_version if base_version is not None else NO_OBJECT
+    conflicts = []
+    for attempt in range(max_attempts):
+        try:
+            version = store.write(ref, ours.to_json(), if_version=expected)
+            return version, ours, conflicts
+        except WriteConflict:
+            theirs_bytes, expected = store.read(ref)
+            theirs = Journey.from_json(theirs_bytes)
+            base_dict = base.to_dict() if base is not None else {"autobiography": {}, "events": []}
+            merged, clashes = three_way_merge(base_dict, ours.to_dict(), theirs.to_dict())
+            logger.info(f"🔀 Merged concurrent changes into {ref} (attempt {attempt + 1}, conflicts: {clashes})")
+            conflicts.extend(c for c in clashes if c not in conflicts)
+            ours, base = Journey.from_dict(merged), theirs
+    raise WriteConflict(f"Gave up saving {ref} after {max_attempts} conflicting writes")
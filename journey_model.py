@@ -0,0 +1,404 @@
+"""Compact columnar representation of a journey.
+
+A journey document on disk / in GCS is a dict with an ``autobiography`` header
+and a list of event dicts. In memory we keep it as parallel NumPy arrays
+(ids, ordinal dates, lat/lon) plus interned string tables, sorted by date once
+at load time. Media references live in their own list so that the hot columns
+stay small. Dict views are only built when an edit needs one.
+"""
+import json
+from datetime import date, datetime
+
+import numpy as np
+
+EVENT_KEYS = ("id", "title", "date", "location", "description", "media")
+EMPTY_MEDIA = ((), ())
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def default_journey_dict(title="My Life Journey"):
+    today = datetime.now().strftime("%Y-%m-%d")
+    return {
+        "autobiography": {
+            "title": title,
+            "author": "Your Name",
+            "created_date": today,
+            "last_updated": today
+        },
+        "events": []
+    }
+
+
+def date_to_ordinal(s):
+    """'YYYY-MM-DD' -> proleptic ordinal, 0 when missing or malformed"""
+    try:
+        return datetime.strptime(s, "%Y-%m-%d").toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+def ordinal_to_date(o):
+    return date.fromordinal(int(o)).strftime("%Y-%m-%d") if o > 0 else "0000-00-00"
+
+
+def _readonly(arr):
+    arr.flags.writeable = False
+    return arr
+
+
+class _Interner:
+    """Builds a string table and the int32 codes pointing into it"""
+
+    def __init__(self, table=()):
+        self.table = list(table)
+        self.index = {s: i for i, s in enumerate(self.table)}
+
+    def code(self, s):
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.table)
+            self.table.append(s)
+        return i
+
+
+class Journey:
+    """Immutable, date-sorted columnar journey.
+
+    Row ``i`` is the i-th event in chronological order (stable for equal
+    dates, matching the old ``sorted(events, key=date)``). Arrays are
+    read-only and the other columns are tuples, so one instance can be shared
+    between sessions without copying. Editing methods return a new
+    ``Journey``; unchanged columns and string tables are shared.
+    """
+
+    __slots__ = ("meta", "ids", "ordinals", "lat", "lon", "title_codes", "titles",
+                 "loc_codes", "locations", "descriptions", "media", "extras", "__weakref__")
+
+    def __init__(self, meta, ids, ordinals, lat, lon, title_codes, titles,
+                 loc_codes, locations, descriptions, media, extras=None):
+        self.meta = meta
+        self.ids = _readonly(ids)
+        self.ordinals = _readonly(ordinals)
+        self.lat = _readonly(lat)
+        self.lon = _readonly(lon)
+        self.title_codes = _readonly(title_codes)
+        self.titles = titles
+        self.loc_codes = _readonly(loc_codes)
+        self.locations = locations
+        self.descriptions = descriptions
+        self.media = media
+        self.extras = extras or {}
+
+    # ==================== CONVERSION ====================
+    @classmethod
+    def from_dict(cls, data):
+        events = data.get("events", [])
+        n = len(events)
+        ids = np.empty(n, dtype=np.int64)
+        ordinals = np.empty(n, dtype=np.int32)
+        lat = np.empty(n, dtype=np.float64)
+        lon = np.empty(n, dtype=np.float64)
+        title_codes = np.empty(n, dtype=np.int32)
+        loc_codes = np.empty(n, dtype=np.int32)
+        titles, locations, descriptions = _Interner(), _Interner(), _Interner()
+        desc_rows, media, extras = [], [], {}
+
+        for i, e in enumerate(events):
+            loc = e.get("location", {})
+            ids[i] = e.get("id", 0)
+            ordinals[i] = date_to_ordinal(e.get("date"))
+            lat[i] = loc.get("latitude", 0.0)
+            lon[i] = loc.get("longitude", 0.0)
+            title_codes[i] = titles.code(e.get("title", ""))
+            loc_codes[i] = locations.code(loc.get("name", ""))
+            desc_rows.append(descriptions.table[descriptions.code(e.get("description", "") or "")])
+            media.append(_pack_media(e.get("media")))
+            extra = _event_extras(e)
+            if extra:
+                extras[int(ids[i])] = extra
+
+        order = np.argsort(ordinals, kind="stable")
+        meta = dict(data.get("autobiography", {}))
+        return cls(meta, ids[order], ordinals[order], lat[order], lon[order],
+                   title_codes[order], tuple(titles.table), loc_codes[order], tuple(locations.table),
+                   tuple(desc_rows[j] for j in order), tuple(media[j] for j in order), extras)
+
+    @classmethod
+    def from_json(cls, raw):
+        text = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+        if not text.strip():
+            raise ValueError("Empty")
+        return cls.from_dict(json.loads(text))
+
+    def to_dict(self):
+        return {"autobiography": dict(self.meta), "events": list(self.events())}
+
+    def to_json(self):
+        """UTF-8 bytes in the on-disk format (indented, non-ASCII kept)"""
+        return json.dumps(self.to_dict(), indent=4, ensure_ascii=False).encode("utf-8")
+
+    def event(self, i):
+        """Fresh, mutable dict view of row ``i`` (for edit forms and saving)"""
+        photos, videos = self.media[i]
+        e = {
+            "id": int(self.ids[i]),
+            "title": self.titles[self.title_codes[i]],
+            "date": ordinal_to_date(self.ordinals[i]),
+            "location": {
+                "name": self.locations[self.loc_codes[i]],
+                "latitude": float(self.lat[i]),
+                "longitude": float(self.lon[i])
+            },
+            "description": self.descriptions[i],
+            "media": {"photos": list(photos), "videos": list(videos)}
+        }
+        extra = self.extras.get(e["id"])
+        if extra:
+            e.update({k: v for k, v in extra.items() if k not in ("location", "media_extra")})
+            e["location"].update(extra.get("location", {}))
+            e["media"].update(extra.get("media_extra", {}))
+        return e
+
+    def events(self):
+        for i in range(len(self)):
+            yield self.event(i)
+
+    # ==================== COLUMN ACCESS ====================
+    def __len__(self):
+        return len(self.ids)
+
+    def title(self, i):
+        return self.titles[self.title_codes[i]]
+
+    def location_name(self, i):
+        return self.locations[self.loc_codes[i]]
+
+    def date_str(self, i):
+        return ordinal_to_date(self.ordinals[i])
+
+    def photos(self, i):
+        return self.media[i][0]
+
+    def videos(self, i):
+        return self.media[i][1]
+
+    def media_refs(self):
+        """Every photo/video reference in the journey, in row order"""
+        for photos, videos in self.media:
+            yield from photos
+            yield from videos
+
+    def coords(self):
+        return np.column_stack((self.lat, self.lon))
+
+    def years(self):
+        days = (self.ordinals.astype(np.int64) - _EPOCH_ORDINAL).astype("datetime64[D]")
+        return days.astype("datetime64[Y]").astype(np.int64) + 1970
+
+    def year_range(self):
+        if not len(self):
+            return None
+        return (date.fromordinal(max(int(self.ordinals[0]), 1)).year,
+                date.fromordinal(max(int(self.ordinals[-1]), 1)).year)
+
+    def row_of(self, event_id):
+        hits = np.flatnonzero(self.ids == event_id)
+        return int(hits[0]) if len(hits) else None
+
+    def next_id(self):
+        return int(self.ids.max()) + 1 if len(self) else 1
+
+    def nbytes(self):
+        """Rough in-memory footprint, used for cache budgeting"""
+        arrays = (self.ids.nbytes + self.ordinals.nbytes + self.lat.nbytes + self.lon.nbytes
+                  + self.title_codes.nbytes + self.loc_codes.nbytes)
+        strings = sum(len(s) + 49 for s in self.titles) + sum(len(s) + 49 for s in self.locations)
+        strings += sum(len(s) + 49 for s in set(self.descriptions))
+        refs = sum(len(r) + 49 for r in self.media_refs())
+        return arrays + strings + refs + 8 * (len(self.descriptions) + len(self.media))
+
+    # ==================== COPY-ON-WRITE EDITS ====================
+    def with_meta(self, **changes):
+        return Journey({**self.meta, **changes}, self.ids, self.ordinals, self.lat, self.lon,
+                       self.title_codes, self.titles, self.loc_codes, self.locations,
+                       self.descriptions, self.media, self.extras)
+
+    def with_event(self, event):
+        """Add ``event`` or replace the row with the same id, keeping date order"""
+        loc = event.get("location", {})
+        ordinal = date_to_ordinal(event.get("date"))
+        row = self.row_of(event["id"])
+        if row is not None and self.ordinals[row] == ordinal:
+            return self._replace_row(row, event)
+
+        base = self.without_event(event["id"])
+        at = int(np.searchsorted(base.ordinals, ordinal, side="right"))
+
+        titles, locations = _Interner(base.titles), _Interner(base.locations)
+        title_code = titles.code(event.get("title", ""))
+        loc_code = locations.code(loc.get("name", ""))
+        extras = base.extras
+        extra = _event_extras(event)
+        if extra:
+            extras = {**extras, int(event["id"]): extra}
+
+        def ins(arr, value):
+            return np.insert(arr, at, value)
+
+        descriptions = base.descriptions[:at] + (event.get("description", "") or "",) + base.descriptions[at:]
+        media = base.media[:at] + (_pack_media(event.get("media")),) + base.media[at:]
+        return Journey(base.meta, ins(base.ids, event["id"]), ins(base.ordinals, ordinal),
+                       ins(base.lat, loc.get("latitude", 0.0)), ins(base.lon, loc.get("longitude", 0.0)),
+                       ins(base.title_codes, title_code),
+                       tuple(titles.table) if len(titles.table) != len(base.titles) else base.titles,
+                       ins(base.loc_codes, loc_code),
+                       tuple(locations.table) if len(locations.table) != len(base.locations) else base.locations,
+                       descriptions, media, extras)
+
+    def _replace_row(self, i, event):
+        """Same row, new values: columns whose value didn't change are shared as-is"""
+        loc = event.get("location", {})
+        titles, locations = _Interner(self.titles), _Interner(self.locations)
+
+        def put(arr, value):
+            if arr[i] == value:
+                return arr
+            arr = arr.copy()
+            arr[i] = value
+            return arr
+
+        def put_item(items, value):
+            return items if items[i] == value else items[:i] + (value,) + items[i + 1:]
+
+        extras = self.extras
+        extra = _event_extras(event)
+        if extra != extras.get(int(event["id"]), {}):
+            extras = {k: v for k, v in extras.items() if k != event["id"]}
+            if extra:
+                extras[int(event["id"])] = extra
+
+        title_code = titles.code(event.get("title", ""))
+        loc_code = locations.code(loc.get("name", ""))
+        return Journey(self.meta, self.ids, self.ordinals,
+                       put(self.lat, loc.get("latitude", 0.0)), put(self.lon, loc.get("longitude", 0.0)),
+                       put(self.title_codes, title_code),
+                       tuple(titles.table) if len(titles.table) != len(self.titles) else self.titles,
+                       put(self.loc_codes, loc_code),
+                       tuple(locations.table) if len(locations.table) != len(self.locations) else self.locations,
+                       put_item(self.descriptions, event.get("description", "") or ""),
+                       put_item(self.media, _pack_media(event.get("media"))), extras)
+
+    def without_event(self, event_id):
+        i = self.row_of(event_id)
+        if i is None:
+            return self
+        extras = self.extras
+        if event_id in extras:
+            extras = {k: v for k, v in extras.items() if k != event_id}
+        return Journey(self.meta, np.delete(self.ids, i), np.delete(self.ordinals, i),
+                       np.delete(self.lat, i), np.delete(self.lon, i),
+                       np.delete(self.title_codes, i), self.titles,
+                       np.delete(self.loc_codes, i), self.locations,
+                       self.descriptions[:i] + self.descriptions[i + 1:],
+                       self.media[:i] + self.media[i + 1:], extras)
+
+
+def _pack_media(media):
+    media = media or {}
+    photos, videos = tuple(media.get("photos", ())), tuple(media.get("videos", ()))
+    return (photos, videos) if photos or videos else EMPTY_MEDIA
+
+
+def _event_extras(e):
+    """Keys we don't model as columns, kept so that to_dict() round-trips"""
+    extra = {k: v for k, v in e.items() if k not in EVENT_KEYS}
+    if "date" in e and date_to_ordinal(e["date"]) == 0:
+        extra["date"] = e["date"]
+    loc_extra = {k: v for k, v in e.get("location", {}).items()
+                 if k not in ("name", "latitude", "longitude")}
+    if loc_extra:
+        extra["location"] = loc_extra
+    media_extra = {k: v for k, v in (e.get("media") or {}).items() if k not in ("photos", "videos")}
+    if media_extra:
+        extra["media_extra"] = media_extra
+    return extra
+
+
+# ==================== SCHEMA CHECKS & MIGRATION ====================
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic")
+
+
+def validate_event(e, n=0, seen=None):
+    """Problems with one event dict (``n`` is its position, ``seen`` the ids so far)"""
+    if not isinstance(e, dict):
+        return [f"event #{n}: not an object"]
+    problems = []
+    eid = e.get("id")
+    if not isinstance(eid, int):
+        problems.append(f"event #{n}: missing or non-integer id")
+    elif seen is not None:
+        if eid in seen:
+            problems.append(f"event #{n}: duplicate id {eid}")
+        seen.add(eid)
+    if date_to_ordinal(e.get("date")) == 0:
+        problems.append(f"event {eid}: bad date {e.get('date')!r}")
+    loc = e.get("location")
+    if not isinstance(loc, dict):
+        return problems + [f"event {eid}: missing location"]
+    try:
+        lat, lon = float(loc.get("latitude")), float(loc.get("longitude"))
+    except (TypeError, ValueError):
+        return problems + [f"event {eid}: missing coordinates"]
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        problems.append(f"event {eid}: coordinates out of range ({lat}, {lon})")
+    return problems
+
+
+def validate_journey_dict(data):
+    """List of problems with a journey document (empty when it's fine)"""
+    if not isinstance(data, dict) or not all(k in data for k in ("autobiography", "events")):
+        return ["missing 'autobiography' or 'events' section"]
+    if not isinstance(data["events"], list):
+        return ["'events' must be a list"]
+    problems, seen = [], set()
+    for n, e in enumerate(data["events"]):
+        problems.extend(validate_event(e, n, seen))
+    return problems
+
+
+def migrate_journey_dict(data):
+    """Upgrade older layouts to the current one; returns (data, list_of_changes).
+
+    Handles a bare list of events, flat ``latitude``/``longitude``/``lat``/``lng``
+    keys, ``media`` given as one list, and events without ids.
+    """
+    changes = []
+    if isinstance(data, list):
+        data = {"events": data}
+        changes.append("wrapped bare event list")
+    data = dict(data)
+    if "autobiography" not in data:
+        data["autobiography"] = default_journey_dict()["autobiography"]
+        changes.append("added autobiography header")
+    events, used = [], {e.get("id") for e in data.get("events", []) if isinstance(e, dict)}
+    next_id = max([i for i in used if isinstance(i, int)], default=0) + 1
+    for e in data.get("events", []):
+        e = dict(e)
+        if "location" not in e or not isinstance(e["location"], dict):
+            lat = e.pop("latitude", e.pop("lat", None))
+            lon = e.pop("longitude", e.pop("lng", e.pop("lon", None)))
+            name = e.get("location") if isinstance(e.get("location"), str) else ""
+            e["location"] = {"name": name, "latitude": lat, "longitude": lon}
+            changes.append(f"event {e.get('id')}: nested location")
+        if isinstance(e.get("media"), list):
+            refs = e["media"]
+            photos = [r for r in refs if str(r).lower().endswith(PHOTO_EXTENSIONS)]
+            e["media"] = {"photos": photos, "videos": [r for r in refs if r not in photos]}
+            changes.append(f"event {e.get('id')}: split media into photos/videos")
+        if not isinstance(e.get("id"), int):
+            e["id"] = next_id
+            next_id += 1
+            changes.append(f"assigned id {e['id']}")
+        events.append(e)
+    data["events"] = events
+    return data, changes
@@ -0,0 +1,311 @@
+"""Restore journeys from a JSON backup or a full archive (see journey_archive).
+
+The journey JSON is parsed incrementally: ``iter_journey`` reads the input in
+chunks and yields the ``autobiography`` header and then one event at a time,
+so each event is validated as it arrives and no second copy of the raw text is
+kept around. Archive media is re-uploaded on a thread pool under
+content-addressed names (``<kind>/<sha256><ext>``): anything the bucket (or
+uploads folder) already has is skipped, and media references in the journey
+are rewritten to point at the uploaded copies.
+"""
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+from journey_archive import CHUNK_SIZE, JOURNEY_MEMBER, MANIFEST_MEMBER
+from journey_model import validate_event
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+MAX_REPORTED_PROBLEMS = 20
+DEFAULT_WORKERS = 8
+
+
+# ==================== STREAMING JSON ====================
+class _StreamReader:
+    """Just enough of a pull parser to walk one journey document"""
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=READ_SIZE):
+        data = "" if self.eof else self.stream.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError(f"Invalid journey JSON: expected {ch!r} near {self.buf[self.pos:self.pos + 30]!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more input as needed"""
+        self.peek()
+        size = READ_SIZE
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self.buf, self.pos)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ValueError(f"Invalid journey JSON: {e.msg}")
+            size *= 2  # One huge value shouldn't cost quadratic re-parsing
+            self._fill(size)
+
+
+def iter_journey(stream):
+    """Yield ``(key, value)`` for top-level keys and ``("event", e)`` per event"""
+    r = _StreamReader(stream)
+    r.expect("{")
+    if r.peek() == "}":
+        r.pos += 1
+    else:
+        while True:
+            key = r.value()
+            if not isinstance(key, str):
+                raise ValueError("Invalid journey JSON: object keys must be strings")
+            r.expect(":")
+            if key == "events" and r.peek() == "[":
+                r.pos += 1
+                yield "events", None  # Marks the start of the list
+                if r.peek() == "]":
+                    r.pos += 1
+                else:
+                    while True:
+                        yield "event", r.value()
+                        if r.peek() == "]":
+                            r.pos += 1
+                            break
+                        r.expect(",")
+            else:
+                yield key, r.value()
+            if r.peek() == "}":
+                r.pos += 1
+                break
+            r.expect(",")
+    if r.peek():
+        raise ValueError("Invalid journey JSON: extra data after the journey")
+
+
+def parse_journey_stream(raw):
+    """(data, problems) for a binary stream holding one journey document"""
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig")
+    data, events, problems, seen = {}, None, [], set()
+    try:
+        for key, value in iter_journey(text):
+            if key == "event":
+                if len(problems) < MAX_REPORTED_PROBLEMS:
+                    problems.extend(validate_event(value, len(events), seen))
+                events.append(value)
+            elif key == "events":
+                if value is None:
+                    events = []
+                else:
+                    problems.append("'events' must be a list")
+            else:
+                data[key] = value
+    finally:
+        text.detach()  # Leave the caller's file open
+    if not isinstance(data.get("autobiography"), dict) or events is None:
+        problems.insert(0, "missing 'autobiography' or 'events' section")
+    data["events"] = events or []
+    return data, problems[:MAX_REPORTED_PROBLEMS]
+
+
+# ==================== MEDIA DESTINATIONS ====================
+class LocalMediaSink:
+    """Restored media goes to the local uploads folders"""
+
+    def __init__(self, photos_dir, videos_dir):
+        self.dirs = {"photos": Path(photos_dir), "videos": Path(videos_dir)}
+
+    def _path(self, kind, digest, ext):
+        return self.dirs[kind] / f"{digest}{ext}"
+
+    def ref(self, kind, digest, ext):
+        return str(self._path(kind, digest, ext))
+
+    def exists(self, kind, digest, ext):
+        return self._path(kind, digest, ext).exists()
+
+    def put(self, kind, digest, ext, src, size):
+        path = self._path(kind, digest, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as out:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+
+class GCSMediaSink:
+    """Restored media goes to ``photos/`` and ``videos/`` in the bucket"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def ref(self, kind, digest, ext):
+        return f"gs://{self.bucket.name}/{kind}/{digest}{ext}"
+
+    def exists(self, kind, digest, ext):
+        return self.bucket.get_blob(f"{kind}/{digest}{ext}") is not None
+
+    def put(self, kind, digest, ext, src, size):
+        from google.api_core.exceptions import PreconditionFailed
+        blob = self.bucket.blob(f"{kind}/{digest}{ext}")
+        try:
+            # Same name means same content, so losing a race to another upload is fine
+            blob.upload_from_file(src, size=size, if_generation_match=0,
+                                  content_type=mimetypes.guess_type(blob.name)[0] or "application/octet-stream")
+        except PreconditionFailed:
+            pass
+
+
+# ==================== RESTORE ====================
+def _restore_member(zf, member, kind, expected, sink):
+    """Upload one archive member unless the sink has it; returns (ref, uploaded)"""
+    info = zf.getinfo(member)
+    # Hash locally first: the name is the hash, so it must be the real one,
+    # and the upload itself can then stream (and retry) straight from the ZIP
+    hasher = hashlib.sha256()
+    with zf.open(info) as src:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    if expected and expected != digest:
+        raise ValueError(f"checksum mismatch (manifest says {expected[:12]}…)")
+    ext = PurePosixPath(member).suffix.lower()
+    if sink.exists(kind, digest, ext):
+        return sink.ref(kind, digest, ext), False
+    with zf.open(info) as src:
+        sink.put(kind, digest, ext, src, info.file_size)
+    return sink.ref(kind, digest, ext), True
+
+
+def safe_journey_name(name):
+    """Plain ``<name>.json`` file name from an archive's manifest, or None.
+
+    The manifest is user input: directories (``../``, absolute paths) are
+    dropped so the journey can only land in the store's own folder.
+    """
+    if not isinstance(name, str):
+        return None
+    name = PurePosixPath(name.replace("\\", "/")).name
+    if not name.endswith(".json") or name.startswith(".") or name == ".json":
+        return None
+    return name
+
+
+def restore_archive(zf, sink, workers=DEFAULT_WORKERS, progress=None):
+    """Validate the archive's journey, upload its media, return (name, data, report).
+
+    ``name`` is the journey file name the archive was made from, made safe
+    by ``safe_journey_name`` (None if it had none usable).
+    """
+    names = set(zf.namelist())
+    if JOURNEY_MEMBER not in names:
+        raise ValueError(f"Not a journey archive: no {JOURNEY_MEMBER}")
+    manifest = json.loads(zf.read(MANIFEST_MEMBER)) if MANIFEST_MEMBER in names else {}
+    with zf.open(JOURNEY_MEMBER) as raw:
+        data, problems = parse_journey_stream(raw)
+    if problems:
+        raise ValueError("; ".join(problems))
+
+    hashes = {m["path"]: m.get("sha256") for m in manifest.get("media", [])}
+    mapping = {m["path"]: m["ref"] for m in manifest.get("missing", [])}
+    todo = {}
+    for e in data["events"]:
+        for kind in ("photos", "videos"):
+            for ref in (e.get("media") or {}).get(kind, []):
+                if ref in names and ref not in todo:
+                    todo[ref] = kind
+
+    report = {"uploaded": 0, "deduplicated": 0, "missing": list(mapping.values()), "failed": []}
+    # Several workers read members of the same ZipFile; zipfile serialises the seeks
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="restore") as pool:
+        futures = {member: pool.submit(_restore_member, zf, member, kind, hashes.get(member), sink)
+                   for member, kind in todo.items()}
+        for done, (member, future) in enumerate(futures.items(), start=1):
+            try:
+                mapping[member], uploaded = future.result()
+                report["uploaded" if uploaded else "deduplicated"] += 1
+            except Exception as e:
+                logger.warning(f"Restore: could not upload {member}: {e}")
+                report["failed"].append(member)
+            if progress is not None:
+                progress(done, len(futures))
+
+    for e in data["events"]:
+        media = e.get("media") or {}
+        for kind in ("photos", "videos"):
+            if kind in media:
+                media[kind] = [mapping.get(r, r) for r in media[kind]]
+    logger.info(f"📤 Restored archive: {report['uploaded']} uploaded, {report['deduplicated']} already present")
+    name = manifest.get("journey")
+    if name is not None and safe_journey_name(name) != name:
+        logger.warning(f"Restore: ignoring unsafe journey name {name!r} in the manifest")
+    return safe_journey_name(name), data, report
+
+
+def restore_upload(fileobj, sink, workers=DEFAULT_WORKERS, progress=None):
+    """Restore from a seekable binary file holding a journey JSON or archive.
+
+    Returns ``(archived_name_or_None, data, report)``; raises ValueError if
+    the journey doesn't validate.
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zf:
+            return restore_archive(zf, sink, workers, progress)
+    fileobj.seek(0)
+    data, problems = parse_journey_stream(fileobj)
+    if problems:
+        raise ValueError("; ".join(problems))
+    return None, data, {"uploaded": 0, "deduplicated": 0, "missing": [], "failed": []}
+
+
+def inspect_upload(fileobj):
+    """Cheap preview (title, event_count, is_archive); raises ValueError if invalid"""
+    fileobj.seek(0)
+    is_archive = zipfile.is_zipfile(fileobj)
+    fileobj.seek(0)
+    if is_archive:
+        with zipfile.ZipFile(fileobj) as zf, zf.open(JOURNEY_MEMBER) as raw:
+            data, problems = parse_journey_stream(raw)
+    else:
+        data, problems = parse_journey_stream(fileobj)
+    fileobj.seek(0)
+    if problems:
+        raise ValueError("; ".join(problems))
+    return data["autobiography"].get("title", ""), len(data["events"]), is_archive
@@ -0,0 +1,237 @@
+"""Storage backends for journey documents.
+
+``LocalJourneyStore`` keeps journeys as ``*.json`` files next to the app,
+``GCSJourneyStore`` keeps them under ``journeys/`` in a bucket. Both address a
+journey by the same ``ref`` strings the app already uses (a full local path,
+or a blob name) and report a cheap ``version`` token for it: ``(mtime_ns,
+size, inode)`` locally, the object generation in GCS.
+
+``names()`` lists the journeys directly in the store's folder; journeys in
+sub-folders (per-user folders, see app.py) belong to other stores.
+``updated_names()`` adds each one's last-modified time.
+
+Writes and moves take an optional ``if_version`` precondition and raise
+``WriteConflict`` when the stored journey moved on since that version.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from google.api_core.exceptions import PreconditionFailed
+
+logger = logging.getLogger(__name__)
+
+NO_OBJECT = 0  # ``if_version`` meaning "only if it doesn't exist yet" (GCS generation 0)
+LOCK_TIMEOUT = 10.0
+STALE_LOCK_AFTER = 30.0
+LIST_PAGE_SIZE = 1000
+
+
+class WriteConflict(Exception):
+    """The stored journey is not at the version the write was based on"""
+
+
+@contextmanager
+def _file_lock(path):
+    """Portable advisory lock: an O_EXCL lock file, broken if left stale"""
+    lock = f"{path}.lock"
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock).st_mtime > STALE_LOCK_AFTER:
+                    logger.warning(f"Breaking stale lock {lock}")
+                    os.unlink(lock)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for {lock}")
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        os.close(fd)
+        os.unlink(lock)
+
+
+# ==================== LOCAL FILESYSTEM ====================
+class LocalJourneyStore:
+    def __init__(self, base_dir):
+        self.base_dir = Path(base_dir)
+
+    def ref(self, json_name):
+        return str(self.base_dir / json_name)
+
+    def names(self):
+        """Journey file names in ``base_dir``"""
+        try:
+            with os.scandir(self.base_dir) as entries:
+                for entry in entries:
+                    if (entry.name.lower().endswith(".json") and not entry.name.startswith(".")
+                            and entry.is_file()):
+                        yield entry.name
+        except FileNotFoundError:
+            return
+
+    def updated_names(self):
+        """(name, modified timestamp) of every journey"""
+        names = []
+        for name in self.names():
+            try:
+                names.append((name, (self.base_dir / name).stat().st_mtime))
+            except FileNotFoundError:
+                pass
+        return names
+
+    def all_names(self):
+        """Journeys in ``base_dir`` and every sub-folder (per-user folders), as paths
+        relative to it; dot folders (history, caches) are skipped"""
+        for root, dirs, files in os.walk(self.base_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            rel = Path(root).relative_to(self.base_dir)
+            for name in files:
+                if name.lower().endswith(".json") and not name.startswith("."):
+                    yield (rel / name).as_posix()
+
+    def version(self, ref):
+        try:
+            st = os.stat(ref)
+        except FileNotFoundError:
+            return None
+        # Writes replace the file, so the inode changes even within one mtime tick
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def read(self, ref, version=None):
+        """Return (bytes, version); retried if the file changes mid-read"""
+        for _ in range(3):
+            before = self.version(ref)
+            data = Path(ref).read_bytes()
+            if self.version(ref) == before:
+                return data, before
+        return data, self.version(ref)
+
+    def write(self, ref, data, if_version=None):
+        """Atomically replace ``ref``; with ``if_version``, only if it's still at that version"""
+        with _file_lock(ref):
+            if if_version is not None and (self.version(ref) or NO_OBJECT) != if_version:
+                raise WriteConflict(ref)
+            tmp = f"{ref}.{os.getpid()}.{threading.get_ident()}.tmp"
+            Path(tmp).write_bytes(data)
+            os.replace(tmp, ref)
+            return self.version(ref)
+
+    def move(self, ref, new_ref, if_version=None):
+        """Rename ``ref``; never overwrites ``new_ref``. Returns the new version"""
+        first, second = sorted((ref, new_ref))
+        with _file_lock(first), _file_lock(second):
+            if os.path.exists(new_ref):
+                raise WriteConflict(new_ref)
+            if if_version is not None and self.version(ref) != if_version:
+                raise WriteConflict(ref)
+            os.rename(ref, new_ref)
+            return self.version(new_ref)
+
+
+# ==================== GOOGLE CLOUD STORAGE ====================
+class GCSJourneyStore:
+    """Journeys in a bucket, optionally read through a ``DiskBlobCache``"""
+
+    def __init__(self, bucket, folder="journeys", blob_cache=None):
+        self.bucket = bucket
+        self.folder = folder
+        self.blob_cache = blob_cache
+
+    def ref(self, json_name):
+        return f"{self.folder}/{json_name}"
+
+    def names(self):
+        """Journey names in the folder, paged; the glob is matched server-side and
+        doesn't descend into sub-folders, so other users' journeys cost nothing"""
+        prefix = f"{self.folder}/"
+        blobs = self.bucket.client.list_blobs(self.bucket, prefix=prefix, match_glob=f"{prefix}*.json",
+                                              page_size=LIST_PAGE_SIZE, fields="items(name),nextPageToken")
+        for page in blobs.pages:
+            for blob in page:
+                yield blob.name[len(prefix):]
+
+    def updated_names(self):
+        """(name, updated timestamp) of every journey, from the same single listing"""
+        prefix = f"{self.folder}/"
+        blobs = self.bucket.client.list_blobs(self.bucket, prefix=prefix, match_glob=f"{prefix}*.json",
+                                              page_size=LIST_PAGE_SIZE,
+                                              fields="items(name,updated),nextPageToken")
+        return [(blob.name[len(prefix):], blob.updated.timestamp() if blob.updated else 0.0)
+                for page in blobs.pages for blob in page]
+
+    def all_names(self):
+        """Journeys in the folder and every sub-folder (per-user folders), as paths
+        relative to it; dot folders (history) are skipped"""
+        prefix = f"{self.folder}/"
+        blobs = self.bucket.client.list_blobs(self.bucket, prefix=prefix, match_glob=f"{prefix}**.json",
+                                              page_size=LIST_PAGE_SIZE, fields="items(name),nextPageToken")
+        for page in blobs.pages:
+            for blob in page:
+                name = blob.name[len(prefix):]
+                if not any(part.startswith(".") for part in name.split("/")):
+                    yield name
+
+    def version(self, ref):
+        """Metadata-only request; None when the object doesn't exist"""
+        blob = self.bucket.get_blob(ref)
+        return blob.generation if blob is not None else None
+
+    def read(self, ref, version=None):
+        """``version`` is the generation we already know about, if any"""
+        if self.blob_cache is not None:
+            return self.blob_cache.fetch(self.bucket, ref, version)
+        blob = self.bucket.blob(ref)
+        data = blob.download_as_bytes()
+        return data, blob.generation
+
+    def write(self, ref, data, if_version=None):
+        """Upload ``ref``; with ``if_version``, only if its generation still matches"""
+        blob = self.bucket.blob(ref)
+        try:
+            blob.upload_from_string(data, content_type="application/json",
+                                    if_generation_match=if_version)
+        except PreconditionFailed:
+            raise WriteConflict(ref)
+        if self.blob_cache is not None:
+            self.blob_cache.store(ref, blob.generation, data)
+        return blob.generation
+
+    def move(self, ref, new_ref, if_version=None):
+        """Server-side rename: rewrite to ``new_ref`` (never overwriting it), then
+        delete ``ref`` only if it's still the generation we copied"""
+        source = self.bucket.get_blob(ref)
+        if source is None:
+            raise FileNotFoundError(ref)
+        if if_version is not None and source.generation != if_version:
+            raise WriteConflict(ref)
+        target = self.bucket.blob(new_ref)
+        try:
+            # Large objects may take several rewrite calls; small ones finish in one
+            token, _, _ = target.rewrite(source, if_generation_match=NO_OBJECT,
+                                         if_source_generation_match=source.generation)
+            while token is not None:
+                token, _, _ = target.rewrite(source, token=token, if_generation_match=NO_OBJECT,
+                                             if_source_generation_match=source.generation)
+        except PreconditionFailed:
+            raise WriteConflict(new_ref)
+        try:
+            source.delete(if_generation_match=source.generation)
+        except PreconditionFailed:
+            # Saved under the old name while we copied: undo, let the caller retry
+            target.delete(if_generation_match=target.generation)
+            raise WriteConflict(ref)
+        if self.blob_cache is not None:
+            self.blob_cache.discard(ref)
+        return target.generation
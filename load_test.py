@@ -0,0 +1,390 @@
+"""Concurrent-session load test for app.py, no browser needed.
+
+    python load_test.py                                  # 1, 5, 10, 20 sessions, 30 s each
+    python load_test.py --sessions 1,10,50 --duration 60 --events 2000
+    python load_test.py --sessions 20 --mix view=6,switch=2,add=1,edit=1 --json results.json
+    python load_test.py --url http://localhost:8501 --pid 1234   # an app that's already running
+
+The app runs as a real ``streamlit run`` server (started here unless
+``--url`` is given), and every session is a headless client speaking
+Streamlit's websocket protocol: it sends the same rerun requests and widget
+values a browser tab does and waits for the run to finish. ``AppTest`` can't
+do this: it swaps a process-wide runtime in and out around every run, so two
+of them can't run at the same time.
+
+Sessions loop until ``--duration`` runs out, picking one action at a time
+from ``--mix``:
+
+* ``view``   rerun the page (map, timeline, memory list);
+* ``switch`` click a "My Journeys" button to open another journey;
+* ``add``    switch to Edit Mode, click the map, fill in and save the add form;
+* ``edit``   open a memory's edit form and save a new title.
+
+Journeys are generated into a temporary folder the server is pointed at
+(``JOURNEY_DATA_DIR``), so the real journeys are never touched. Each level
+reports interactions per second, latency percentiles (request to finished
+run, including any ``st.rerun`` it triggers), script errors and the server's
+RSS. Timed fragments (``run_every``) are not polled, and nothing is rendered,
+so the numbers are the server's side of the story only.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+APP = Path(__file__).resolve().parent / "app.py"
+DEFAULT_SESSIONS = "1,5,10,20"
+DEFAULT_MIX = "view=6,switch=2,add=1,edit=1"
+SERVER_START_TIMEOUT = 60.0
+RSS_SAMPLE_INTERVAL = 0.5
+FINISHED = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY)
+
+
+# ==================== TEST DATA ====================
+def make_journeys(folder, journeys, events, seed=0):
+    """Write ``journeys`` synthetic journeys of ``events`` memories each; returns their names"""
+    rng = random.Random(seed)
+    names = []
+    for j in range(journeys):
+        lat0, lon0 = rng.uniform(-50, 60), rng.uniform(-150, 150)
+        day = date(1990, 1, 1)
+        items = []
+        for i in range(events):
+            day += timedelta(days=rng.randint(0, 10))
+            lat, lon = lat0 + rng.gauss(0, 3), lon0 + rng.gauss(0, 3)
+            items.append({
+                "id": i + 1,
+                "title": f"Memory {i + 1}",
+                "date": day.isoformat(),
+                "location": {"name": f"{lat:.5f}, {lon:.5f}", "latitude": round(lat, 6), "longitude": round(lon, 6)},
+                "description": "Load test memory",
+                "media": {"photos": [], "videos": []},
+            })
+        name = f"load_test_{j + 1}.json"
+        data = {"autobiography": {"title": f"Load test {j + 1}", "author": "load_test.py",
+                                  "created_date": day.isoformat(), "last_updated": day.isoformat()},
+                "events": items}
+        (Path(folder) / name).write_text(json.dumps(data, indent=4), encoding="utf-8")
+        names.append(name)
+    return names
+
+
+# ==================== SERVER ====================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(data_dir, journey, port):
+    """``streamlit run app.py`` on ``port`` against ``data_dir``; returns the Popen once it's healthy"""
+    env = dict(os.environ, JOURNEY_DATA_DIR=str(data_dir))
+    env.pop("DEPLOY_ENV", None)  # Local storage stand-in, never GCS
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", str(APP), "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false", "--", "--file", journey],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"streamlit exited with code {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=2) as resp:
+                if resp.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"streamlit didn't come up on port {port} within {SERVER_START_TIMEOUT:.0f}s")
+
+
+def rss_mb(pid):
+    """Resident set size of process ``pid`` (Linux /proc), None if unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+# ==================== SESSIONS ====================
+class Widget:
+    def __init__(self, kind, element, fragment_id):
+        self.kind = kind
+        self.id = element.id
+        self.label = getattr(element, "label", "")
+        self.options = list(getattr(element, "options", []))
+        self.disabled = getattr(element, "disabled", False)
+        self.fragment_id = fragment_id
+
+    def has_key(self, prefix):
+        # Widget ids end in "-<key>" for keyed widgets ("-None" otherwise)
+        return self.id.rpartition("-")[2].startswith(prefix)
+
+
+class Session:
+    """One headless browser tab talking to the server over its websocket"""
+
+    def __init__(self, index, url, timeout, rng):
+        self.index = index
+        self.url = url.replace("http", "ws", 1).rstrip("/") + "/_stcore/stream"
+        self.timeout = timeout
+        self.rng = rng
+        self.ws = None
+        self.page_hash = ""
+        self.widgets = {}  # id -> Widget on the page right now
+        self.latencies = []
+        self.errors = []
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def _run(self, states=(), fragment_id=""):
+        """Send one rerun request with ``states`` ((widget id, (field, value)), ...); records its latency"""
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = self.page_hash
+        msg.rerun_script.fragment_id = fragment_id
+        for widget_id, (field, value) in states:
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            setattr(state, field, value)
+        started = time.perf_counter()
+        try:
+            await self.ws.send(msg.SerializeToString())
+            ok = await asyncio.wait_for(self._receive_run(), self.timeout)
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+            return False
+        self.latencies.append(time.perf_counter() - started)
+        return ok
+
+    async def _receive_run(self):
+        """Read messages until the run (and any st.rerun it started) finishes"""
+        ok = True
+        while True:
+            fwd = ForwardMsg()
+            fwd.ParseFromString(await self.ws.recv())
+            kind = fwd.WhichOneof("type")
+            if kind == "new_session":
+                self.page_hash = fwd.new_session.main_script_hash
+                fragments = set(fwd.new_session.fragment_ids_this_run)
+                # A full run redraws the page; a fragment run only its own elements
+                self.widgets = {k: w for k, w in self.widgets.items()
+                                if fragments and w.fragment_id not in fragments}
+            elif kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                element_kind = fwd.delta.new_element.WhichOneof("type")
+                element = getattr(fwd.delta.new_element, element_kind)
+                if element_kind == "exception":
+                    self.errors.append(f"{element.type}: {element.message}")
+                    ok = False
+                elif getattr(element, "id", ""):
+                    self.widgets[element.id] = Widget(element_kind, element, fwd.delta.fragment_id)
+            elif kind == "script_finished":
+                if fwd.script_finished in FINISHED:
+                    return ok
+                if fwd.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    self.errors.append("script compile error")
+                    return False
+
+    def _find(self, kind, key=None, label=None):
+        return [w for w in self.widgets.values() if w.kind == kind and not w.disabled
+                and (key is None or w.has_key(key)) and (label is None or w.label == label)]
+
+    async def _click(self, button, extra=()):
+        return await self._run([(button.id, ("trigger_value", True)), *extra], button.fragment_id)
+
+    async def view(self):
+        return await self._run()
+
+    async def switch(self):
+        buttons = self._find("button", key="journey_switch_")
+        if not buttons:
+            return await self.view()
+        return await self._click(self.rng.choice(buttons))
+
+    async def add(self):
+        for mode in self._find("radio", key="mode_radio"):
+            edit_mode = next(o for o in mode.options if o.endswith("Edit Mode"))
+            if not await self._run([(mode.id, ("string_value", edit_mode))], mode.fragment_id):
+                return False
+        maps = self._find("component_instance")
+        if not maps:
+            self.errors.append("map not shown")
+            return False
+        click = {"last_clicked": {"lat": self.rng.uniform(-60, 70), "lng": self.rng.uniform(-170, 170)}}
+        if not await self._run([(maps[0].id, ("json_value", json.dumps(click)))], maps[0].fragment_id):
+            return False
+        titles, saves = self._find("text_input", label="Title*"), self._find("button", label="💾 Save Memory")
+        if not titles or not saves:
+            self.errors.append("add form not shown")
+            return False
+        title = f"Load test {self.index}-{len(self.latencies)}"
+        return await self._click(saves[0], [(titles[0].id, ("string_value", title))])
+
+    async def edit(self):
+        buttons = self._find("button", key="edit_sidebar_")
+        if not buttons or not await self._click(self.rng.choice(buttons)):
+            return False
+        titles, saves = self._find("text_input", label="Title"), self._find("button", label="💾 Save Changes")
+        if not titles or not saves:
+            self.errors.append("edit form not shown")
+            return False
+        title = f"Edited by session {self.index} at {time.strftime('%H:%M:%S')}"
+        return await self._click(saves[0], [(titles[0].id, ("string_value", title))])
+
+
+# ==================== LEVELS ====================
+async def run_level(url, sessions, duration, mix, timeout, seed, pid=None):
+    """Drive ``sessions`` concurrent sessions for ``duration`` seconds; returns the level's report"""
+    actions, weights = zip(*mix.items())
+    clients = [Session(i, url, timeout, random.Random(seed * 1000 + i)) for i in range(sessions)]
+    counts = dict.fromkeys(actions, 0)
+    rss_peak = [0.0]
+
+    async def sample_rss():
+        while True:
+            rss_peak[0] = max(rss_peak[0], rss_mb(pid) or 0.0)
+            await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+
+    async def open_tab(client):
+        await client.connect()
+        await client.view()  # First page load, like opening the tab
+
+    async def drive(client, stop_at):
+        while time.monotonic() < stop_at:
+            action = client.rng.choices(actions, weights)[0]
+            await getattr(client, action)()
+            counts[action] += 1
+
+    sampler = asyncio.create_task(sample_rss()) if pid is not None else None
+    try:
+        await asyncio.gather(*(open_tab(c) for c in clients))
+        started = time.monotonic()
+        await asyncio.gather(*(drive(c, started + duration) for c in clients))
+        elapsed = time.monotonic() - started
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+    first_loads = [c.latencies[0] for c in clients if c.latencies]
+    measured = [x for c in clients for x in c.latencies[1:]]
+    latencies = np.array(measured or [0.0]) * 1000
+    errors = [e for c in clients for e in c.errors]
+    rss = rss_mb(pid) if pid is not None else None
+    return {
+        "sessions": sessions,
+        "seconds": round(elapsed, 1),
+        "runs": len(measured),
+        "runs_per_s": round(len(measured) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p90_ms": round(float(np.percentile(latencies, 90)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "max_ms": round(float(latencies.max()), 1),
+        "first_load_ms": round(float(np.mean(first_loads)) * 1000, 1) if first_loads else None,
+        "actions": counts,
+        "errors": len(errors),
+        "first_errors": sorted(set(errors))[:5],
+        "rss_mb": round(rss, 1) if rss else None,
+        "rss_peak_mb": round(max(rss_peak[0], rss or 0.0), 1) if rss else None,
+    }
+
+
+def print_report(rows):
+    print(f"{'sessions':>8} {'runs/s':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'1st load':>8} {'errors':>6} {'RSS MB':>7} {'peak MB':>7}")
+    for r in rows:
+        rss = f"{r['rss_mb']:>7.1f} {r['rss_peak_mb']:>7.1f}" if r["rss_mb"] else f"{'-':>7} {'-':>7}"
+        print(f"{r['sessions']:>8} {r['runs_per_s']:>7.2f} {r['p50_ms']:>8.1f} {r['p90_ms']:>8.1f} "
+              f"{r['p99_ms']:>8.1f} {r['max_ms']:>8.1f} {r['first_load_ms'] or 0:>8.1f} {r['errors']:>6} {rss}")
+        for e in r["first_errors"]:
+            print(f"{'':>8}   ⚠️ {e}")
+
+
+# ==================== CLI ====================
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        action, _, weight = part.partition("=")
+        if action not in ("view", "switch", "add", "edit"):
+            raise argparse.ArgumentTypeError(f"unknown action {action!r}")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the journey app")
+    parser.add_argument("--sessions", default=DEFAULT_SESSIONS,
+                        help=f"comma-separated session counts, one level each (default {DEFAULT_SESSIONS})")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per level (default 30)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"action weights (default {DEFAULT_MIX})")
+    parser.add_argument("--journeys", type=int, default=3, help="synthetic journeys to switch between")
+    parser.add_argument("--events", type=int, default=200, help="memories per synthetic journey")
+    parser.add_argument("--data-dir", help="serve these journeys instead of generated ones (edits are written!)")
+    parser.add_argument("--url", help="test this running app instead of starting one")
+    parser.add_argument("--pid", type=int, help="with --url: the server process whose RSS to report")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a run counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    opts = parser.parse_args(argv)
+
+    levels = [int(n) for n in opts.sessions.split(",") if n.strip()]
+    scratch = server = None
+    rows = []
+    try:
+        if opts.url:
+            url, pid = opts.url, opts.pid
+        else:
+            if opts.data_dir:
+                data_dir = Path(opts.data_dir).resolve()
+                names = sorted(p.name for p in data_dir.glob("*.json"))
+            else:
+                scratch = data_dir = Path(tempfile.mkdtemp(prefix="journey-load-"))
+                names = make_journeys(data_dir, opts.journeys, opts.events, opts.seed)
+            if not names:
+                parser.error(f"no journeys in {data_dir}")
+            port = free_port()
+            server = start_server(data_dir, names[0], port)
+            url, pid = f"http://127.0.0.1:{port}", server.pid
+            print(f"📂 {len(names)} journeys in {data_dir}; server RSS at start: {rss_mb(pid) or 0:.1f} MB")
+        for n in levels:
+            print(f"🏃 {n} sessions for {opts.duration:.0f}s ...", flush=True)
+            rows.append(asyncio.run(run_level(url, n, opts.duration, opts.mix, opts.timeout, opts.seed, pid)))
+        print_report(rows)
+        if opts.json:
+            Path(opts.json).write_text(json.dumps(rows, indent=2, ensure_ascii=False), encoding="utf-8")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""Orphan-media collection and media reference integrity checks.
+
+Media ends up orphaned when a delete fails, a memory's photo is removed in the
+app or a restore is abandoned half-way. ``collect`` lists every stored media
+object (``photos/`` and ``videos/`` in the bucket, or the local uploads
+folders) and every media reference in every journey. It reports:
+
+* orphans: stored objects no journey references (optionally deleted)
+* dangling references: journey media that isn't stored anywhere
+
+Both sides go into a throwaway SQLite database, not Python sets, so memory
+stays flat with millions of objects. Bucket listings are split into key ranges
+(``start_offset``/``end_offset``) that are paged through in parallel. Objects
+younger than ``min_age`` are never treated as orphans, because the app uploads
+media before it saves the journey that references it.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from media_store import delete_media
+
+logger = logging.getLogger(__name__)
+
+MEDIA_KINDS = ("photos", "videos")
+PAGE_SIZE = 1000
+DELETE_CHUNK = 1000
+DEFAULT_MIN_AGE = 24 * 3600
+DEFAULT_WORKERS = 8
+# Range boundaries for parallel listing; names sort into one range each
+_SPLIT_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+# ==================== MEDIA LISTING ====================
+def _key_ranges(prefix, shards):
+    """Cover every name under ``prefix`` with ``shards`` contiguous ranges"""
+    step = max(1, len(_SPLIT_CHARS) // max(shards, 1))
+    bounds = [prefix + c for c in _SPLIT_CHARS[step::step]]
+    starts = [prefix] + bounds
+    ends = bounds + [None]
+    return list(zip(starts, ends))
+
+
+def list_gcs_media(bucket, prefixes=MEDIA_KINDS, workers=DEFAULT_WORKERS):
+    """Yield pages of ``(ref, size, updated_ts)`` for media objects in ``bucket``"""
+    ranges = [(f"{p}/", start, end) for p in prefixes for start, end in _key_ranges(f"{p}/", workers)]
+    pages = queue.Queue(maxsize=workers * 2)  # Bounded: listing waits for the database
+    done, cancelled = object(), threading.Event()
+
+    def walk(prefix, start, end):
+        try:
+            blobs = bucket.client.list_blobs(bucket, prefix=prefix, start_offset=start,
+                                             end_offset=end, page_size=PAGE_SIZE,
+                                             fields="items(name,size,updated),nextPageToken")
+            for page in blobs.pages:
+                if cancelled.is_set():
+                    return
+                pages.put([(f"gs://{bucket.name}/{b.name}", b.size or 0, b.updated.timestamp())
+                           for b in page if not b.name.endswith("/")])
+        finally:
+            pages.put(done)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gc-list") as pool:
+        futures = [pool.submit(walk, *r) for r in ranges]
+        remaining = len(futures)
+        try:
+            while remaining:
+                page = pages.get()
+                if page is done:
+                    remaining -= 1
+                else:
+                    yield page
+        finally:
+            # Consumer gave up early: unblock the listers so the pool can shut down
+            cancelled.set()
+            while remaining:
+                remaining -= pages.get() is done
+        for f in futures:
+            f.result()  # Surface listing errors rather than report a partial bucket as orphans
+
+
+def list_local_media(dirs):
+    """Yield pages of ``(path, size, mtime)`` for files in the upload folders"""
+    page = []
+    for folder in dirs:
+        if not Path(folder).is_dir():
+            continue
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if name.startswith("."):
+                    continue  # In-flight temp files from restores
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                page.append((_normalize_local(path), st.st_size, st.st_mtime))
+                if len(page) >= PAGE_SIZE:
+                    yield page
+                    page = []
+    if page:
+        yield page
+
+
+def _normalize_local(path, base_dir=None):
+    """Absolute, normalised path, so listed files and journey references compare
+    equal whether the data dir was given relative or absolute"""
+    p = Path(path)
+    if not p.is_absolute() and base_dir is not None:
+        p = Path(base_dir) / p
+    return os.path.abspath(str(p))
+
+
+# ==================== JOURNEY REFERENCES ====================
+def _journey_refs(store, name):
+    data, _ = store.read(store.ref(name))
+    refs = []
+    for e in json.loads(data.decode("utf-8")).get("events", []):
+        media = e.get("media") or {}
+        for kind in MEDIA_KINDS:
+            refs.extend(r for r in media.get(kind, []) if isinstance(r, str))
+    return refs
+
+
+def iter_journey_refs(store, names, workers=DEFAULT_WORKERS):
+    """Yield ``(journey, [refs])`` per journey, reading a few journeys ahead"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gc-read") as pool:
+        names = iter(names)
+        window = []
+        for name in names:
+            window.append((name, pool.submit(_journey_refs, store, name)))
+            if len(window) >= workers * 2:
+                break
+        while window:
+            name, future = window.pop(0)
+            next_name = next(names, None)
+            if next_name is not None:
+                window.append((next_name, pool.submit(_journey_refs, store, next_name)))
+            yield name, future.result()
+
+
+# ==================== COLLECTION ====================
+class MediaIndex:
+    """Temporary on-disk index of stored objects and journey references"""
+
+    def __init__(self, directory=None):
+        fd, self.path = tempfile.mkstemp(prefix="media-gc-", suffix=".sqlite", dir=directory)
+        os.close(fd)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA cache_size = -65536;
+            CREATE TABLE objects (ref TEXT PRIMARY KEY, size INTEGER, updated REAL) WITHOUT ROWID;
+            CREATE TABLE refs (ref TEXT, journey TEXT);
+        """)
+
+    def add_objects(self, rows):
+        self.db.executemany("INSERT OR IGNORE INTO objects VALUES (?, ?, ?)", rows)
+
+    def add_refs(self, journey, refs):
+        self.db.executemany("INSERT INTO refs VALUES (?, ?)", ((r, journey) for r in refs))
+
+    def finish_loading(self):
+        # Indexing once at the end is much faster than maintaining it per insert
+        self.db.execute("CREATE INDEX refs_by_ref ON refs (ref)")
+        self.db.commit()
+
+    def orphans(self, cutoff):
+        """(ref, size) of objects older than ``cutoff`` that nothing references"""
+        return self.db.execute(
+            "SELECT ref, size FROM objects o WHERE updated < ? "
+            "AND NOT EXISTS (SELECT 1 FROM refs r WHERE r.ref = o.ref) ORDER BY ref", (cutoff,))
+
+    def dangling(self, in_scope):
+        """(ref, journey) for references inside the listed area with no object"""
+        for ref, journey in self.db.execute(
+                "SELECT ref, journey FROM refs r WHERE NOT EXISTS "
+                "(SELECT 1 FROM objects o WHERE o.ref = r.ref) ORDER BY journey, ref"):
+            if in_scope(ref):
+                yield ref, journey
+
+    def count(self, table):
+        return self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+        Path(self.path).unlink(missing_ok=True)
+
+
+def collect(store, journeys, bucket=None, local_dirs=None, base_dir=None, delete=False,
+            min_age=DEFAULT_MIN_AGE, workers=DEFAULT_WORKERS, report_to=None, sample=10):
+    """Find (and with ``delete`` remove) orphaned media; flag dangling references.
+
+    Media is listed from ``bucket`` (a ``google.cloud.storage.Bucket``) or
+    ``local_dirs``. ``report_to``, if given, is a text file that receives every
+    orphan and dangling reference as JSON lines. Returns a summary dict with
+    counts and the first ``sample`` of each.
+    """
+    if bucket is not None:
+        roots = tuple(f"gs://{bucket.name}/{k}/" for k in MEDIA_KINDS)
+    else:
+        roots = tuple(_normalize_local(d) + os.sep for d in local_dirs)
+
+    def in_scope(ref):
+        return ref.startswith(roots)
+
+    def normalize(ref):
+        return ref if ref.startswith("gs://") else _normalize_local(ref, base_dir)
+
+    index = MediaIndex()
+    started = time.time()
+    try:
+        # Objects before journeys, so a journey saved meanwhile can only add references;
+        # a journey that can't be read aborts the run rather than orphan its media
+        pages = list_gcs_media(bucket, workers=workers) if bucket is not None else list_local_media(local_dirs)
+        for page in pages:
+            index.add_objects(page)
+        for journey, refs in iter_journey_refs(store, journeys, workers):
+            index.add_refs(journey, (normalize(r) for r in refs))
+        index.finish_loading()
+
+        summary = {"objects": index.count("objects"), "references": index.count("refs"),
+                   "journeys": len(journeys), "orphans": 0, "orphan_bytes": 0, "dangling": 0,
+                   "deleted": 0, "delete_failed": 0, "orphan_sample": [], "dangling_sample": []}
+        chunk = []
+
+        def flush_deletes():
+            if delete and chunk:
+                result = delete_media(chunk, bucket.client if bucket is not None else None, keep_shared=False)
+                summary["deleted"] += len(result["deleted"]) + len(result["missing"])
+                summary["delete_failed"] += len(result["failed"])
+            chunk.clear()
+
+        for ref, size in index.orphans(started - min_age):
+            summary["orphans"] += 1
+            summary["orphan_bytes"] += size or 0
+            if len(summary["orphan_sample"]) < sample:
+                summary["orphan_sample"].append(ref)
+            if report_to is not None:
+                report_to.write(json.dumps({"orphan": ref, "size": size}) + "\n")
+            chunk.append(ref)
+            if len(chunk) >= DELETE_CHUNK:
+                flush_deletes()
+        flush_deletes()
+
+        for ref, journey in index.dangling(in_scope):
+            summary["dangling"] += 1
+            if len(summary["dangling_sample"]) < sample:
+                summary["dangling_sample"].append((journey, ref))
+            if report_to is not None:
+                report_to.write(json.dumps({"dangling": ref, "journey": journey}) + "\n")
+    finally:
+        index.close()
+
+    logger.info(f"🧹 Media GC: {summary['objects']} objects, {summary['orphans']} orphans "
+                f"({summary['deleted']} deleted), {summary['dangling']} dangling references")
+    return summary
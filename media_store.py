@@ -0,0 +1,130 @@
+"""Bulk operations on journey media (photos and videos).
+
+Media references are local paths or ``gs://bucket/path`` URLs. Deleting many
+GCS objects goes through JSON API batch requests (up to ``BATCH_SIZE`` deletes
+per HTTP round trip, one at a time for a batch that reports errors); throttled
+or failed deletes are retried with backoff and whatever still fails is
+reported back rather than swallowed.
+"""
+import logging
+import re
+import time
+from pathlib import Path, PurePosixPath
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100  # GCS limit for calls in one batch request
+MAX_ATTEMPTS = 4
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}$")
+
+
+def parse_gs_ref(ref):
+    """'gs://bucket/a/b.jpg' -> ('bucket', 'a/b.jpg')"""
+    bucket_name, _, blob_path = ref[5:].partition("/")
+    return bucket_name, blob_path
+
+
+def is_content_addressed(ref):
+    """Restored media is named by its sha256 and may be shared between journeys"""
+    return bool(_CONTENT_ADDRESSED.match(PurePosixPath(ref).stem))
+
+
+def _delete_local(refs, report):
+    for ref in refs:
+        try:
+            Path(ref).unlink()
+            report["deleted"].append(ref)
+        except FileNotFoundError:
+            report["missing"].append(ref)
+        except OSError as e:
+            logger.warning(f"Could not delete {ref}: {e}")
+            report["failed"].append(ref)
+
+
+def _delete_gcs_batch(client, bucket_name, blob_paths):
+    """One batch request; returns {blob_path: http_status}.
+
+    A batch raises just one of its errors, so when one fails the chunk is
+    redone a delete at a time to get each outcome (the ones the batch did
+    delete then come back as 404, i.e. already gone).
+    """
+    from google.api_core.exceptions import GoogleAPICallError
+    bucket = client.bucket(bucket_name)
+    try:
+        with client.batch():
+            for path in blob_paths:
+                bucket.blob(path).delete()
+        return {path: 204 for path in blob_paths}
+    except GoogleAPICallError as e:
+        logger.debug(f"Batch delete in {bucket_name} reported {e}, deleting one by one")
+    statuses = {}
+    for path in blob_paths:
+        try:
+            bucket.blob(path).delete()
+            statuses[path] = 204
+        except GoogleAPICallError as e:
+            statuses[path] = e.code or 500
+    return statuses
+
+
+def _delete_gcs(client, bucket_name, blob_paths, report):
+    pending, attempt = list(blob_paths), 0
+    while pending and attempt < MAX_ATTEMPTS:
+        if attempt:
+            time.sleep(min(2 ** attempt, 30))
+        attempt += 1
+        retry = []
+        for start in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[start:start + BATCH_SIZE]
+            try:
+                statuses = _delete_gcs_batch(client, bucket_name, chunk)
+            except Exception as e:
+                logger.warning(f"Batch delete in {bucket_name} failed (attempt {attempt}): {e}")
+                retry.extend(chunk)
+                continue
+            for path, status in statuses.items():
+                ref = f"gs://{bucket_name}/{path}"
+                if 200 <= status < 300:
+                    report["deleted"].append(ref)
+                elif status == 404:
+                    report["missing"].append(ref)
+                elif status in RETRYABLE_STATUS:
+                    retry.append(path)
+                else:
+                    logger.debug(f"Could not delete {ref}: HTTP {status}")
+                    report["failed"].append(ref)
+        pending = retry
+    report["failed"].extend(f"gs://{bucket_name}/{p}" for p in pending)
+
+
+def delete_media(refs, client=None, keep_shared=True):
+    """Delete media references in as few round trips as possible.
+
+    Returns ``{"deleted": [...], "missing": [...], "failed": [...], "kept": [...]}``;
+    ``missing`` were already gone. With ``keep_shared`` content-addressed
+    media (restored from archives, possibly used by other journeys) is left
+    for the orphan collector instead.
+    """
+    report = {"deleted": [], "missing": [], "failed": [], "kept": []}
+    local, remote = [], {}
+    for ref in dict.fromkeys(refs):
+        if keep_shared and is_content_addressed(ref):
+            report["kept"].append(ref)
+        elif ref.startswith("gs://"):
+            bucket_name, path = parse_gs_ref(ref)
+            remote.setdefault(bucket_name, []).append(path)
+        else:
+            local.append(ref)
+
+    _delete_local(local, report)
+    if remote:
+        if client is None:
+            from google.cloud import storage
+            client = storage.Client()
+        for bucket_name, paths in remote.items():
+            _delete_gcs(client, bucket_name, paths, report)
+    if report["failed"]:
+        logger.error(f"🗑️ {len(report['failed'])} media deletes failed, e.g. {report['failed'][0]}")
+    logger.info(f"🗑️ Deleted {len(report['deleted'])} media ({len(report['missing'])} already gone)")
+    return report
@@ -0,0 +1,214 @@
+"""Cache tier shared by every app process (replica).
+
+``JourneyCache`` and friends are per process, so without this each replica
+downloads and parses the same journeys, and only notices another replica's
+save when its own revalidation comes round. A ``SharedCache`` holds what is
+worth sharing (raw journey JSON by ref and version, journey listings,
+rendered popups) and carries invalidation messages: a save on one replica
+tells the others to recheck that journey right away, and they then read the
+new bytes from here rather than from storage.
+
+Two backends, picked by ``open_shared_cache(url)``:
+
+* ``redis://...`` (needs the ``redis`` package): several hosts, messages over
+  pub/sub;
+* ``sqlite:///path/to/file.sqlite3``: replicas on one host, a WAL database
+  that messages are polled from every ``poll_interval`` seconds.
+
+The shared tier is only ever an optimisation: a backend error is logged and
+treated as a miss, and storage stays the source of truth for versions.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_POLL_INTERVAL = 0.5
+CHANNEL = "journey-cache"
+MESSAGE_TTL = 300.0  # SQLite keeps messages this long for slow pollers
+PURGE_EVERY = 50  # SQLite sets between purges of expired/over-budget entries
+
+
+class SharedCache:
+    """Backend-independent part: compression, error handling, subscribers.
+
+    Values are bytes, stored zlib-compressed. Messages are ``(kind, key)``
+    pairs; a process never receives its own.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._subscribers = []
+
+    def get(self, key):
+        try:
+            value = self._get(key)
+            return zlib.decompress(value) if value is not None else None
+        except Exception as e:
+            logger.warning(f"Shared cache read of {key} failed: {e}")
+            return None
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        try:
+            self._set(key, zlib.compress(value, 1), ttl)
+        except Exception as e:
+            logger.warning(f"Shared cache write of {key} failed: {e}")
+
+    def delete(self, key):
+        try:
+            self._delete(key)
+        except Exception as e:
+            logger.warning(f"Shared cache delete of {key} failed: {e}")
+
+    def publish(self, kind, key):
+        """Tell every other process that ``key`` of ``kind`` changed"""
+        try:
+            self._publish(f"{self.origin}\t{kind}\t{key}")
+        except Exception as e:
+            logger.warning(f"Shared cache could not publish {kind} {key}: {e}")
+
+    def subscribe(self, callback):
+        """``callback(kind, key)`` for every message from another process"""
+        self._subscribers.append(callback)
+
+    def _deliver(self, message):
+        origin, kind, key = message.split("\t", 2)
+        if origin == self.origin:
+            return
+        for callback in list(self._subscribers):
+            try:
+                callback(kind, key)
+            except Exception as e:
+                logger.warning(f"Shared cache subscriber failed on {kind} {key}: {e}")
+
+    def close(self):
+        pass
+
+
+# ==================== SQLITE ====================
+class SQLiteSharedCache(SharedCache):
+    """One database file on a host; every replica on it opens the same path"""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, poll_interval=DEFAULT_POLL_INTERVAL):
+        super().__init__()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._sets = 0
+        self._db = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages ("
+                         " id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT, sent_at REAL)")
+        self._last_id = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        self._stop = threading.Event()
+        threading.Thread(target=self._poll, name="shared-cache", daemon=True).start()
+
+    def _get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM entries WHERE key = ? AND expires > ?",
+                                   (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, value, ttl):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+            self._sets += 1
+            if self._sets % PURGE_EVERY == 0:
+                self._purge()
+
+    def _delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _publish(self, message):
+        with self._lock:
+            self._db.execute("INSERT INTO messages (message, sent_at) VALUES (?, ?)", (message, time.time()))
+
+    def _purge(self):
+        """Drop expired entries and old messages, then the soonest to expire until under budget"""
+        now = time.time()
+        self._db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        self._db.execute("DELETE FROM messages WHERE sent_at < ?", (now - MESSAGE_TTL,))
+        total = self._db.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._db.execute("SELECT key, LENGTH(value) FROM entries ORDER BY expires"):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM entries WHERE key = ?", victims)
+        logger.info(f"🧹 Evicted {len(victims)} shared cache entries")
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                with self._lock:
+                    rows = self._db.execute("SELECT id, message FROM messages WHERE id > ? ORDER BY id",
+                                            (self._last_id,)).fetchall()
+            except Exception as e:
+                logger.warning(f"Shared cache poll failed: {e}")
+                continue
+            for message_id, message in rows:
+                self._last_id = message_id
+                self._deliver(message)
+
+    def close(self):
+        self._stop.set()
+
+
+# ==================== REDIS ====================
+class RedisSharedCache(SharedCache):
+    """Redis (or anything speaking its protocol); keys live under ``prefix``"""
+
+    def __init__(self, url, prefix="journey:"):
+        super().__init__()
+        import redis
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{prefix + CHANNEL: self._on_message})
+        self._listener = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def _on_message(self, message):
+        data = message["data"]
+        self._deliver(data.decode("utf-8") if isinstance(data, bytes) else data)
+
+    def _get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def _set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=max(int(ttl), 1))
+
+    def _delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def _publish(self, message):
+        self.client.publish(self.prefix + CHANNEL, message)
+
+    def close(self):
+        self._listener.stop()
+        self._pubsub.close()
+
+
+def open_shared_cache(url, **kwargs):
+    """Backend for ``redis://``/``rediss://`` or ``sqlite:///path`` URLs; None when ``url`` is empty"""
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSharedCache(url)
+    if url.startswith("sqlite://"):
+        return SQLiteSharedCache(os.path.expanduser(url[len("sqlite://"):]), **kwargs)
+    raise ValueError(f"Unsupported shared cache URL: {url}")
@@ -0,0 +1,367 @@
+"""Static site export: a journey as a folder anyone can open or host.
+
+Layout::
+
+    index.html                  entry point: map, timeline, loads the two assets
+    assets/journey.<hash>.js    memories, trip paths and bounds
+    assets/viewer.<hash>.js     the Leaflet viewer
+    popups/<hash>.js            one popup per memory, fetched when it's clicked
+    media/<hash>.<ext>          photos and videos, named by content
+    thumbs/<hash>.jpg           photo thumbnails (the photo itself without Pillow)
+    .export-state.json          what the last build produced, for incremental rebuilds
+
+Everything except ``index.html`` is named by a hash of its content, so a host
+can serve it with ``Cache-Control: immutable``. Files are loaded with script
+tags rather than ``fetch``, so the folder also works opened from disk.
+
+Rebuilding into the same folder only redoes what changed. Media is copied
+again when the reference is new or a local file's size/mtime changed. A
+popup is rendered again when its memory's content hash changed. Both steps
+run on a thread pool over the memories. Files no longer referenced are
+removed at the end.
+"""
+import hashlib
+import html
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+from trips import segment_trips, trip_path
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are optional
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = ".export-state.json"
+STATE_VERSION = 1
+RENDER_VERSION = "1"  # Bump when popup HTML changes, to re-render every popup
+DEFAULT_WORKERS = 8
+THUMB_SIZE = (320, 320)
+HASH_CHARS = 16
+CHUNK_SIZE = 1024 * 1024
+LEAFLET = "https://cdn.jsdelivr.net/npm/leaflet@1.9.4/dist"
+MARKERCLUSTER = "https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.5.3"
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_CHARS]
+
+
+def _write_atomic(path, data):
+    """Temp file + rename, so an interrupted build never leaves a file that looks finished"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _write_hashed(folder, prefix, ext, data):
+    """Write ``data`` as ``<prefix><hash><ext>`` (once) and return its relative name"""
+    name = f"{prefix}{_digest(data)}{ext}"
+    if not (folder / name).exists():
+        _write_atomic(folder / name, data)
+    return name
+
+
+# ==================== MEDIA ====================
+def _stamp(fetcher, ref):
+    """What identifies this version of the media: size and mtime for local files"""
+    if fetcher.is_remote(ref):
+        return None  # Uploads get unique names, so the object behind a reference doesn't change
+    st = fetcher.local_path(ref).stat()
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _thumbnail(out, media_name):
+    if Image is None:
+        return media_name
+    thumb = f"thumbs/{PurePosixPath(media_name).stem}.jpg"
+    if (out / thumb).exists():
+        return thumb
+    try:
+        with Image.open(out / media_name) as img:
+            img.thumbnail(THUMB_SIZE)
+            tmp = out / "thumbs" / f".{PurePosixPath(thumb).name}.{os.getpid()}.tmp"
+            img.convert("RGB").save(tmp, "JPEG", quality=80)
+            os.replace(tmp, out / thumb)
+        return thumb
+    except Exception as e:
+        logger.warning(f"Export: no thumbnail for {media_name}: {e}")
+        return media_name
+
+
+def _export_media(out, fetcher, ref, kind, previous):
+    """Copy one reference into media/ under its content hash; returns its state entry"""
+    stamp = _stamp(fetcher, ref)
+    if previous and previous.get("stamp") == stamp and (out / previous["file"]).exists():
+        return previous
+    ext = PurePosixPath(ref.split("?", 1)[0]).suffix.lower() or ".bin"
+    digest = hashlib.sha256()
+    with fetcher.open(ref) as src, tempfile.NamedTemporaryFile(dir=out / "media", delete=False) as tmp:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            tmp.write(chunk)
+    name = f"media/{digest.hexdigest()[:HASH_CHARS]}{ext}"
+    if (out / name).exists():
+        os.unlink(tmp.name)
+    else:
+        os.replace(tmp.name, out / name)
+    entry = {"stamp": stamp, "file": name}
+    if kind == "photos":
+        entry["thumb"] = _thumbnail(out, name)
+    return entry
+
+
+# ==================== POPUPS ====================
+def render_popup(title, description, location, date_str, photos, videos):
+    """Popup HTML for one memory; ``photos`` are (thumb, file) pairs, ``videos`` files"""
+    parts = [
+        f'<div class="popup"><h3>{html.escape(title or "Untitled")}</h3>',
+        f'<p class="meta">{html.escape(date_str)} • {html.escape(location)}</p>',
+        f'<p>{html.escape(description or "No description")}</p>',
+    ]
+    if photos:
+        parts.append('<div class="photos">')
+        parts += [f'<a href="{file}" target="_blank"><img src="{thumb}" loading="lazy"></a>'
+                  for thumb, file in photos]
+        parts.append("</div>")
+    parts += [f'<video controls preload="none" src="{file}"></video>' for file in videos]
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def _popup_script(key, popup_html):
+    return f"journeyPopup({json.dumps(key)}, {json.dumps(popup_html, ensure_ascii=False)});\n".encode("utf-8")
+
+
+# ==================== VIEWER ====================
+VIEWER_JS = """
+(function () {
+  var J = window.JOURNEY, popups = {};
+  var map = L.map("map");
+  L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
+    maxZoom: 19, attribution: "&copy; OpenStreetMap contributors"
+  }).addTo(map);
+  if (J.bounds) { map.fitBounds(J.bounds, {padding: [40, 40]}); } else { map.setView([20, 0], 2); }
+
+  J.trips.forEach(function (t) {
+    t.paths.forEach(function (p) {
+      L.polyline(p, {color: t.color, weight: 3, opacity: 0.8, smoothFactor: 1}).bindTooltip(t.label).addTo(map);
+    });
+  });
+
+  window.journeyPopup = function (key, content) {
+    popups[key] = content;
+    (waiting[key] || []).forEach(function (m) { m.setPopupContent(content); });
+    delete waiting[key];
+  };
+  var waiting = {};
+  var cluster = L.markerClusterGroup({chunkedLoading: true});
+  J.events.forEach(function (e) {
+    var m = L.circleMarker([e[0], e[1]], {radius: 7, color: "#fff", weight: 2, fillColor: e[5], fillOpacity: 0.9});
+    m.bindTooltip(function () {  // Titles are text, not HTML
+      var s = document.createElement("span");
+      s.textContent = e[2] + ". " + e[3] + " (" + e[4] + ")";
+      return s;
+    });
+    m.bindPopup("Loading…", {maxWidth: 420});
+    m.on("popupopen", function () {
+      var key = e[6];
+      if (popups[key]) { m.setPopupContent(popups[key]); return; }
+      if (!waiting[key]) {
+        waiting[key] = [];
+        var s = document.createElement("script");
+        s.src = "popups/" + key + ".js";
+        document.head.appendChild(s);
+      }
+      waiting[key].push(m);
+    });
+    cluster.addLayer(m);
+  });
+  map.addLayer(cluster);
+
+  // Timeline: a tick per memory and a band per multi-memory trip
+  var bar = document.getElementById("timeline");
+  if (J.events.length) {
+    var lo = J.span[0], width = (J.span[1] - J.span[0]) || 1;
+    var pct = function (d) { return ((d - lo) / width * 100) + "%"; };
+    var frag = document.createDocumentFragment();
+    J.trips.forEach(function (t) {
+      var b = document.createElement("div");
+      b.className = "trip"; b.title = t.label; b.style.left = pct(t.first); b.style.background = t.color;
+      b.style.width = Math.max((t.last - t.first) / width * 100, 0.4) + "%";
+      frag.appendChild(b);
+    });
+    J.events.forEach(function (e) {
+      var d = document.createElement("div");
+      d.className = "tick"; d.style.left = pct(e[7]); d.title = e[2] + ". " + e[3] + " (" + e[4] + ")";
+      d.onclick = function () { map.setView([e[0], e[1]], Math.max(map.getZoom(), 10)); };
+      frag.appendChild(d);
+    });
+    bar.appendChild(frag);
+  }
+})();
+"""
+
+INDEX_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<link rel="stylesheet" href="{leaflet}/leaflet.css">
+<link rel="stylesheet" href="{cluster}/MarkerCluster.css">
+<link rel="stylesheet" href="{cluster}/MarkerCluster.Default.css">
+<style>
+  body {{ margin: 0; font-family: sans-serif; }}
+  header {{ padding: 10px 16px; }}
+  header h1 {{ margin: 0; font-size: 1.4rem; }}
+  header p {{ margin: 4px 0 0 0; color: #555; }}
+  #timeline {{ position: relative; height: 28px; margin: 6px 16px 10px 16px;
+              background: linear-gradient(to bottom, #f0f4f8, #e0e8f0); border-radius: 8px; }}
+  #timeline .trip {{ position: absolute; top: 10px; height: 8px; border-radius: 4px; opacity: 0.6; }}
+  #timeline .tick {{ position: absolute; top: 4px; width: 2px; height: 20px; background: #333; cursor: pointer; }}
+  #map {{ height: calc(100vh - 110px); }}
+  .popup {{ max-height: 480px; overflow-y: auto; }}
+  .popup h3 {{ margin: 0 0 6px 0; text-align: center; }}
+  .popup .meta {{ color: #555; text-align: center; }}
+  .popup .photos {{ display: flex; flex-wrap: wrap; gap: 6px; justify-content: center; }}
+  .popup img {{ width: 100px; height: 100px; object-fit: cover; border-radius: 6px; }}
+  .popup video {{ max-width: 100%; border-radius: 6px; margin-top: 8px; }}
+</style>
+</head>
+<body>
+<header><h1>{title}</h1><p>{subtitle}</p></header>
+<div id="timeline"></div>
+<div id="map"></div>
+<script src="{leaflet}/leaflet.js"></script>
+<script src="{cluster}/leaflet.markercluster.js"></script>
+<script src="{data}"></script>
+<script src="{viewer}"></script>
+</body>
+</html>
+"""
+
+
+# ==================== EXPORT ====================
+def _load_state(out):
+    try:
+        state = json.loads((out / STATE_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"media": {}}
+    return state if state.get("version") == STATE_VERSION else {"media": {}}
+
+
+def _prune(out, keep):
+    """Delete generated files nothing refers to any more"""
+    removed = 0
+    for folder in ("assets", "popups", "media", "thumbs"):
+        for path in (out / folder).glob("*"):
+            if f"{folder}/{path.name}" not in keep:
+                path.unlink(missing_ok=True)
+                removed += 1
+    return removed
+
+
+def export_site(journey, out, fetcher, workers=DEFAULT_WORKERS, progress=None):
+    """Render ``journey`` into the folder ``out``, reusing what an earlier build made.
+
+    ``fetcher`` is a ``journey_archive.MediaFetcher``. ``progress(done, total)``
+    is called after each memory's popup. Returns a summary dict.
+    """
+    out = Path(out)
+    for folder in ("assets", "popups", "media", "thumbs"):
+        (out / folder).mkdir(parents=True, exist_ok=True)
+    state = _load_state(out)
+    old_media = state.get("media", {})
+    summary = {"events": len(journey), "media_copied": 0, "media_missing": [],
+               "popups_rendered": 0, "removed": 0}
+
+    # Media: every distinct reference once, in parallel
+    refs = {}
+    for i in range(len(journey)):
+        for kind, items in (("photos", journey.photos(i)), ("videos", journey.videos(i))):
+            for ref in items:
+                refs.setdefault(ref, kind)
+    media = {}
+
+    def copy(item):
+        ref, kind = item
+        try:
+            return ref, _export_media(out, fetcher, ref, kind, old_media.get(ref))
+        except Exception as e:
+            return ref, e
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="export") as pool:
+        for ref, entry in pool.map(copy, refs.items()):
+            if isinstance(entry, Exception):
+                logger.warning(f"Export: skipping unreadable media {ref}: {entry}")
+                summary["media_missing"].append(ref)
+                continue
+            media[ref] = entry
+            summary["media_copied"] += entry is not old_media.get(ref)
+
+        # Popups: named by content hash, so an unchanged memory is already on disk
+        def popup(i):
+            photos = [(media[r].get("thumb", media[r]["file"]), media[r]["file"])
+                      for r in journey.photos(i) if r in media]
+            videos = [media[r]["file"] for r in journey.videos(i) if r in media]
+            args = (journey.title(i), journey.descriptions[i], journey.location_name(i),
+                    journey.date_str(i), photos, videos)
+            key = _digest(json.dumps([RENDER_VERSION, args], ensure_ascii=False).encode("utf-8"))
+            path = out / "popups" / f"{key}.js"
+            rendered = not path.exists()
+            if rendered:
+                _write_atomic(path, _popup_script(key, render_popup(*args)))
+            return key, rendered
+
+        keys = []
+        for done, (key, rendered) in enumerate(pool.map(popup, range(len(journey))), start=1):
+            keys.append(key)
+            summary["popups_rendered"] += rendered
+            if progress is not None:
+                progress(done, len(journey))
+
+    trips = segment_trips(journey)
+    colors = [t.color for t in trips for _ in range(len(t))]  # Markers take their trip's color
+    data = {
+        "bounds": ([[float(journey.lat.min()), float(journey.lon.min())],
+                    [float(journey.lat.max()), float(journey.lon.max())]] if len(journey) else None),
+        "span": ([int(journey.ordinals[0]), int(journey.ordinals[-1])] if len(journey) else None),
+        "events": [[float(journey.lat[i]), float(journey.lon[i]), i + 1, journey.title(i) or "Untitled",
+                    journey.date_str(i), colors[i], keys[i], int(journey.ordinals[i])]
+                   for i in range(len(journey))],
+        "trips": [{"color": t.color, "label": t.label(), "first": t.first_ordinal, "last": t.last_ordinal,
+                   "paths": trip_path(journey, t)} for t in trips if len(t) > 1],
+    }
+    data_name = _write_hashed(out, "assets/journey.", ".js", (
+        "window.JOURNEY = " + json.dumps(data, ensure_ascii=False, separators=(",", ":")) + ";\n").encode("utf-8"))
+    viewer_name = _write_hashed(out, "assets/viewer.", ".js", VIEWER_JS.encode("utf-8"))
+
+    meta = journey.meta
+    title = meta.get("title") or "My Life Journey"
+    years = journey.year_range()
+    subtitle = f"{len(journey)} memories" + (f" • {years[0]}–{years[1]}" if years else "")
+    page = INDEX_HTML.format(title=html.escape(title), subtitle=html.escape(subtitle), leaflet=LEAFLET,
+                             cluster=MARKERCLUSTER, data=data_name, viewer=viewer_name)
+    if not (out / "index.html").exists() or (out / "index.html").read_bytes() != page.encode("utf-8"):
+        _write_atomic(out / "index.html", page.encode("utf-8"))
+
+    keep = {data_name, viewer_name}
+    keep.update(f"popups/{k}.js" for k in keys)
+    for entry in media.values():
+        keep.add(entry["file"])
+        keep.add(entry.get("thumb", entry["file"]))
+    summary["removed"] = _prune(out, keep)
+
+    state = {"version": STATE_VERSION, "media": media}
+    _write_atomic(out / STATE_FILE, json.dumps(state, indent=1, ensure_ascii=False).encode("utf-8"))
+    logger.info(f"🌐 Exported {len(journey)} memories to {out}: {summary['popups_rendered']} popups rendered, "
+                f"{summary['media_copied']} media copied, {summary['removed']} stale files removed")
+    return summary
+
@@ -0,0 +1,50 @@
+import threading
+
+from journey_history import JourneyHistory, LocalHistoryFiles
+from journey_model import Journey, default_journey_dict
+
+
+def _event(i, title="t"):
+    return {"id": i, "title": title, "date": f"2020-01-{i:02d}", "description": "",
+            "location": {"name": "here", "latitude": 1.0, "longitude": 2.0},
+            "media": {"photos": [], "videos": []}}
+
+
+def _journey(*events):
+    data = default_journey_dict("History")
+    data["events"] = list(events)
+    return Journey.from_dict(data)
+
+
+def test_concurrent_creates_claim_a_version_once(tmp_path):
+    files, ref = LocalHistoryFiles(), str(tmp_path / "j.json")
+    barrier, results = threading.Barrier(8), []
+
+    def create(i):
+        barrier.wait()
+        results.append(files.create(ref, "00000002.json", str(i).encode()))
+
+    threads = [threading.Thread(target=create, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(True) == 1
+
+
+def test_delta_and_checkpoint_racing_for_a_version_both_survive(tmp_path):
+    ref = str(tmp_path / "j.json")
+    base = _journey(*(_event(i) for i in range(1, 21)))
+    ours = _journey(*(_event(i) for i in range(1, 21)), _event(21))
+    theirs = _journey(*(_event(i, "renamed") for i in range(1, 21)))
+    small = JourneyHistory(LocalHistoryFiles())
+    big = JourneyHistory(LocalHistoryFiles(), checkpoint_ratio=0)  # Always writes checkpoints
+    small.record(ref, base).result()
+    big.record(ref, base).result()  # Unchanged: both now know v1 as their head
+
+    small.record(ref, ours).result()  # v2, a delta
+    big.record(ref, theirs).result()  # Its v2 checkpoint is refused, so it becomes v3
+
+    assert [v.number for v in small.versions(ref)] == [3, 2, 1]
+    assert small.load(ref, 2)[0] == ours.to_dict()
+    assert small.load(ref, 3)[0] == theirs.to_dict()
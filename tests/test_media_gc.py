@@ -0,0 +1,31 @@
+import json
+import os
+from pathlib import Path
+
+import journey_cli
+from journey_model import default_journey_dict
+
+
+def _journey(photos):
+    data = default_journey_dict("GC")
+    data["events"] = [{"id": 1, "title": "t", "date": "2020-01-01", "description": "",
+                       "location": {"name": "here", "latitude": 1.0, "longitude": 2.0},
+                       "media": {"photos": photos, "videos": []}}]
+    return json.dumps(data)
+
+
+def test_relative_data_dir_keeps_referenced_uploads(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    photos = Path("data/uploads/photos")
+    photos.mkdir(parents=True)
+    for name in ("relative.jpg", "absolute.jpg", "orphan.jpg"):
+        (photos / name).write_bytes(b"x")
+        os.utime(photos / name, (0, 0))  # Old enough to be collected
+    Path("data/j.json").write_text(_journey(["uploads/photos/relative.jpg",
+                                             str((photos / "absolute.jpg").resolve())]))
+
+    assert journey_cli.main(["--data-dir", "data", "media", "gc", "--min-age-hours", "0"]) == 0
+    out = capsys.readouterr().out
+    orphans = [line for line in out.splitlines() if "orphan:" in line]
+    assert len(orphans) == 1 and orphans[0].endswith("orphan.jpg")
+    assert "1 orphans" in out
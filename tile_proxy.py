@@ -0,0 +1,191 @@
+"""Optional local proxy for map tiles.
+
+Browsers fetch ``/tiles/{z}/{x}/{y}.png`` from this proxy instead of from
+OpenStreetMap directly. Tiles are kept in a ``DiskBlobCache`` (LRU by last
+access, bounded in bytes), so repeat views of a journey load from local disk
+and the upstream server sees each tile at most once per ``max_age``. If
+upstream is down, a stale copy is served. Misses are fetched on a small
+thread pool, and concurrent requests for the same tile share one upstream
+fetch.
+
+``prefetch`` warms the tiles covering a journey's bounds at the zoom the map
+will open at and a couple around it. The count is capped: the OSM tile
+policy forbids bulk downloading. Point ``upstream`` at your own or a
+commercial tile server for anything heavier.
+"""
+import logging
+import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from blob_cache import DiskBlobCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAM = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 7 * 24 * 3600  # OSM asks clients to keep tiles at least a week
+DEFAULT_WORKERS = 2  # OSM allows two connections per client
+MAX_ZOOM = 19
+MAX_PREFETCH_TILES = 200
+USER_AGENT = "MyLifeJourney-TileProxy/1.0"
+_TILE_PATH = re.compile(r"^/tiles/(\d+)/(\d+)/(\d+)\.png$")
+
+
+# ==================== TILE MATH ====================
+def tile_xy(lat, lon, zoom):
+    """Web Mercator tile containing the point"""
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 1 << zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bounds(bounds, zoom):
+    """Every (x, y) at ``zoom`` covering ``[[south, west], [north, east]]``"""
+    (south, west), (north, east) = bounds
+    x0, y0 = tile_xy(north, west, zoom)
+    x1, y1 = tile_xy(south, east, zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def fit_zoom(bounds, width=1200, height=800):
+    """Zoom Leaflet's fit_bounds would roughly pick for a map of this size"""
+    (south, west), (north, east) = bounds
+    for zoom in range(MAX_ZOOM, -1, -1):
+        x0, y0 = tile_xy(north, west, zoom)
+        x1, y1 = tile_xy(south, east, zoom)
+        if (x1 - x0 + 1) * 256 <= width and (y1 - y0 + 1) * 256 <= height:
+            return zoom
+    return 0
+
+
+# ==================== PROXY ====================
+class TileProxy:
+    """Cache + upstream fetcher; ``serve`` exposes it over HTTP"""
+
+    def __init__(self, cache_dir, upstream=DEFAULT_UPSTREAM, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE, workers=DEFAULT_WORKERS, timeout=10.0):
+        self.cache = DiskBlobCache(cache_dir, max_bytes=max_bytes)
+        self.upstream = upstream
+        self.max_age = max_age
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tiles")
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.server = None
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+        return session
+
+    def _download(self, z, x, y):
+        resp = self._session().get(self.upstream.format(z=z, x=x, y=y), timeout=self.timeout)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.content
+
+    def _fetch(self, key, z, x, y):
+        try:
+            data = self._download(z, x, y)
+            if data is not None:
+                self.cache.store(key, 0, data)
+            return data
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _submit(self, key, z, x, y):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = self._pool.submit(self._fetch, key, z, x, y)
+            return future
+
+    def get(self, z, x, y):
+        """Tile bytes, or None if upstream has no such tile"""
+        key = f"{z}/{x}/{y}"
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            _, path, fetched_at = cached
+            if (fetched_at or 0) + self.max_age > time.time():
+                self.cache.touch(key)
+                return path.read_bytes()
+        try:
+            return self._submit(key, z, x, y).result()
+        except Exception as e:
+            if cached is not None:
+                logger.warning(f"🗺️ Upstream failed for tile {key}, serving stale copy: {e}")
+                return cached[1].read_bytes()
+            raise
+
+    def prefetch(self, bounds, zooms=None, limit=MAX_PREFETCH_TILES):
+        """Queue missing tiles covering ``bounds``; returns how many were queued"""
+        if zooms is None:
+            zoom = fit_zoom(bounds)
+            zooms = range(max(zoom - 1, 0), min(zoom + 2, MAX_ZOOM) + 1)
+        missing = [(z, x, y) for z in zooms for x, y in tiles_for_bounds(bounds, z)
+                   if self.cache.lookup(f"{z}/{x}/{y}") is None][:limit]
+        for z, x, y in missing:
+            self._submit(f"{z}/{x}/{y}", z, x, y)
+        queued = len(missing)
+        if queued:
+            logger.info(f"🗺️ Prefetching {queued} tiles")
+        return queued
+
+    # ==================== HTTP ====================
+    def serve(self, host="0.0.0.0", port=8765):
+        """Start the HTTP server in a daemon thread; returns the server"""
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = _TILE_PATH.match(self.path.split("?", 1)[0])
+                if not match:
+                    self.send_error(404)
+                    return
+                z, x, y = (int(v) for v in match.groups())
+                if z > MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+                    self.send_error(404)
+                    return
+                try:
+                    data = proxy.get(z, x, y)
+                except Exception as e:
+                    self.send_error(502, str(e))
+                    return
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Cache-Control", "public, max-age=86400")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="tile-proxy", daemon=True).start()
+        logger.info(f"🗺️ Tile proxy listening on {host}:{self.server.server_port}")
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
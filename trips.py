@@ -0,0 +1,119 @@
+"""Split a journey into trips.
+
+Consecutive memories (in date order) belong to the same trip while they are
+close in space-time: ``gap_days / TRIP_GAP_DAYS + jump_km / TRIP_JUMP_KM``
+stays at or below 1. That is DBSCAN with a space-time radius and a minimum
+of one point, run along the time-sorted chain, so it is a single vectorised
+pass over the date and coordinate columns. A long pause or a big jump (home
+in Portland, then a week in Tokyo) starts a new trip.
+
+``segment_trips`` is memoised per ``Journey`` snapshot. Each trip's drawn
+path is cached by the trip's own coordinates, so after an edit only the
+trips whose memories changed are interpolated again.
+"""
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from geodesic import great_circle_path
+from journey_analytics import leg_distances
+from journey_model import ordinal_to_date
+
+TRIP_GAP_DAYS = 10.0
+TRIP_JUMP_KM = 1500.0
+TRIP_COLORS = ("#50E3C2", "#F5A623", "#BD10E0", "#4A90E2", "#7ED321", "#D0021B", "#9013FE", "#F8E71C")
+PATH_CACHE_ENTRIES = 4096
+
+_memo = weakref.WeakKeyDictionary()  # Journey -> (gap_days, jump_km) -> trips
+_paths = OrderedDict()  # trip key -> segments, LRU shared by every journey
+_lock = threading.Lock()
+
+
+class Trip:
+    """Rows ``start:stop`` of a journey (date order)"""
+
+    __slots__ = ("index", "start", "stop", "first_ordinal", "last_ordinal", "km", "key")
+
+    def __init__(self, index, start, stop, first_ordinal, last_ordinal, km, key):
+        self.index = index
+        self.start = start
+        self.stop = stop
+        self.first_ordinal = first_ordinal
+        self.last_ordinal = last_ordinal
+        self.km = km
+        self.key = key
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def color(self):
+        return TRIP_COLORS[self.index % len(TRIP_COLORS)]
+
+    def label(self):
+        first, last = ordinal_to_date(self.first_ordinal), ordinal_to_date(self.last_ordinal)
+        dates = first if first == last else f"{first} – {last}"
+        memories = "1 memory" if len(self) == 1 else f"{len(self)} memories"
+        return f"Trip {self.index + 1}: {dates} • {memories} • {self.km:,.0f} km"
+
+
+def trip_starts(journey, gap_days=TRIP_GAP_DAYS, jump_km=TRIP_JUMP_KM):
+    """First row of every trip"""
+    if len(journey) < 2:
+        return np.zeros(min(len(journey), 1), dtype=np.int64)
+    gaps = np.diff(journey.ordinals.astype(np.int64))
+    reach = gaps / gap_days + leg_distances(journey) / jump_km
+    return np.concatenate(([0], np.flatnonzero(reach > 1.0) + 1))
+
+
+def _trip_key(journey, start, stop):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(journey.lat[start:stop].tobytes())
+    h.update(journey.lon[start:stop].tobytes())
+    return h.digest()
+
+
+def _segment(journey, gap_days, jump_km):
+    starts = trip_starts(journey, gap_days, jump_km)
+    stops = np.append(starts[1:], len(journey))
+    legs = leg_distances(journey)
+    # km within each trip: all legs from its first row up to (not including) its last
+    cum = np.concatenate(([0.0], np.cumsum(legs)))
+    km = cum[stops - 1] - cum[starts]
+    return tuple(
+        Trip(i, int(a), int(b), int(journey.ordinals[a]), int(journey.ordinals[b - 1]), float(k),
+             _trip_key(journey, a, b))
+        for i, (a, b, k) in enumerate(zip(starts.tolist(), stops.tolist(), km.tolist()))
+    )
+
+
+def segment_trips(journey, gap_days=TRIP_GAP_DAYS, jump_km=TRIP_JUMP_KM):
+    """Tuple of ``Trip`` in date order, memoised per snapshot"""
+    if not len(journey):
+        return ()
+    params = (gap_days, jump_km)
+    with _lock:
+        cached = _memo.get(journey, {}).get(params)
+    if cached is None:
+        cached = _segment(journey, gap_days, jump_km)
+        with _lock:
+            _memo.setdefault(journey, {})[params] = cached
+    return cached
+
+
+def trip_path(journey, trip):
+    """Great-circle segments for one trip, reused while its memories don't move"""
+    with _lock:
+        segments = _paths.get(trip.key)
+        if segments is not None:
+            _paths.move_to_end(trip.key)
+            return segments
+    segments = great_circle_path(journey.lat[trip.start:trip.stop], journey.lon[trip.start:trip.stop])
+    with _lock:
+        _paths[trip.key] = segments
+        while len(_paths) > PATH_CACHE_ENTRIES:
+            _paths.popitem(last=False)
+    return segments
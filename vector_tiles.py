@@ -0,0 +1,449 @@
+"""Mapbox Vector Tiles for large journeys.
+
+Folium writes every marker and path vertex into the page. For a journey with
+tens of thousands of memories, the map instead loads ``/mvt/{token}/{z}/{x}/{y}.pbf``
+from a small local HTTP server and draws only the tiles in view.
+
+Each registered journey snapshot gets an in-memory index:
+
+* memories sorted by Morton code (Z-order) of their Web Mercator position,
+  so any tile is a contiguous range found with two binary searches;
+* the great-circle trip paths from ``trips.trip_path`` as one flat vertex
+  array, with per-segment bounding boxes.
+
+A tile holds two layers. ``events`` has one point per screen pixel, with a
+``count`` where memories overlap, coarsened further until it holds at most
+``MAX_POINTS_PER_TILE`` points. ``tracks`` has the trip paths clipped to
+the tile plus a small buffer. Encoded tiles are kept in a byte-bounded LRU.
+Snapshots are immutable, so the browser may also cache a tile for as long
+as it likes.
+
+The protobuf encoding is written out here (the MVT schema is four small
+messages), so no extra dependency is needed.
+"""
+import gzip
+import logging
+import re
+import secrets
+import threading
+import weakref
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from heatmap import _mercator
+from trips import segment_trips, trip_path
+
+logger = logging.getLogger(__name__)
+
+EXTENT = 4096
+BUFFER = 64  # Extent units drawn beyond each tile edge, so strokes aren't cut off
+POINT_CELL = EXTENT // 256  # One screen pixel
+TRACK_SNAP = 4  # Track vertices are snapped to a quarter pixel, then deduplicated
+MAX_POINTS_PER_TILE = 5000
+MAX_ZOOM = 20
+INDEX_BITS = 24  # Morton index resolution per axis (~2.4 m at the equator)
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_JOURNEYS = 16
+_TILE_PATH = re.compile(r"^/mvt/([A-Za-z0-9_-]+)/(\d+)/(\d+)/(\d+)\.pbf$")
+
+
+# ==================== PROTOBUF ====================
+def _varint(n):
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def _bytes_field(num, data):
+    return _varint(num << 3 | 2) + _varint(len(data)) + data
+
+
+def _uint_field(num, value):
+    return _varint(num << 3) + _varint(value)
+
+
+def _varints(values):
+    """Varint encoding of a whole non-negative integer array at once"""
+    v = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += v >= np.uint64(1 << (7 * k))
+    width = int(nbytes.max()) if len(v) else 1
+    groups = ((v[:, None] >> (np.arange(width, dtype=np.uint64) * np.uint64(7))) & np.uint64(0x7F)).astype(np.uint8)
+    column = np.arange(width)
+    groups[column < nbytes[:, None] - 1] |= 0x80
+    return groups[column < nbytes[:, None]].tobytes()
+
+
+def _packed(num, values):
+    if isinstance(values, np.ndarray):
+        return _bytes_field(num, _varints(values))
+    return _bytes_field(num, b"".join(_varint(v) for v in values))
+
+
+def _value(v):
+    """One ``Tile.Value`` message"""
+    if isinstance(v, bool):
+        return _uint_field(7, int(v))
+    if isinstance(v, int):
+        return _uint_field(5, v) if v >= 0 else _uint_field(6, _zigzag(v))
+    if isinstance(v, float):
+        return _varint(3 << 3 | 1) + np.float64(v).tobytes()
+    return _bytes_field(1, str(v).encode("utf-8"))
+
+
+def _command(cmd, count):
+    return (cmd & 0x7) | (count << 3)
+
+
+def point_geometry(x, y):
+    return [_command(1, 1), _zigzag(x), _zigzag(y)]
+
+
+def line_geometry(xs, ys, part):
+    """(Multi)LineString command array; ``part`` numbers each vertex's line, in runs.
+
+    Every part is a MoveTo to its first vertex and a LineTo through the rest,
+    all as deltas from the previous vertex (the cursor carries across parts).
+    """
+    dx = np.diff(xs, prepend=0)
+    dy = np.diff(ys, prepend=0)
+    pairs = np.column_stack(((dx << 1) ^ (dx >> 63), (dy << 1) ^ (dy >> 63))).ravel()
+    starts = np.flatnonzero(np.diff(part, prepend=part[0] - 1) != 0)
+    lengths = np.diff(np.append(starts, len(xs)))
+    at = np.column_stack((2 * starts, 2 * starts + 2)).ravel()
+    commands = np.column_stack((np.full(len(starts), _command(1, 1)), (lengths - 1) << 3 | 2)).ravel()
+    return np.insert(pairs, at, commands)
+
+
+class LayerBuilder:
+    """Collects features for one ``Tile.Layer``, sharing its key/value tables"""
+
+    __slots__ = ("name", "keys", "values", "features")
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def add(self, geom_type, geometry, properties):
+        tags = []
+        for k, v in properties.items():
+            tags.append(self.keys.setdefault(k, len(self.keys)))
+            tags.append(self.values.setdefault((type(v), v), len(self.values)))
+        self.features.append(_packed(2, tags) + _uint_field(3, geom_type) + _packed(4, geometry))
+
+    def encode(self):
+        out = [_uint_field(15, 2), _bytes_field(1, self.name.encode("utf-8"))]
+        out += [_bytes_field(2, f) for f in self.features]
+        out += [_bytes_field(3, k.encode("utf-8")) for k in self.keys]
+        out += [_bytes_field(4, _value(v)) for _, v in self.values]
+        out.append(_uint_field(5, EXTENT))
+        return _bytes_field(3, b"".join(out))
+
+
+# ==================== SPATIAL INDEX ====================
+def _spread_bits(v):
+    v = v.astype(np.uint64)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton(ix, iy):
+    """Z-order code interleaving the bits of two integer arrays"""
+    return _spread_bits(ix) | (_spread_bits(iy) << np.uint64(1))
+
+
+def _clip_segments(x0, y0, x1, y1, box):
+    """Liang–Barsky: parameters (t0, t1) of each segment inside ``box``; t0 > t1 if outside"""
+    bx0, by0, bx1, by1 = box
+    dx, dy = x1 - x0, y1 - y0
+    t0 = np.zeros(len(x0))
+    t1 = np.ones(len(x0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, x0 - bx0), (dx, bx1 - x0), (-dy, y0 - by0), (dy, by1 - y0)):
+            r = q / p
+            parallel = p == 0
+            t1[parallel & (q < 0)] = -1.0  # Parallel to this edge and outside it
+            entering = ~parallel & (p < 0)
+            leaving = ~parallel & (p > 0)
+            t0 = np.where(entering, np.maximum(t0, r), t0)
+            t1 = np.where(leaving, np.minimum(t1, r), t1)
+    return t0, t1
+
+
+class JourneyTileIndex:
+    """Everything needed to cut one journey snapshot into tiles"""
+
+    def __init__(self, journey, year_color=None):
+        x, y = _mercator(journey.lat, journey.lon)
+        scale = float(1 << INDEX_BITS)
+        codes = morton((x * scale).astype(np.int64), (y * scale).astype(np.int64))
+        order = np.argsort(codes, kind="stable")
+        self.journey = journey
+        self.codes = codes[order]
+        self.rows = order
+        self.x, self.y = x[order], y[order]
+
+        years, year_idx = np.unique(journey.years(), return_inverse=True)
+        self.palette = [year_color(int(y)) if year_color else "#4A90E2" for y in years.tolist()]
+        self.color = year_idx.ravel()[order]
+
+        # Trip paths: vertices of every polyline back to back; segment k joins vertex k and k+1
+        # (a trip crossing the antimeridian is several polylines, drawn as one feature)
+        vx, vy, line_of, line_trip, self.trips = [], [], [], [], []
+        for trip in segment_trips(journey):
+            if len(trip) < 2:
+                continue
+            for segment in trip_path(journey, trip):
+                if len(segment) < 2:
+                    continue
+                lat, lon = np.asarray(segment, dtype=np.float64).T
+                px, py = _mercator(lat, lon)
+                vx.append(px)
+                vy.append(py)
+                line_of.append(np.full(len(px), len(line_trip)))
+                line_trip.append(len(self.trips))
+            self.trips.append({"trip": trip.index + 1, "color": trip.color, "label": trip.label()})
+        if line_trip:
+            self.vx, self.vy = np.concatenate(vx), np.concatenate(vy)
+            line_of = np.concatenate(line_of)
+            self.seg = np.flatnonzero(line_of[:-1] == line_of[1:])
+            self.seg_line = line_of[self.seg]
+            self.line_trip = np.array(line_trip)
+            a, b = self.seg, self.seg + 1
+            self.seg_box = (np.minimum(self.vx[a], self.vx[b]), np.minimum(self.vy[a], self.vy[b]),
+                            np.maximum(self.vx[a], self.vx[b]), np.maximum(self.vy[a], self.vy[b]))
+        else:
+            self.seg = np.zeros(0, dtype=np.int64)
+
+    def _point_rows(self, z, tx, ty, box):
+        """Positions (into the sorted arrays) of memories inside ``box``, via Morton ranges"""
+        n = 1 << z
+        shift = np.uint64(2 * (INDEX_BITS - z))
+        found = []
+        for nx in range(max(tx - 1, 0), min(tx + 1, n - 1) + 1):
+            for ny in range(max(ty - 1, 0), min(ty + 1, n - 1) + 1):
+                lo = morton(np.array([nx]), np.array([ny]))[0] << shift
+                hi = lo + (np.uint64(1) << shift)
+                a, b = np.searchsorted(self.codes, [lo, hi])
+                if b > a:
+                    found.append(np.arange(a, b))
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        idx = np.concatenate(found)
+        x0, y0, x1, y1 = box
+        inside = (self.x[idx] >= x0) & (self.x[idx] <= x1) & (self.y[idx] >= y0) & (self.y[idx] <= y1)
+        return idx[inside]
+
+    def _events_layer(self, z, tx, ty, box):
+        layer = LayerBuilder("events")
+        idx = self._point_rows(z, tx, ty, box)
+        if not len(idx):
+            return layer
+        qx = np.round((self.x[idx] * (1 << z) - tx) * EXTENT).astype(np.int64)
+        qy = np.round((self.y[idx] * (1 << z) - ty) * EXTENT).astype(np.int64)
+        cell = POINT_CELL
+        while True:
+            keys = ((qx // cell + EXTENT) << 20) | (qy // cell + EXTENT)
+            uniq, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            if len(uniq) <= MAX_POINTS_PER_TILE or cell >= EXTENT:
+                break
+            cell *= 2
+        # Each pixel is drawn at, and named after, its earliest memory
+        inverse = inverse.ravel()
+        order = np.lexsort((self.rows[idx], inverse))
+        first = order[np.searchsorted(inverse[order], np.arange(len(uniq)))]
+        journey = self.journey
+        for p, count in zip(first.tolist(), counts.tolist()):
+            row = int(self.rows[idx[p]])
+            props = {"n": row + 1, "color": self.palette[self.color[idx[p]]],
+                     "title": journey.title(row) or "Untitled", "date": journey.date_str(row)}
+            if count > 1:
+                props["count"] = count
+            layer.add(1, point_geometry(int(qx[p]), int(qy[p])), props)
+        return layer
+
+    def _tracks_layer(self, z, tx, ty, box):
+        layer = LayerBuilder("tracks")
+        if not len(self.seg):
+            return layer
+        x0, y0, x1, y1 = box
+        bx0, by0, bx1, by1 = self.seg_box
+        hit = np.flatnonzero((bx1 >= x0) & (bx0 <= x1) & (by1 >= y0) & (by0 <= y1))
+        if not len(hit):
+            return layer
+        a = self.seg[hit]
+        sx0, sy0, sx1, sy1 = self.vx[a], self.vy[a], self.vx[a + 1], self.vy[a + 1]
+        t0, t1 = _clip_segments(sx0, sy0, sx1, sy1, box)
+        keep = t0 <= t1
+        hit, a, t0, t1 = hit[keep], a[keep], t0[keep], t1[keep]
+        if not len(hit):
+            return layer
+        sx0, sy0, sx1, sy1 = self.vx[a], self.vy[a], self.vx[a + 1], self.vy[a + 1]
+        start_x, start_y = sx0 + t0 * (sx1 - sx0), sy0 + t0 * (sy1 - sy0)
+        end_x, end_y = sx0 + t1 * (sx1 - sx0), sy0 + t1 * (sy1 - sy0)
+        # A run continues while segments are consecutive, on one line and unclipped where they meet
+        joined = (np.diff(hit) == 1) & (np.diff(self.seg_line[hit]) == 0) & (t1[:-1] >= 1) & (t0[1:] <= 0)
+        runs = np.flatnonzero(np.concatenate(([True], ~joined)))
+        run_len = np.diff(np.append(runs, len(hit))) + 1
+
+        # Vertices of every run: its clipped start, then the (clipped) end of each segment
+        snap = lambda v, origin: (np.round((v * (1 << z) - origin) * EXTENT / TRACK_SNAP) * TRACK_SNAP).astype(np.int64)
+        xs = snap(np.insert(end_x, runs, start_x[runs]), tx)
+        ys = snap(np.insert(end_y, runs, start_y[runs]), ty)
+        run = np.repeat(np.arange(len(runs)), run_len)
+        moved = np.concatenate(([True], (np.diff(xs) != 0) | (np.diff(ys) != 0) | (np.diff(run) != 0)))
+        xs, ys, run = xs[moved], ys[moved], run[moved]
+        visible = np.bincount(run, minlength=len(runs)) >= 2
+        keep = visible[run]
+        xs, ys, run = xs[keep], ys[keep], run[keep]
+        if not len(xs):
+            return layer
+
+        # One MultiLineString feature per trip
+        trip = self.line_trip[self.seg_line[hit[runs]]][run]
+        order = np.argsort(trip, kind="stable")
+        xs, ys, run, trip = xs[order], ys[order], run[order], trip[order]
+        bounds = np.flatnonzero(np.diff(trip, prepend=-1) != 0)
+        for a, b in zip(bounds.tolist(), np.append(bounds[1:], len(trip)).tolist()):
+            layer.add(2, line_geometry(xs[a:b], ys[a:b], run[a:b]), self.trips[int(trip[a])])
+        return layer
+
+    def tile(self, z, tx, ty):
+        """Encoded (uncompressed) MVT bytes for tile ``z/tx/ty``"""
+        span = 1.0 / (1 << z)
+        pad = span * BUFFER / EXTENT
+        box = (tx * span - pad, ty * span - pad, (tx + 1) * span + pad, (ty + 1) * span + pad)
+        layers = [self._tracks_layer(z, tx, ty, box), self._events_layer(z, tx, ty, box)]
+        return b"".join(layer.encode() for layer in layers if layer.features)
+
+
+# ==================== TILE SOURCE ====================
+class VectorTileSource:
+    """Registered journey snapshots, their indexes and an LRU of encoded tiles"""
+
+    def __init__(self, max_journeys=DEFAULT_MAX_JOURNEYS, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.max_journeys = max_journeys
+        self.cache_bytes = cache_bytes
+        self._tokens = weakref.WeakKeyDictionary()  # Journey -> token
+        self._journeys = OrderedDict()  # token -> [journey, year_color, index or None]
+        self._tiles = OrderedDict()  # (token, z, x, y) -> gzipped bytes
+        self._tile_bytes = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.server = None
+
+    def register(self, journey, year_color=None):
+        """Token naming this snapshot in tile URLs; the index is built on first use"""
+        with self._lock:
+            token = self._tokens.get(journey)
+            if token is None:
+                token = self._tokens[journey] = secrets.token_urlsafe(12)
+            if token not in self._journeys:
+                self._journeys[token] = [journey, year_color, None]
+            self._journeys.move_to_end(token)
+            while len(self._journeys) > self.max_journeys:
+                old, _ = self._journeys.popitem(last=False)
+                self._drop_tiles(old)
+        return token
+
+    def _drop_tiles(self, token):
+        for key in [k for k in self._tiles if k[0] == token]:
+            self._tile_bytes -= len(self._tiles.pop(key))
+
+    def _index(self, token):
+        with self._lock:
+            entry = self._journeys.get(token)
+        if entry is None:
+            return None
+        if entry[2] is None:
+            with self._build_lock:
+                if entry[2] is None:
+                    entry[2] = JourneyTileIndex(entry[0], entry[1])
+                    logger.info(f"🧭 Built vector tile index for {len(entry[0])} memories")
+        return entry[2]
+
+    def tile(self, token, z, x, y):
+        """Gzipped MVT bytes, or None for an unknown (or expired) token"""
+        key = (token, z, x, y)
+        with self._lock:
+            data = self._tiles.get(key)
+            if data is not None:
+                self._tiles.move_to_end(key)
+                return data
+        index = self._index(token)
+        if index is None:
+            return None
+        data = gzip.compress(index.tile(z, x, y), compresslevel=6)
+        with self._lock:
+            if token in self._journeys and key not in self._tiles:
+                self._tiles[key] = data
+                self._tile_bytes += len(data)
+                while self._tile_bytes > self.cache_bytes and self._tiles:
+                    _, old = self._tiles.popitem(last=False)
+                    self._tile_bytes -= len(old)
+        return data
+
+    # ==================== HTTP ====================
+    def serve(self, host="0.0.0.0", port=8766):
+        """Start the HTTP server in a daemon thread; returns the server"""
+        source = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = _TILE_PATH.match(self.path.split("?", 1)[0])
+                if not match:
+                    self.send_error(404)
+                    return
+                token = match.group(1)
+                z, x, y = (int(v) for v in match.groups()[1:])
+                if z > MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+                    self.send_error(404)
+                    return
+                try:
+                    data = source.tile(token, z, x, y)
+                except Exception as e:
+                    logger.error(f"❌ Vector tile {z}/{x}/{y} failed: {e}")
+                    self.send_error(500)
+                    return
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    self.send_header("Content-Encoding", "gzip")
+                else:
+                    data = gzip.decompress(data)
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Cache-Control", "private, max-age=31536000, immutable")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="vector-tiles", daemon=True).start()
+        logger.info(f"🧭 Vector tile server listening on {host}:{self.server.server_port}")
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()